@@ -1,26 +1,99 @@
 # file: app/main.py
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import hmac
+import json
 import os
+import threading
+import time
+import numpy as np
 
-from .utils.vector_db import query_recipes  # Vector DB
+from .utils.vector_db import (  # Vector DB
+    query_recipes, query_recipes_batch, build_where, normalize_pantry, catalog_version,
+    get_ingredient_index, warm_up, warmup_state, is_ready, embedding_cache_stats, embedding_batcher_stats,
+    base_instructions, get_substitution_table, update_catalog, RETRIEVAL_MODE, SUBSTITUTIONS_SOURCE
+)
+from .utils.cache import LRUCache
+from .utils.metrics import registry, timed, COUNT_BUCKETS
 
 # Optional: Ollama LLM helper
 try:
-    from .utils.llm_helper import generate_recipe_details
+    from .utils.llm_helper import (
+        generate_recipe_details, generate_batch_details, generate_substitutions, missing_ingredients,
+        get_enrichment_cache
+    )
+    from .utils.llm_client import get_llm_client
     LLM_AVAILABLE = True
 except ImportError:
     LLM_AVAILABLE = False
 
+# LLM enrichment limits (how many Ollama calls run at once, per-recipe timeout,
+# and the total time budget for enriching one request)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+# Ollama calls run on their own pool, shared by all requests: at most LLM_CONCURRENCY calls run
+# at once process-wide, and a slow Ollama can't starve retrieval in the default executor.
+# A call that timed out keeps its thread (and slot) until it really returns.
+llm_executor = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY, thread_name_prefix="llm")
+# "per-recipe": one prompt per recipe; "batch": one prompt covering all of a request's recipes
+LLM_ENRICH_MODE = os.getenv("LLM_ENRICH_MODE", "per-recipe").lower()
+
+# Candidates fetched from the vector DB per request. Hybrid retrieval (RETRIEVAL_MODE=hybrid)
+# already puts exact-ingredient matches first, so a smaller value (e.g. 20) keeps the same quality.
+CANDIDATE_TOP_K = int(os.getenv("CANDIDATE_TOP_K", "50"))
+
+# Cache of final /recommend-recipes payloads (entries are tied to the catalog version)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "900"))
+response_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+
+def cache_hit_ratios():
+    """Hit ratio per cache tier, read by the `cache_hit_ratio` gauge at scrape time."""
+    embedding = embedding_cache_stats()
+    ratios = {
+        (("cache", "response"),): response_cache.stats()["hit_ratio"],
+        (("cache", "embedding_memory"),): embedding["memory"]["hit_ratio"],
+        (("cache", "embedding_shared"),): embedding["shared"]["hit_ratio"] if embedding["shared"] else None
+    }
+    enrichment_cache = get_enrichment_cache(create=False) if LLM_AVAILABLE else None
+    if enrichment_cache is not None:
+        ratios[(("cache", "llm_enrichment"),)] = enrichment_cache.stats()["hit_ratio"]
+    return ratios
+
+
+registry.gauge("cache_hit_ratio", cache_hit_ratios, "Hit ratio per cache tier since startup")
+
+# Shared secret for the catalog write endpoints (/recipes), sent as X-Catalog-Token;
+# empty = the write endpoints are disabled (503)
+CATALOG_API_TOKEN = os.getenv("CATALOG_API_TOKEN", "")
+
+# Load the embedding model / Chroma in a background thread at startup (see /ready)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
 # -----------------------------
 # FastAPI setup
 # -----------------------------
-app = FastAPI(title="Recipe Recommender API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so uvicorn binds immediately; requests arriving
+    # earlier still work, they just load the model on first use.
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="Recipe Recommender API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +114,32 @@ def index():
 def health_check():
     return {"status": "ok", "message": "API is running"}
 
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 200 once the model, vector DB and indexes are loaded, 503 before."""
+    status_code = 200 if is_ready() else 503
+    return JSONResponse(status_code=status_code, content=dict(warmup_state))
+
+
+@app.get("/stats")
+def stats():
+    """Cache hit ratios and embedding micro-batching histograms, for tuning."""
+    enrichment_cache = get_enrichment_cache(create=False) if LLM_AVAILABLE else None
+    return {
+        "response_cache": response_cache.stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "embedding_batcher": embedding_batcher_stats(),
+        "llm_cache": enrichment_cache.stats() if enrichment_cache is not None else None,
+        "llm_client": get_llm_client().stats() if LLM_AVAILABLE else None
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: stage latencies, candidate counts, LLM outcomes, cache hit ratios."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # -----------------------------
 # Request model
 # -----------------------------
@@ -51,111 +150,664 @@ class RecipeRequest(BaseModel):
     time_available: Optional[int] = None
     servings_required: Optional[int] = None
 
+# -----------------------------
+# Scoring & enrichment helpers
+# -----------------------------
+def score_candidates(top_recipes, request: RecipeRequest):
+    """Filter candidates by the request and score them by pantry match (parsing the metadata strings)."""
+    has_diet = bool(request.diet and request.diet.strip())
+    has_cuisine = bool(request.cuisine and request.cuisine.strip())
+    has_time = bool(request.time_available)
+
+    scored_recipes = []
+
+    for r in top_recipes:
+        # Ingredient match
+        recipe_ingredients = [ing.strip().lower() for ing in r.get("ingredients", "").split(",")]
+        match_count = sum(1 for item in request.pantry_items if item.lower() in recipe_ingredients)
+        if match_count == 0:
+            continue
+
+        # --- Apply strict filtering for filled fields only ---
+        if request.servings_required and r.get("servings", 0) != request.servings_required:
+            continue
+        if has_time and r.get("time_minutes", 0) != request.time_available:
+            continue
+        recipe_tags = {" ".join(tag.lower().split()) for tag in r.get("tags", "").split(",")}
+        if has_diet and " ".join(request.diet.lower().split()) not in recipe_tags:
+            continue
+        if has_cuisine and " ".join(request.cuisine.lower().split()) not in recipe_tags:
+            continue
+
+        r["match_score"] = match_count
+        scored_recipes.append(r)
+
+    # Sort by ingredient match
+    scored_recipes.sort(key=lambda x: x["match_score"], reverse=True)
+    return scored_recipes
+
+
+def score_rows(store, rows, request: RecipeRequest, pantry_ids):
+    """
+    `score_candidates` on row numbers of a columnar `RecipeStore`: the same filters, as array
+    operations. Returns `(rows, match_scores)`, best first (stable for equal scores).
+    """
+    counts = store.match_counts(rows, pantry_ids)
+    keep = counts > 0
+    if request.servings_required:
+        keep &= store.servings[rows] == request.servings_required
+    if request.time_available:
+        keep &= store.time_minutes[rows] == request.time_available
+    if request.diet and request.diet.strip():
+        keep &= store.has_tag(rows, request.diet)
+    if request.cuisine and request.cuisine.strip():
+        keep &= store.has_tag(rows, request.cuisine)
+
+    rows, counts = rows[keep], counts[keep]
+    order = np.argsort(-counts, kind="stable")
+    return rows[order], counts[order]
+
+
+def load_substitution_table():
+    """Substitution table, or None if it can't be loaded (substitutions then come from the LLM)."""
+    try:
+        return get_substitution_table()
+    except Exception:
+        return None
+
+
+def table_substitutions(r, request: RecipeRequest):
+    """
+    Precomputed substitutions for the recipe ingredients the pantry lacks (no model call).
+    None when SUBSTITUTIONS_SOURCE isn't "table" or the table is unavailable.
+    """
+    if SUBSTITUTIONS_SOURCE != "table":
+        return None
+    table = load_substitution_table()
+    if table is None:
+        return None
+    # The request's diet and the recipe's own tags (e.g. a vegetarian recipe stays vegetarian)
+    diets = [request.diet or ""] + r.get("tags", "").split(",")
+    return table.suggest(r.get("ingredients", ""), request.pantry_items, diets=diets)
+
+
+def fallback_details(r, request: RecipeRequest = None):
+    """Instructions used when the LLM is unavailable, fails or runs out of time."""
+    substitutions = (table_substitutions(r, request) if request is not None else None) or []
+    precomputed = base_instructions(r)
+    if precomputed:
+        return {"instructions": precomputed, "substitutions": substitutions}
+    return {
+        "instructions": [
+            f"Use available ingredients: {r['ingredients']}.",
+            f"Prepare {r['name']} in your preferred cooking style."
+        ],
+        "substitutions": substitutions
+    }
+
+
+async def run_llm(timeout: float, fn, *args, **kwargs):
+    """
+    Run a blocking LLM helper on `llm_executor`, waiting at most `timeout` seconds
+    (time queued for a free slot included; queued calls that time out never start).
+    The helper gets the same deadline, so the client's attempts and retries end with it.
+    """
+    deadline = time.monotonic() + timeout
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(
+        loop.run_in_executor(llm_executor, functools.partial(fn, *args, deadline=deadline, **kwargs)),
+        timeout=timeout
+    )
+
+
+async def enrich_recipe(r, request: RecipeRequest):
+    """
+    Generate instructions/substitutions for one recipe, bounded by `llm_executor` and the timeout.
+    Returns `(details, ok)`; `ok` is False when the LLM failed and the fallback was used.
+    Substitutions the model wrote win; the substitution table only fills in when no model call
+    is made for them or the call fails.
+    """
+    if not LLM_AVAILABLE:
+        return fallback_details(r, request), True
+
+    # Precomputed instructions: only substitutions for missing ingredients are personalized,
+    # from the substitution table when it is the source (no model call at all)
+    precomputed = base_instructions(r)
+    if precomputed:
+        substitutions = table_substitutions(r, request)
+        if substitutions is not None:
+            return {"instructions": precomputed, "substitutions": substitutions}, True
+        if not missing_ingredients(r, request.pantry_items):
+            return {"instructions": precomputed, "substitutions": []}, True
+        try:
+            substitutions = await run_llm(
+                LLM_TIMEOUT_SECONDS,
+                generate_substitutions, r, request.pantry_items,
+                diet=request.diet, cuisine=request.cuisine
+            )
+            return {"instructions": precomputed, "substitutions": substitutions}, True
+        except Exception:
+            return {"instructions": precomputed, "substitutions": []}, False
+
+    try:
+        llm_result = await run_llm(
+            LLM_TIMEOUT_SECONDS,
+            generate_recipe_details,
+            r,
+            request.pantry_items,
+            diet=request.diet,
+            cuisine=request.cuisine,
+            time_available=request.time_available,
+            servings_required=request.servings_required
+        )
+        # The helper falls back itself when Ollama fails or the circuit breaker is open
+        substitutions = llm_result.get("substitutions", [])
+        if llm_result.get("fallback"):
+            substitutions = table_substitutions(r, request) or substitutions
+        return {
+            "instructions": llm_result.get("instructions", []),
+            "substitutions": substitutions
+        }, not llm_result.get("fallback")
+    except Exception:
+        # Fallback if LLM fails or times out
+        return fallback_details(r, request), False
+
+
+async def enrich_batch(indices, recipes, request: RecipeRequest):
+    """
+    Enrich several recipes with a single LLM call. Returns `(results, missing)`: `(index, result, ok)`
+    for every recipe the model answered, and the indices it left out (to be enriched one by one).
+    If the call itself fails or times out, all recipes get the fallback.
+    """
+    try:
+        batch_details = await run_llm(
+            LLM_DEADLINE_SECONDS,
+            generate_batch_details,
+            [recipes[i] for i in indices],
+            request.pantry_items,
+            diet=request.diet,
+            cuisine=request.cuisine,
+            time_available=request.time_available,
+            servings_required=request.servings_required
+        )
+    except Exception:
+        return [(i, fallback_details(recipes[i], request), False) for i in indices], []
+
+    results, missing = [], []
+    for i, details in zip(indices, batch_details):
+        if details is None:
+            missing.append(i)
+        else:
+            results.append((i, {
+                "instructions": details.get("instructions", []),
+                "substitutions": details.get("substitutions", [])
+            }, True))
+    return results, missing
+
+
+async def iter_enriched(recipes, request: RecipeRequest):
+    """
+    Enrich recipes concurrently (at most LLM_CONCURRENCY calls at a time, across all requests) and yield
+    `(index, result, ok)` as soon as each one finishes.
+    With LLM_ENRICH_MODE=batch, recipes without precomputed instructions share one LLM call;
+    any recipe missing from its answer is then enriched on its own.
+    Recipes not finished within LLM_DEADLINE_SECONDS get fallback instructions.
+    """
+    async def enrich_one(i):
+        details, ok = await enrich_recipe(recipes[i], request)
+        return [(i, details, ok)], []
+
+    tasks = {}  # task -> recipe indices it covers
+
+    def spawn(coro, indices):
+        task = asyncio.create_task(coro)
+        tasks[task] = indices
+        return task
+
+    batched = []
+    if LLM_AVAILABLE and LLM_ENRICH_MODE == "batch":
+        batched = [i for i, r in enumerate(recipes) if not base_instructions(r)]
+    pending = {spawn(enrich_one(i), [i]) for i in range(len(recipes)) if i not in batched}
+    if len(batched) > 1:
+        pending.add(spawn(enrich_batch(batched, recipes, request), batched))
+    else:
+        pending.update(spawn(enrich_one(i), [i]) for i in batched)
+    deadline = asyncio.get_running_loop().time() + LLM_DEADLINE_SECONDS
+
+    try:
+        while pending:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                results, missing = task.result()
+                for result in results:
+                    if not result[2]:
+                        registry.inc("llm_fallbacks_total", reason="error")
+                    yield result
+                # Recipes the batched answer left out fall back to their own prompt
+                pending.update(spawn(enrich_one(i), [i]) for i in missing)
+
+        # Deadline reached: remaining recipes get the fallback
+        for task in pending:
+            for i in tasks[task]:
+                registry.inc("llm_fallbacks_total", reason="deadline")
+                yield i, fallback_details(recipes[i], request), False
+    finally:
+        # Also runs when a streaming client disconnects early
+        for task in pending:
+            task.cancel()
+
+
+async def enrich_recipes(recipes, request: RecipeRequest):
+    """
+    Enrich all recipes concurrently; results are returned in the same order as `recipes`.
+    Returns `(results, all_ok)`.
+    """
+    results = [None] * len(recipes)
+    all_ok = True
+    async for i, result, ok in iter_enriched(recipes, request):
+        results[i] = result
+        all_ok = all_ok and ok
+    return results, all_ok
+
+
+def build_recipe_detail(r):
+    """Response entry for a scored recipe (without LLM fields)."""
+    return {
+        "name": r["name"],
+        "ingredients": r["ingredients"],
+        "tags": r["tags"],
+        "time_minutes": r.get("time_minutes", 0),
+        "servings": r.get("servings", 1),
+        "rank": "high",
+        "match_score": r["match_score"]
+    }
+
+
+def build_note(request: RecipeRequest):
+    """Note listing the optional fields the user left empty."""
+    missing_fields = []
+    if not (request.diet and request.diet.strip()): missing_fields.append("diet")
+    if not (request.cuisine and request.cuisine.strip()): missing_fields.append("cuisine")
+    if not request.time_available: missing_fields.append("max time")
+
+    note = ""
+    if missing_fields:
+        note = "Note: You have not provided " + ", ".join(missing_fields) + \
+               ", so recipes are shown based on the remaining inputs."
+    return note
+
+def normalize_request(request: RecipeRequest):
+    """Copy of the request with pantry/diet/cuisine normalized, so equivalent requests match."""
+    diet = (request.diet or "").strip().lower()
+    cuisine = (request.cuisine or "").strip().lower()
+    return RecipeRequest(
+        pantry_items=normalize_pantry(request.pantry_items or []),
+        diet=diet or None,
+        cuisine=cuisine or None,
+        time_available=request.time_available or None,
+        servings_required=request.servings_required
+    )
+
+
+def response_cache_key(request: RecipeRequest):
+    """Cache key for a normalized request; includes the catalog version so ingestion invalidates it."""
+    return (
+        catalog_version(),
+        tuple(request.pantry_items),
+        request.diet,
+        request.cuisine,
+        request.time_available,
+        request.servings_required
+    )
+
+
+NO_RESULTS_MESSAGE = "No recipes found for these matches. Try with different inputs."
+
+
+def validate_request(request: RecipeRequest):
+    """Message for a request missing mandatory fields (None when valid)."""
+    if not request.pantry_items or not request.servings_required:
+        return "Please provide at least pantry items and servings."
+    return None
+
+
+def request_where(request: RecipeRequest):
+    """Chroma filter for the request's servings / time / diet / cuisine."""
+    return build_where(
+        servings=request.servings_required,
+        time_minutes=request.time_available,
+        tags=[tag for tag in (request.diet, request.cuisine) if tag]
+    )
+
+
+def load_ingredient_index():
+    """Ingredient index, or None if it can't be built (scoring then parses metadata strings)."""
+    try:
+        return get_ingredient_index()
+    except Exception:
+        return None
+
+
+def rank_candidates(request: RecipeRequest, top_recipes, index):
+    """
+    Merge vector candidates with exact-overlap recipes from the index, then score and filter.
+    Returns `(recipes, message)`; `message` is set when there is nothing to recommend.
+    With an index, candidates stay row numbers in its columnar store until the top 10 are picked.
+    """
+    if index is not None:
+        return rank_rows(request, top_recipes, index.columnar())
+
+    registry.observe("candidates", len(top_recipes), buckets=COUNT_BUCKETS, stage="retrieved")
+    if not top_recipes:
+        return [], NO_RESULTS_MESSAGE
+
+    with timed("scoring"):
+        scored_recipes = score_candidates(top_recipes, request)
+    registry.observe("candidates", len(scored_recipes), buckets=COUNT_BUCKETS, stage="filtered")
+    if not scored_recipes:
+        return [], NO_RESULTS_MESSAGE
+
+    return scored_recipes[:10], None
+
+
+def rank_rows(request: RecipeRequest, top_recipes, store):
+    """`rank_candidates` on a `RecipeStore`: only the returned recipes are materialized as dicts."""
+    rows, unknown = store.rows_of(top_recipes)
+    pantry_ids = store.pantry_ids(request.pantry_items)
+    # Add recipes with the highest exact ingredient overlap, even if the embedding ranked them low.
+    # Hybrid retrieval already fuses keyword matches (with filters applied) into the candidates.
+    if RETRIEVAL_MODE != "hybrid":
+        overlap, _ = store.top_overlap(pantry_ids, limit=CANDIDATE_TOP_K)
+        rows = np.concatenate([rows, overlap[~np.isin(overlap, rows)]])
+
+    registry.observe("candidates", len(rows) + len(unknown), buckets=COUNT_BUCKETS, stage="retrieved")
+    if not len(rows) and not unknown:
+        return [], NO_RESULTS_MESSAGE
+
+    with timed("scoring"):
+        rows, scores = score_rows(store, rows, request, pantry_ids)
+        # Recipes not indexed yet are scored from their metadata strings
+        unindexed = score_candidates(unknown, request) if unknown else []
+        scored_recipes = [store.metadata(row, match_score=int(score)) for row, score in zip(rows[:10], scores[:10])]
+        if unindexed:
+            scored_recipes = sorted(scored_recipes + unindexed, key=lambda x: x["match_score"], reverse=True)
+    registry.observe("candidates", len(rows) + len(unindexed), buckets=COUNT_BUCKETS, stage="filtered")
+    if not scored_recipes:
+        return [], NO_RESULTS_MESSAGE
+
+    return scored_recipes[:10], None
+
+
+async def find_top_recipes(request: RecipeRequest):
+    """
+    Run vector search + scoring for a request.
+    Returns `(recipes, message)`; `message` is set when there is nothing to recommend.
+    """
+    # Validate mandatory fields
+    message = validate_request(request)
+    if message:
+        return [], message
+
+    # Query recipes from vector DB (off the event loop, embedding is CPU-bound).
+    # Filters are pushed into the Chroma query so only eligible recipes are ranked.
+    with timed("retrieval"):
+        where = await asyncio.to_thread(request_where, request)
+        top_recipes = await asyncio.to_thread(query_recipes, request.pantry_items, top_k=CANDIDATE_TOP_K, where=where)
+    index = await asyncio.to_thread(load_ingredient_index)
+    if SUBSTITUTIONS_SOURCE == "table":
+        # Load (or refresh) the substitution table off the event loop; enrichment then only reads it
+        await asyncio.to_thread(load_substitution_table)
+    return rank_candidates(request, top_recipes, index)
+
+
+def find_top_recipes_batch(requests: List[RecipeRequest]):
+    """
+    Batched `find_top_recipes` for already-validated requests: one embedding batch and
+    multi-query vector search for all of them. Returns `(recipes, message)` or an
+    Exception per request, in input order.
+    """
+    with timed("retrieval"):
+        wheres = [request_where(request) for request in requests]
+        candidate_lists = query_recipes_batch(
+            [request.pantry_items for request in requests], top_k=CANDIDATE_TOP_K, wheres=wheres
+        )
+    index = load_ingredient_index()
+    if SUBSTITUTIONS_SOURCE == "table":
+        load_substitution_table()
+
+    outcomes = []
+    for request, candidates in zip(requests, candidate_lists):
+        try:
+            outcomes.append(rank_candidates(request, candidates, index))
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+
+async def build_response(request: RecipeRequest, recipes, cache_key, enrich: bool = True):
+    """Enrich the top recipes and assemble the final payload (cached under `cache_key`)."""
+    if enrich:
+        with timed("enrichment"):
+            llm_results, all_ok = await enrich_recipes(recipes, request)
+    else:
+        llm_results, all_ok = [fallback_details(r, request) for r in recipes], False
+
+    final_recipes = []
+    for r, llm_result in zip(recipes, llm_results):
+        recipe_detail = build_recipe_detail(r)
+        recipe_detail.update(llm_result)
+        final_recipes.append(recipe_detail)
+
+    response = {"note": build_note(request), "recipes": final_recipes}
+    # Don't pin fallback output from a transient LLM failure in the cache
+    if all_ok:
+        response_cache.set(cache_key, response)
+    return response
+
 # -----------------------------
 # Recipe recommender endpoint
 # -----------------------------
 @app.post("/recommend-recipes")
-def recommend_recipes(request: RecipeRequest):
+async def recommend_recipes(request: RecipeRequest):
+    registry.inc("requests_total", endpoint="recommend")
+    try:
+        with timed("request"):
+            request = normalize_request(request)
+            cache_key = response_cache_key(request)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            top_recipes_metadata, message = await find_top_recipes(request)
+            if message:
+                return {"message": message}
+
+            # Prepare final output with optional LLM (enriched concurrently)
+            return await build_response(request, top_recipes_metadata, cache_key)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# -----------------------------
+# Batch recommender endpoint
+# -----------------------------
+@app.post("/recommend-recipes/batch")
+async def recommend_recipes_batch(requests: List[RecipeRequest], enrich: bool = True):
+    """
+    Recommendations for many pantries in one call. All vector searches share one
+    embedding batch and multi-query call; LLM enrichment goes through the shared
+    LLM_CONCURRENCY pool (`?enrich=false` skips it). Returns one result per request, in input order:
+    the normal response, a `{"message": ...}`, or an `{"error": ...}`.
+    """
+    registry.inc("requests_total", endpoint="batch")
+    registry.observe("batch_size", len(requests), buckets=COUNT_BUCKETS)
+    requests = [normalize_request(request) for request in requests]
+    cache_keys = [response_cache_key(request) for request in requests]
+    results = [None] * len(requests)
+
+    pending = []
+    for i, request in enumerate(requests):
+        message = validate_request(request)
+        cached = response_cache.get(cache_keys[i]) if not message and enrich else None
+        if message:
+            results[i] = {"message": message}
+        elif cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+
     try:
-        # Validate mandatory fields
-        if not request.pantry_items or not request.servings_required:
-            return {"message": "Please provide at least pantry items and servings."}
-
-        # Query recipes from vector DB
-        top_recipes = query_recipes(request.pantry_items, top_k=50)
-        if not top_recipes:
-            return {"message": "No recipes found for these matches. Try with different inputs."}
-
-        # Optional fields flags
-        has_diet = bool(request.diet and request.diet.strip())
-        has_cuisine = bool(request.cuisine and request.cuisine.strip())
-        has_time = bool(request.time_available)
-
-        scored_recipes = []
-
-        for r in top_recipes:
-            # Ingredient match
-            recipe_ingredients = [ing.strip().lower() for ing in r.get("ingredients", "").split(",")]
-            match_count = sum(1 for item in request.pantry_items if item.lower() in recipe_ingredients)
-            if match_count == 0:
-                continue
-
-            # --- Apply strict filtering for filled fields only ---
-            if request.servings_required and r.get("servings", 0) != request.servings_required:
-                continue
-            if has_time and r.get("time_minutes", 0) != request.time_available:
-                continue
-            if has_diet and request.diet.lower() not in r.get("tags", "").lower():
-                continue
-            if has_cuisine and request.cuisine.lower() not in r.get("tags", "").lower():
-                continue
-
-            r["match_score"] = match_count
-            scored_recipes.append(r)
-
-        if not scored_recipes:
-            return {"message": "No recipes found for these matches. Try with different inputs."}
-
-        # Sort by ingredient match
-        scored_recipes.sort(key=lambda x: x["match_score"], reverse=True)
-        top_recipes_metadata = scored_recipes[:10]
-
-        # Prepare final output with optional LLM
-        final_recipes = []
-        for r in top_recipes_metadata:
-            recipe_detail = {
-                "name": r["name"],
-                "ingredients": r["ingredients"],
-                "tags": r["tags"],
-                "time_minutes": r.get("time_minutes", 0),
-                "servings": r.get("servings", 1),
-                "rank": "high",
-                "match_score": r["match_score"]
-            }
-
-            if LLM_AVAILABLE:
-                try:
-                    llm_result = generate_recipe_details(
-                        r,
-                        request.pantry_items,
-                        diet=request.diet,
-                        cuisine=request.cuisine,
-                        time_available=request.time_available,
-                        servings_required=request.servings_required
-                    )
-                    recipe_detail.update({
-                        "instructions": llm_result.get("instructions", []),
-                        "substitutions": llm_result.get("substitutions", [])
-                    })
-                except Exception:
-                    # Fallback if LLM fails
-                    recipe_detail["instructions"] = [
-                        f"Use available ingredients: {r['ingredients']}.",
-                        f"Prepare {r['name']} in your preferred cooking style."
-                    ]
-                    recipe_detail["substitutions"] = []
-            else:
-                # Fallback if LLM not installed
-                recipe_detail["instructions"] = [
-                    f"Use available ingredients: {r['ingredients']}.",
-                    f"Prepare {r['name']} in your preferred cooking style."
-                ]
-                recipe_detail["substitutions"] = []
-
-            final_recipes.append(recipe_detail)
-
-        # Note if optional fields missing
-        missing_fields = []
-        if not has_diet: missing_fields.append("diet")
-        if not has_cuisine: missing_fields.append("cuisine")
-        if not has_time: missing_fields.append("max time")
-
-        note = ""
-        if missing_fields:
-            note = "Note: You have not provided " + ", ".join(missing_fields) + \
-                   ", so recipes are shown based on the remaining inputs."
-
-        return {"note": note, "recipes": final_recipes}
+        outcomes = await asyncio.to_thread(find_top_recipes_batch, [requests[i] for i in pending])
+    except Exception as e:
+        outcomes = [e] * len(pending)
+
+    async def finish(i, outcome):
+        if isinstance(outcome, Exception):
+            return {"error": str(outcome)}
+        recipes, message = outcome
+        if message:
+            return {"message": message}
+        try:
+            return await build_response(requests[i], recipes, cache_keys[i], enrich)
+        except Exception as e:
+            return {"error": str(e)}
+
+    finished = await asyncio.gather(*(finish(i, outcome) for i, outcome in zip(pending, outcomes)))
+    for i, result in zip(pending, finished):
+        results[i] = result
+    return results
+
+# -----------------------------
+# Streaming recommender endpoint
+# -----------------------------
+def ndjson(event):
+    return json.dumps(event) + "\n"
+
+
+@app.post("/recommend-recipes/stream")
+async def recommend_recipes_stream(request: RecipeRequest):
+    """
+    Same recommendations as /recommend-recipes, streamed as NDJSON:
+    - {"type": "message", ...} when there is nothing to recommend
+    - {"type": "candidates", "note": ..., "recipes": [...]} right after the vector search
+    - {"type": "details", "index": i, "instructions": [...], "substitutions": [...]} per recipe,
+      in completion order
+    - {"type": "done"} at the end
+    """
+    registry.inc("requests_total", endpoint="stream")
+    request = normalize_request(request)
+    cache_key = response_cache_key(request)
+    cached = response_cache.get(cache_key)
+
+    async def cached_stream():
+        # Replay a cached payload in the same event format
+        recipes = cached["recipes"]
+        yield ndjson({
+            "type": "candidates",
+            "note": cached["note"],
+            "recipes": [
+                {k: v for k, v in r.items() if k not in ("instructions", "substitutions")}
+                for r in recipes
+            ]
+        })
+        for i, r in enumerate(recipes):
+            yield ndjson({
+                "type": "details", "index": i,
+                "instructions": r["instructions"], "substitutions": r["substitutions"]
+            })
+        yield ndjson({"type": "done"})
+
+    if cached is not None:
+        return StreamingResponse(cached_stream(), media_type="application/x-ndjson")
+
+    try:
+        top_recipes_metadata, message = await find_top_recipes(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        if message:
+            yield ndjson({"type": "message", "message": message})
+            return
 
+        final_recipes = [build_recipe_detail(r) for r in top_recipes_metadata]
+        note = build_note(request)
+        yield ndjson({"type": "candidates", "note": note, "recipes": final_recipes})
+
+        all_ok = True
+        async for i, llm_result, ok in iter_enriched(top_recipes_metadata, request):
+            all_ok = all_ok and ok
+            yield ndjson({"type": "details", "index": i, **llm_result})
+            final_recipes[i] = {**final_recipes[i], **llm_result}
+
+        if all_ok:
+            response_cache.set(cache_key, {"note": note, "recipes": final_recipes})
+        yield ndjson({"type": "done"})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+# -----------------------------
+# Catalog update endpoints
+# -----------------------------
+class Recipe(BaseModel):
+    id: Optional[str] = None
+    name: str
+    ingredients: List[str]
+    tags: List[str] = []
+    time_required: int = 0
+    servings: int = 1
+
+
+def check_catalog_token(token: Optional[str]):
+    if not CATALOG_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Catalog writes are disabled (CATALOG_API_TOKEN is not set)")
+    if not hmac.compare_digest(token or "", CATALOG_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Catalog-Token")
+
+
+async def apply_update(upserts=(), deletes=()):
+    """Run a catalog update off the event loop; recommendations keep being served meanwhile."""
+    try:
+        return await asyncio.to_thread(update_catalog, upserts=upserts, deletes=deletes)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/recipes")
+async def upsert_recipes(recipes: List[Recipe], x_catalog_token: Optional[str] = Header(None)):
+    """
+    Add or update recipes in the running catalog. Only new or changed recipes are
+    re-embedded; indexes and caches follow the new catalog version without a restart.
+    """
+    check_catalog_token(x_catalog_token)
+    if any(not recipe.id for recipe in recipes):
+        raise HTTPException(status_code=422, detail="Every recipe needs an id")
+    ids = [recipe.id for recipe in recipes]
+    duplicates = sorted({rid for rid in ids if ids.count(rid) > 1})
+    if duplicates:
+        raise HTTPException(status_code=422, detail=f"Duplicate recipe ids: {', '.join(duplicates)}")
+    return await apply_update(upserts=[recipe.model_dump() for recipe in recipes])
+
+
+@app.put("/recipes/{recipe_id}")
+async def replace_recipe(recipe_id: str, recipe: Recipe, x_catalog_token: Optional[str] = Header(None)):
+    """Create or replace one recipe."""
+    check_catalog_token(x_catalog_token)
+    if recipe.id not in (None, recipe_id):
+        raise HTTPException(status_code=422, detail="Recipe id does not match the URL")
+    return await apply_update(upserts=[{**recipe.model_dump(), "id": recipe_id}])
+
+
+@app.delete("/recipes/{recipe_id}")
+async def delete_recipe(recipe_id: str, x_catalog_token: Optional[str] = Header(None)):
+    """Remove one recipe from the catalog."""
+    check_catalog_token(x_catalog_token)
+    result = await apply_update(deletes=[recipe_id])
+    if not result["deleted"]:
+        raise HTTPException(status_code=404, detail=f"Recipe {recipe_id} not found")
+    return result
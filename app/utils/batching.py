@@ -0,0 +1,92 @@
+# file: app/utils/batching.py
+
+from concurrent.futures import Future
+import queue
+import threading
+import time
+import numpy as np
+
+from app.utils.metrics import Histogram
+
+# -----------------------------
+# Dynamic micro-batching
+# -----------------------------
+class MicroBatcher:
+    """
+    Collects texts submitted by concurrent callers and encodes them together.
+    A background thread takes the first waiting text, keeps collecting for up to
+    `max_wait_ms` (or until `max_batch_size` texts), calls `encode_fn` once and hands
+    each caller its own vector. A batch of one is encoded exactly like a direct call.
+    """
+
+    def __init__(self, encode_fn, max_batch_size: int = 32, max_wait_ms: float = 2.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.queue_depth = Histogram()   # texts waiting when a batch starts
+        self.batch_size = Histogram()    # texts encoded per model call
+        self.wait_ms = Histogram(bounds=(0.5, 1, 2, 5, 10, 20, 50, 100))  # time spent queued
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        self._ensure_worker()
+        return future
+
+    def encode(self, text: str, timeout: float = None):
+        """Blocking helper: the embedding for one text."""
+        return self.submit(text).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        self.queue_depth.observe(self._queue.qsize() + 1)
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                self.wait_ms.observe((started - queued_at) * 1000)
+
+            # Identical texts from concurrent callers are encoded once
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            self.batch_size.observe(len(texts))
+            try:
+                if len(texts) == 1:
+                    vectors = {texts[0]: np.asarray(self.encode_fn(texts[0]))}
+                else:
+                    vectors = dict(zip(texts, np.asarray(self.encode_fn(texts))))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for text, future, _ in batch:
+                future.set_result(vectors[text])
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "pending": self._queue.qsize(),
+            "queue_depth": self.queue_depth.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+            "wait_ms": self.wait_ms.snapshot()
+        }
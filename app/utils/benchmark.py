@@ -0,0 +1,729 @@
+# file: app/utils/benchmark.py
+#
+# Benchmark suite and load-test harness for the recommendation pipeline:
+#   python -m app.utils.benchmark run --recipes 10000 --concurrency 1,8 --output bench.json
+#   python -m app.utils.benchmark compare old.json new.json
+#   python -m app.utils.benchmark loadtest --url http://localhost:8000 --requests 500 --concurrency 16
+#   python -m app.utils.benchmark memory --workers 1,4,16 --recipes 20000
+#   python -m app.utils.benchmark hnsw --sizes 1000,10000,50000 --search-ef 10,50,100,200
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import zlib
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # app/utils
+APP_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))  # app
+SAMPLE_CATALOG_PATH = os.path.join(APP_DIR, "data", "recipes.json")
+
+STAGES = ("embedding", "vector_query", "scoring", "enrichment", "end_to_end")
+
+# -----------------------------
+# Synthetic catalogs
+# -----------------------------
+MODIFIERS = ("fresh", "dried", "smoked", "roasted", "ground", "chopped", "red", "green", "baby", "wild")
+DIET_TAGS = ("vegan", "vegetarian", "non-vegetarian")
+SERVINGS = (1, 2, 4, 6)
+TIMES = (10, 15, 20, 25, 30, 40, 45, 60)
+
+
+def catalog_vocabulary(sample_path: str = SAMPLE_CATALOG_PATH):
+    """Ingredient / tag / name vocabularies taken from the sample `recipes.json`."""
+    with open(sample_path, "r", encoding="utf-8") as f:
+        sample = json.load(f)
+    ingredients = sorted({i for r in sample for i in r["ingredients"]})
+    tags = sorted({t for r in sample for t in r["tags"]} - set(DIET_TAGS))
+    name_words = sorted({w for r in sample for w in r["name"].split()})
+    # Modifier variants grow the vocabulary to a more realistic size for large catalogs
+    ingredients += [f"{m} {i}" for m in MODIFIERS for i in ingredients]
+    return ingredients, tags, name_words
+
+
+def generate_catalog(n: int, path: str, seed: int = 0, sample_path: str = SAMPLE_CATALOG_PATH):
+    """
+    Write `n` synthetic recipes (same schema as `recipes.json`) as JSON Lines.
+    Ingredient popularity is Zipf-like, so postings and filters behave like a real catalog.
+    """
+    rng = random.Random(seed)
+    ingredients, tags, name_words = catalog_vocabulary(sample_path)
+    weights = [1.0 / (rank + 1) for rank in range(len(ingredients))]
+    rng.shuffle(weights)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            recipe_ingredients = list(dict.fromkeys(rng.choices(ingredients, weights=weights, k=rng.randint(4, 8))))
+            recipe = {
+                "id": f"s-{i}",
+                "name": " ".join(rng.sample(name_words, 2) + [recipe_ingredients[0].title()]),
+                "ingredients": recipe_ingredients,
+                "tags": [rng.choice(DIET_TAGS)] + rng.sample(tags, rng.randint(1, 3)),
+                "time_required": rng.choice(TIMES),
+                "servings": rng.choice(SERVINGS)
+            }
+            f.write(json.dumps(recipe) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def generate_queries(catalog_path: str, n: int, seed: int = 0):
+    """
+    `/recommend-recipes` bodies built from recipes in the catalog: a few of the recipe's
+    ingredients plus some noise, its servings, and sometimes its diet/cuisine tags and time.
+    """
+    from app.utils.vector_db import iter_recipes
+
+    rng = random.Random(seed)
+    # Reservoir sample of recipes, so huge catalogs are read once with bounded memory
+    picked = []
+    for i, recipe in enumerate(iter_recipes(catalog_path)):
+        if len(picked) < n:
+            picked.append(recipe)
+        else:
+            j = rng.randint(0, i)
+            if j < n:
+                picked[j] = recipe
+    vocabulary = sorted({i for r in picked for i in r["ingredients"]})
+
+    queries = []
+    for i in range(n):
+        recipe = picked[i % len(picked)]
+        pantry = rng.sample(recipe["ingredients"], min(len(recipe["ingredients"]), rng.randint(2, 4)))
+        pantry += rng.sample(vocabulary, min(len(vocabulary), rng.randint(0, 2)))
+        diet = next((t for t in recipe["tags"] if t in DIET_TAGS), None)
+        queries.append({
+            "pantry_items": pantry,
+            "diet": diet if rng.random() < 0.3 else None,
+            "cuisine": recipe["tags"][-1] if rng.random() < 0.3 else None,
+            "time_available": recipe["time_required"] if rng.random() < 0.2 else None,
+            "servings_required": recipe["servings"]
+        })
+    return queries
+
+# -----------------------------
+# Fast deterministic embedder (for large catalogs)
+# -----------------------------
+class HashEmbedder:
+    """
+    Stand-in for the sentence-transformer when the model cost is not what is measured:
+    a text is the normalized sum of fixed random vectors of its tokens, so texts sharing
+    words still land close together.
+    """
+
+    name = "hash"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self._tokens = {}
+
+    def _token_vector(self, token: str):
+        vector = self._tokens.get(token)
+        if vector is None:
+            vector = np.random.default_rng(zlib.crc32(token.encode("utf-8"))).standard_normal(self.dim).astype(np.float32)
+            self._tokens[token] = vector
+        return vector
+
+    def _encode_one(self, text: str):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+# -----------------------------
+# Measurement helpers
+# -----------------------------
+def summarize(latencies_ms: List[float], wall_seconds: float, errors: int = 0):
+    """p50/p95/p99 latency (ms) and throughput (requests/s) for one measured run."""
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    if not len(values):
+        return {"count": 0, "errors": errors}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": int(len(values)),
+        "errors": errors,
+        "throughput_rps": round(len(values) / wall_seconds, 2) if wall_seconds > 0 else None,
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+
+def run_threaded(fn, inputs, concurrency: int):
+    """Closed-loop run of a blocking `fn` over `inputs` with `concurrency` worker threads."""
+    latencies, errors = [], []
+
+    def call(item):
+        start = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as e:
+            errors.append(e)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, inputs))
+    return summarize(latencies, time.perf_counter() - start, len(errors))
+
+
+def run_async(coro_fn, inputs, concurrency: int, client_factory=None):
+    """
+    Closed-loop run of an async `coro_fn` over `inputs` with at most `concurrency` in flight.
+    With `client_factory` (e.g. an httpx.AsyncClient), one client is opened for the run and
+    `coro_fn(client, item)` is called instead.
+    """
+    latencies, errors = [], []
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        client = client_factory() if client_factory else None
+
+        async def call(item):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await (coro_fn(client, item) if client is not None else coro_fn(item))
+                except Exception as e:
+                    errors.append(e)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        try:
+            await asyncio.gather(*(call(item) for item in inputs))
+        finally:
+            if client is not None:
+                await client.aclose()
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return summarize(latencies, time.perf_counter() - start, len(errors))
+
+# -----------------------------
+# Isolated benchmark workspace
+# -----------------------------
+def use_workspace(path: str, fake_embeddings: bool):
+    """Point vector_db at a private Chroma dir / derived-index paths, with caches disabled."""
+    import chromadb
+    from app.utils import vector_db
+    from app.utils.cache import LRUCache
+
+    os.makedirs(path, exist_ok=True)
+    vector_db.client = chromadb.PersistentClient(path=os.path.join(path, "chroma"))
+    vector_db.collection = vector_db.open_collection(vector_db.client)
+    vector_db.CATALOG_VERSION_PATH = os.path.join(path, "catalog_version")
+    vector_db.INGREDIENT_INDEX_PATH = os.path.join(path, "ingredient_index.json")
+    vector_db.NUMPY_INDEX_DIR = os.path.join(path, "numpy_index")
+    vector_db.SUBSTITUTIONS_PATH = os.path.join(path, "substitutions.json")
+    vector_db._ingredient_index = None
+    vector_db._substitution_table = None
+    vector_db._lexical_index = None
+    vector_db._numpy_store = None
+    # Every query should pay for its embedding
+    vector_db.embedding_cache = LRUCache(maxsize=0)
+    vector_db.shared_embedding_cache = None
+    if fake_embeddings:
+        vector_db.embed_model = HashEmbedder()
+
+
+def use_stub_llm(stub_url: str):
+    """Send LLM calls to the stub server, with the durable enrichment cache off."""
+    from app.utils import llm_client, llm_helper
+
+    llm_client.llm_client = llm_client.LLMClient(host=stub_url)
+    llm_helper.LLM_CACHE_PATH = ""
+    llm_helper.enrichment_cache = None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=APP_DIR, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+# -----------------------------
+# Pipeline benchmark
+# -----------------------------
+def prepare_workspace(recipes: int, fake_embeddings: bool = True, workdir: str = None, seed: int = 0, setup=None):
+    """Generate (or reuse) a synthetic catalog and ingest it into its own workspace. Returns the catalog path."""
+    from app.utils import vector_db
+
+    setup = setup if setup is not None else {}
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "recipe-benchmarks")
+    workspace = os.path.join(workdir, f"catalog-{recipes}-seed{seed}-{'hash' if fake_embeddings else 'model'}")
+    os.makedirs(workspace, exist_ok=True)
+    catalog_path = os.path.join(workspace, "recipes.jsonl")
+
+    if not os.path.exists(catalog_path):
+        start = time.perf_counter()
+        generate_catalog(recipes, catalog_path, seed=seed)
+        setup["generate_seconds"] = round(time.perf_counter() - start, 3)
+
+    use_workspace(workspace, fake_embeddings)
+    if vector_db.get_collection().count() != recipes:
+        print(f"🔄 Ingesting {recipes} synthetic recipes into {workspace}...")
+        setup["ingest"] = vector_db.ingest_recipes(vector_db.iter_recipes(catalog_path))
+    return catalog_path
+
+def run_benchmark(recipes: int = 1000, queries: int = 200, concurrency=(1, 8), llm_latency_ms: float = 50.0,
+                  fake_embeddings: bool = True, workdir: str = None, seed: int = 0, stages=STAGES):
+    """
+    Generate (or reuse) a synthetic catalog, ingest it into an isolated workspace and measure
+    each pipeline stage at each concurrency level. Returns a JSON-serializable report.
+    """
+    import httpx
+    from app import main
+    from app.utils import vector_db
+    from app.utils.cache import LRUCache
+    from app.utils.stub_ollama import StubOllama
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "recipes": recipes,
+            "queries": queries,
+            "seed": seed,
+            "llm_latency_ms": llm_latency_ms,
+            "embeddings": "hash" if fake_embeddings else vector_db.EMBED_BACKEND,
+            "vector_backend": vector_db.VECTOR_BACKEND,
+            "retrieval_mode": vector_db.RETRIEVAL_MODE,
+            "candidate_top_k": main.CANDIDATE_TOP_K,
+            "llm_enrich_mode": main.LLM_ENRICH_MODE
+        },
+        "setup": {},
+        "results": []
+    }
+
+    catalog_path = prepare_workspace(recipes, fake_embeddings, workdir, seed, report["setup"])
+    start = time.perf_counter()
+    index = vector_db.get_ingredient_index()
+    if vector_db.RETRIEVAL_MODE == "hybrid":
+        vector_db.get_lexical_index()
+    vector_db.get_vector_backend()
+    report["setup"]["index_load_seconds"] = round(time.perf_counter() - start, 3)
+
+    requests = [main.normalize_request(main.RecipeRequest(**q)) for q in generate_queries(catalog_path, queries, seed)]
+    pantries = [r.pantry_items for r in requests]
+    wheres = [main.request_where(r) for r in requests]
+    embeddings = [vector_db.embed_query(p) for p in pantries]
+    candidates = [vector_db.query_recipes(p, top_k=main.CANDIDATE_TOP_K, where=w) for p, w in zip(pantries, wheres)]
+    ranked = [main.rank_candidates(r, [dict(c) for c in cands], index)[0] for r, cands in zip(requests, candidates)]
+
+    main.response_cache = LRUCache(maxsize=0)
+    with StubOllama(latency_ms=llm_latency_ms, jitter_ms=llm_latency_ms / 4, seed=seed) as stub:
+        use_stub_llm(stub.url)
+        main.LLM_AVAILABLE = True
+
+        async def end_to_end(client, body):
+            response = await client.post("/recommend-recipes", json=body, timeout=120)
+            response.raise_for_status()
+
+        def asgi_client():
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench")
+
+        runners = {
+            "embedding": lambda c: run_threaded(vector_db.embed_query, pantries, c),
+            "vector_query": lambda c: run_threaded(
+                lambda item: vector_db.get_vector_backend().query(
+                    query_embeddings=[item[0]], n_results=main.CANDIDATE_TOP_K, where=item[1]
+                ),
+                list(zip(embeddings, wheres)), c
+            ),
+            "scoring": lambda c: run_threaded(
+                lambda item: main.rank_candidates(item[0], [dict(x) for x in item[1]], index),
+                list(zip(requests, candidates)), c
+            ),
+            "enrichment": lambda c: run_async(
+                lambda item: main.enrich_recipes(item[1], item[0]), list(zip(requests, ranked)), c
+            ),
+            "end_to_end": lambda c: run_async(end_to_end, [r.model_dump() for r in requests], c, asgi_client)
+        }
+        for stage in stages:
+            for level in concurrency:
+                print(f"⏱️ {stage} @ concurrency {level}...")
+                result = runners[stage](level)
+                report["results"].append({"stage": stage, "concurrency": level, **result})
+        report["meta"]["llm_calls"] = stub.calls
+
+    return report
+
+# -----------------------------
+# Per-worker memory (pre-fork serving)
+# -----------------------------
+def run_memory(worker_counts=(1, 4, 16), recipes: int = 20000, fake_embeddings: bool = True,
+               workdir: str = None, seed: int = 0, requests_per_worker: int = 5):
+    """
+    Start N forked workers on the NumPy backend, once loading the serving state in every
+    worker and once preloading it before fork (`app.utils.serve`), send a few requests and
+    read each worker's RSS / PSS / USS. The LLM is off: only the retrieval path is exercised.
+    """
+    import httpx
+    from app import main
+    from app.utils import serve, vector_db
+    from app.utils.cache import LRUCache
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "recipes": recipes,
+            "embeddings": "hash" if fake_embeddings else vector_db.EMBED_BACKEND,
+            "retrieval_mode": vector_db.RETRIEVAL_MODE,
+            "substitutions_source": vector_db.SUBSTITUTIONS_SOURCE
+        },
+        "setup": {},
+        "results": []
+    }
+    catalog_path = prepare_workspace(recipes, fake_embeddings, workdir, seed, report["setup"])
+    vector_db.VECTOR_BACKEND = "numpy"
+    # Bring every derived file up to date here; workers only load them
+    vector_db.warm_up()
+    main.LLM_AVAILABLE = False
+    main.response_cache = LRUCache(maxsize=0)
+    bodies = generate_queries(catalog_path, max(worker_counts) * requests_per_worker, seed)
+
+    for preloaded in (False, True):
+        for workers in worker_counts:
+            vector_db._ingredient_index = vector_db._lexical_index = None
+            vector_db._numpy_store = vector_db._substitution_table = None
+            gc.collect()
+            if preloaded:
+                serve.load_shared_state()
+                serve.freeze()
+
+            sock = serve.bind("127.0.0.1", 0)
+            ready_r, ready_w = os.pipe()
+            pids = [serve.spawn_worker(sock, preloaded, ready_fd=ready_w) for _ in range(workers)]
+            try:
+                ready = 0
+                while ready < workers:
+                    ready += len(os.read(ready_r, workers))
+                url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+                with httpx.Client(base_url=url, timeout=60) as client:
+                    for attempt in range(100):
+                        try:
+                            client.get("/health")
+                            break
+                        except httpx.TransportError:
+                            time.sleep(0.1)
+                    for body in bodies[:workers * requests_per_worker]:
+                        client.post("/recommend-recipes", json=body)
+                usage = [serve.memory_usage(pid) for pid in pids]
+            finally:
+                for pid in pids:
+                    os.kill(pid, 15)
+                for pid in pids:
+                    os.waitpid(pid, 0)
+                os.close(ready_r)
+                os.close(ready_w)
+                sock.close()
+                if preloaded:
+                    gc.unfreeze()
+
+            row = {"mode": "preloaded" if preloaded else "per-worker", "workers": workers}
+            for metric in ("rss_mb", "pss_mb", "uss_mb"):
+                row[f"{metric}_per_worker"] = round(sum(u[metric] for u in usage) / len(usage), 1)
+            row["total_pss_mb"] = round(sum(u["pss_mb"] for u in usage), 1)
+            print(f"🧠 {row['mode']:10s} x{workers:<3d} RSS {row['rss_mb_per_worker']} MB, "
+                  f"PSS {row['pss_mb_per_worker']} MB, USS {row['uss_mb_per_worker']} MB per worker")
+            report["results"].append(row)
+    return report
+
+# -----------------------------
+# HNSW recall / latency sweep
+# -----------------------------
+class ExactSearch:
+    """Brute-force top-k under `space` (cosine / ip / l2), the ground truth for recall; per-row work is done once."""
+
+    def __init__(self, vectors, space: str = "l2"):
+        self.space = space
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        if space == "cosine":
+            self.vectors = self.vectors / np.maximum(np.linalg.norm(self.vectors, axis=1, keepdims=True), 1e-12)
+        self.squared_norms = (self.vectors ** 2).sum(axis=1) if space == "l2" else None
+
+    def top_k(self, queries, k: int, chunk_size: int = 64):
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, len(self.vectors))
+        top = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), chunk_size):
+            scores = queries[start:start + chunk_size] @ self.vectors.T
+            if self.space == "l2":
+                scores = 2 * scores - self.squared_norms  # argmax of this = argmin of the squared distance
+            chunk_top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(scores, chunk_top, axis=1), axis=1, kind="stable")
+            top[start:start + len(chunk_top)] = np.take_along_axis(chunk_top, order, axis=1)
+        return top
+
+
+def sweep_vectors(recipes: int, queries: int, embedder, workspace: str, seed: int = 0):
+    """Recipe and query embeddings for a synthetic catalog, cached in the workspace."""
+    from app.utils import vector_db
+
+    catalog_path = os.path.join(workspace, "recipes.jsonl")
+    vectors_path = os.path.join(workspace, "vectors.npy")
+    if not os.path.exists(catalog_path):
+        generate_catalog(recipes, catalog_path, seed=seed)
+    if not os.path.exists(vectors_path):
+        chunks = [
+            np.asarray(embedder.encode([vector_db.recipe_text(r) for r in batch]), dtype=np.float32)
+            for batch in vector_db.iter_batches(vector_db.iter_recipes(catalog_path), 1024)
+        ]
+        np.save(vectors_path, np.concatenate(chunks))
+    texts = [" ".join(vector_db.normalize_pantry(b["pantry_items"])) for b in generate_queries(catalog_path, queries, seed)]
+    return np.load(vectors_path), np.asarray(embedder.encode(texts), dtype=np.float32)
+
+
+def run_hnsw_sweep(sizes=(1000, 10000, 50000), queries: int = 200, k: int = 10, spaces=("l2",), ms=(16,),
+                   construction_efs=(100,), search_efs=(10, 20, 50, 100, 200), fake_embeddings: bool = True,
+                   workdir: str = None, seed: int = 0):
+    """
+    Recall@k of the Chroma HNSW index against exact brute-force search, and single-query latency,
+    for every combination of catalog size, distance metric, M, construction ef and search ef.
+    Each (size, metric, M, construction ef) index is built once and kept in the workdir; search ef
+    is applied by reopening it. An `exact/...` row per size and metric gives the brute-force latency.
+    """
+    import chromadb
+    from chromadb.api.client import SharedSystemClient
+    from app.utils import vector_db
+
+    embedder = HashEmbedder() if fake_embeddings else vector_db.get_embed_model()
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "recipe-benchmarks")
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "queries": queries,
+            "k": k,
+            "embeddings": "hash" if fake_embeddings else vector_db.EMBED_BACKEND,
+            "configured": vector_db.hnsw_configuration()["hnsw"]
+        },
+        "setup": {},
+        "results": []
+    }
+
+    for recipes in sizes:
+        workspace = os.path.join(workdir, f"hnsw-{recipes}-seed{seed}-{'hash' if fake_embeddings else 'model'}")
+        os.makedirs(workspace, exist_ok=True)
+        start = time.perf_counter()
+        vectors, query_vectors = sweep_vectors(recipes, queries, embedder, workspace, seed)
+        report["setup"][f"vectors_{recipes}_seconds"] = round(time.perf_counter() - start, 3)
+
+        for space in spaces:
+            search = ExactSearch(vectors, space)
+            exact = search.top_k(query_vectors, k)
+            latencies = []
+            wall = time.perf_counter()
+            for query in query_vectors:
+                start = time.perf_counter()
+                search.top_k(query[None], k)
+                latencies.append((time.perf_counter() - start) * 1000)
+            row = {"stage": f"exact/{recipes}/{space}", "concurrency": 1, "size": recipes, "space": space,
+                   "recall_at_k": 1.0, **summarize(latencies, time.perf_counter() - wall)}
+            print(f"🎯 {row['stage']:32s} recall@{k} 1.000  p50 {row['p50_ms']} ms")
+            report["results"].append(row)
+
+            for m in ms:
+                for construction_ef in construction_efs:
+                    path = os.path.join(workspace, f"chroma-{space}-m{m}-efc{construction_ef}")
+                    build_seconds = None
+                    for search_ef in search_efs:
+                        # Chroma loads an index once per process: reopen so the new search ef applies
+                        SharedSystemClient.clear_system_cache()
+                        configuration = vector_db.hnsw_configuration(space, m, construction_ef, search_ef)
+                        client = chromadb.PersistentClient(path=path)
+                        collection = vector_db.open_collection(client, "sweep", configuration)
+                        if collection.count() != len(vectors):
+                            start = time.perf_counter()
+                            batch_size = client.get_max_batch_size()
+                            for offset in range(collection.count(), len(vectors), batch_size):
+                                batch = vectors[offset:offset + batch_size]
+                                collection.add(ids=[str(i) for i in range(offset, offset + len(batch))], embeddings=batch)
+                            build_seconds = round(time.perf_counter() - start, 3)
+
+                        collection.query(query_embeddings=query_vectors[:1], n_results=k)  # loads the index
+                        found, latencies = [], []
+                        wall = time.perf_counter()
+                        for query in query_vectors:
+                            start = time.perf_counter()
+                            found.append(collection.query(query_embeddings=query[None], n_results=k)["ids"][0])
+                            latencies.append((time.perf_counter() - start) * 1000)
+                        wall = time.perf_counter() - wall
+                        recall = np.mean([
+                            len({int(i) for i in ids} & set(truth.tolist())) / len(truth)
+                            for ids, truth in zip(found, exact)
+                        ])
+
+                        row = {
+                            "stage": f"hnsw/{recipes}/{space}/m{m}/efc{construction_ef}/ef{search_ef}",
+                            "concurrency": 1, "size": recipes, "space": space, "m": m,
+                            "construction_ef": construction_ef, "search_ef": search_ef,
+                            "build_seconds": build_seconds, "recall_at_k": round(float(recall), 4),
+                            **summarize(latencies, wall)
+                        }
+                        build_seconds = None
+                        print(f"🎯 {row['stage']:32s} recall@{k} {row['recall_at_k']:.3f}  p50 {row['p50_ms']} ms")
+                        report["results"].append(row)
+    SharedSystemClient.clear_system_cache()
+    return report
+
+# -----------------------------
+# Load test against a running API
+# -----------------------------
+def run_loadtest(url: str, requests: int = 200, concurrency: int = 8, catalog_path: str = SAMPLE_CATALOG_PATH,
+                 seed: int = 0, endpoint: str = "/recommend-recipes"):
+    """Closed-loop HTTP load test; bodies are generated from `catalog_path`."""
+    import httpx
+
+    bodies = generate_queries(catalog_path, requests, seed)
+    statuses = {}
+
+    async def call(client, body):
+        response = await client.post(endpoint, json=body, timeout=120)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        response.raise_for_status()
+
+    def http_client():
+        return httpx.AsyncClient(
+            base_url=url, limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+
+    result = run_async(call, bodies, concurrency, http_client)
+    return {
+        "meta": {"commit": git_commit(), "url": url, "endpoint": endpoint, "requests": requests, "seed": seed},
+        "results": [{"stage": "http", "concurrency": concurrency, "status_codes": statuses, **result}]
+    }
+
+# -----------------------------
+# Comparing runs
+# -----------------------------
+def compare_reports(old, new, metrics=("p50_ms", "p95_ms", "p99_ms", "throughput_rps")):
+    """Per (stage, concurrency) metric changes between two reports, in percent."""
+    old_rows = {(r["stage"], r["concurrency"]): r for r in old["results"]}
+    rows = []
+    for row in new["results"]:
+        before = old_rows.get((row["stage"], row["concurrency"]))
+        if before is None:
+            continue
+        diff = {"stage": row["stage"], "concurrency": row["concurrency"]}
+        for metric in metrics:
+            if before.get(metric) and row.get(metric) is not None:
+                diff[metric] = {
+                    "old": before[metric], "new": row[metric],
+                    "change_pct": round((row[metric] - before[metric]) / before[metric] * 100, 1)
+                }
+        rows.append(diff)
+    return {"old_commit": old["meta"].get("commit"), "new_commit": new["meta"].get("commit"), "diff": rows}
+
+
+def write_report(report, output: str = None):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"✅ Wrote {output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recipe recommender benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="per-stage pipeline benchmark on a synthetic catalog")
+    run.add_argument("--recipes", type=int, default=1000, help="synthetic catalog size (1k-1M)")
+    run.add_argument("--queries", type=int, default=200)
+    run.add_argument("--concurrency", default="1,8", help="comma-separated concurrency levels")
+    run.add_argument("--llm-latency-ms", type=float, default=50.0, help="stub LLM latency per call")
+    run.add_argument("--real-embeddings", action="store_true", help="use EMBED_BACKEND instead of hash vectors")
+    run.add_argument("--stages", default=",".join(STAGES))
+    run.add_argument("--workdir", default=None, help="where catalogs/DBs are kept between runs")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", default=None)
+
+    load = commands.add_parser("loadtest", help="HTTP load test against a running API")
+    load.add_argument("--url", default="http://localhost:8000")
+    load.add_argument("--endpoint", default="/recommend-recipes")
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--catalog", default=SAMPLE_CATALOG_PATH, help="catalog the request bodies are drawn from")
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--output", default=None)
+
+    memory = commands.add_parser("memory", help="per-worker memory with and without pre-fork loading")
+    memory.add_argument("--workers", default="1,4,16", help="comma-separated worker counts")
+    memory.add_argument("--recipes", type=int, default=20000)
+    memory.add_argument("--real-embeddings", action="store_true", help="use EMBED_BACKEND instead of hash vectors")
+    memory.add_argument("--workdir", default=None)
+    memory.add_argument("--seed", type=int, default=0)
+    memory.add_argument("--output", default=None)
+
+    hnsw = commands.add_parser("hnsw", help="HNSW recall@k vs brute force and query latency per setting")
+    hnsw.add_argument("--sizes", default="1000,10000,50000", help="comma-separated catalog sizes")
+    hnsw.add_argument("--queries", type=int, default=200)
+    hnsw.add_argument("--k", type=int, default=10)
+    hnsw.add_argument("--space", default="l2", help="comma-separated distance metrics (cosine, ip, l2)")
+    hnsw.add_argument("--m", default="16", help="comma-separated HNSW M values")
+    hnsw.add_argument("--construction-ef", default="100", help="comma-separated construction ef values")
+    hnsw.add_argument("--search-ef", default="10,20,50,100,200", help="comma-separated search ef values")
+    hnsw.add_argument("--real-embeddings", action="store_true", help="use EMBED_BACKEND instead of hash vectors")
+    hnsw.add_argument("--workdir", default=None)
+    hnsw.add_argument("--seed", type=int, default=0)
+    hnsw.add_argument("--output", default=None)
+
+    compare = commands.add_parser("compare", help="diff two JSON reports")
+    compare.add_argument("old")
+    compare.add_argument("new")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        write_report(run_benchmark(
+            recipes=args.recipes, queries=args.queries,
+            concurrency=[int(c) for c in args.concurrency.split(",")],
+            llm_latency_ms=args.llm_latency_ms, fake_embeddings=not args.real_embeddings,
+            workdir=args.workdir, seed=args.seed, stages=[s for s in args.stages.split(",") if s]
+        ), args.output)
+    elif args.command == "hnsw":
+        write_report(run_hnsw_sweep(
+            sizes=[int(n) for n in args.sizes.split(",")], queries=args.queries, k=args.k,
+            spaces=args.space.split(","), ms=[int(m) for m in args.m.split(",")],
+            construction_efs=[int(ef) for ef in args.construction_ef.split(",")],
+            search_efs=[int(ef) for ef in args.search_ef.split(",")],
+            fake_embeddings=not args.real_embeddings, workdir=args.workdir, seed=args.seed
+        ), args.output)
+    elif args.command == "memory":
+        write_report(run_memory(
+            worker_counts=[int(w) for w in args.workers.split(",")], recipes=args.recipes,
+            fake_embeddings=not args.real_embeddings, workdir=args.workdir, seed=args.seed
+        ), args.output)
+    elif args.command == "loadtest":
+        write_report(run_loadtest(
+            args.url, requests=args.requests, concurrency=args.concurrency,
+            catalog_path=args.catalog, seed=args.seed, endpoint=args.endpoint
+        ), args.output)
+    else:
+        with open(args.old, "r", encoding="utf-8") as f_old, open(args.new, "r", encoding="utf-8") as f_new:
+            write_report(compare_reports(json.load(f_old), json.load(f_new)))
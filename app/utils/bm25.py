@@ -0,0 +1,117 @@
+# file: app/utils/bm25.py
+
+from collections import Counter, defaultdict
+from collections.abc import Sequence
+from typing import List
+import math
+import re
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Text fields indexed per recipe (name, ingredients, tags), with field weights
+FIELD_WEIGHTS = {"name": 1, "ingredients": 2, "tags": 1}
+
+
+def tokenize(text: str):
+    return TOKEN_RE.findall(text.lower())
+
+
+def metadata_matches(metadata, where):
+    """Evaluate the subset of Chroma `where` syntax produced by `build_where` on one metadata dict."""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(metadata_matches(metadata, clause) for clause in where["$and"])
+
+    (key, value), = where.items()
+    if isinstance(value, dict):
+        (op, value), = value.items()
+        if op != "$eq":
+            raise ValueError(f"Unsupported operator for lexical search: {op}")
+    if key.startswith("tag_") and key not in metadata:
+        # Catalogs ingested before tag flags existed: check the tags string
+        tags = {" ".join(t.lower().split()) for t in str(metadata.get("tags", "")).split(",")}
+        return (key[len("tag_"):] in tags) == bool(value)
+    return metadata.get(key) == value
+
+# -----------------------------
+# BM25 keyword index
+# -----------------------------
+class BM25Index:
+    """
+    Okapi BM25 over recipe name, ingredients and tags (ingredients weighted double).
+    Per-term postings hold precomputed BM25 weights, so a query is a few vectorized
+    additions into a score array. Rows line up with the metadata list it was built from.
+    """
+
+    def __init__(self, metadatas, version: str = "0"):
+        self.version = version
+        self.recipes = metadatas if isinstance(metadatas, Sequence) else list(metadatas)
+        term_rows = defaultdict(list)
+        term_freqs = defaultdict(list)
+        lengths = np.zeros(len(self.recipes), dtype=np.float32)
+
+        for row, metadata in enumerate(self.recipes):
+            counts = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(str(metadata.get(field, ""))):
+                    counts[token] += weight
+            lengths[row] = sum(counts.values())
+            for token, tf in counts.items():
+                term_rows[token].append(row)
+                term_freqs[token].append(tf)
+
+        n = len(self.recipes)
+        avg_length = float(lengths.mean()) if n else 0.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (avg_length or 1.0))
+        self.postings = {}  # term -> (rows, weights)
+        for token, rows in term_rows.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            tf = np.asarray(term_freqs[token], dtype=np.float32)
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            self.postings[token] = (rows, (idf * tf * (BM25_K1 + 1) / (tf + norm[rows])).astype(np.float32))
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def search(self, query: str, limit: int = 10, where: dict = None):
+        """Top recipes for a keyword query: list of `(metadata, score)`, best first."""
+        scores = np.zeros(len(self.recipes), dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token in self.postings:
+                rows, weights = self.postings[token]
+                scores[rows] += weights
+
+        candidates = np.flatnonzero(scores)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        results = []
+        for row in candidates:
+            metadata = self.recipes[row]
+            if metadata_matches(metadata, where):
+                results.append((metadata, float(scores[row])))
+                if len(results) >= limit:
+                    break
+        return results
+
+# -----------------------------
+# Reciprocal-rank fusion
+# -----------------------------
+def reciprocal_rank_fusion(result_lists: List[List[dict]], limit: int = 10, k: int = 60):
+    """
+    Fuse ranked recipe lists: each recipe scores sum(1 / (k + rank)) over the lists it
+    appears in (rank from 1). Recipes are identified by their `id`. Returns the top `limit`.
+    """
+    scores = defaultdict(float)
+    recipes = {}
+    for results in result_lists:
+        for rank, metadata in enumerate(results, start=1):
+            rid = str(metadata.get("id"))
+            scores[rid] += 1.0 / (k + rank)
+            recipes.setdefault(rid, metadata)
+    ranked = sorted(scores, key=lambda rid: scores[rid], reverse=True)
+    return [recipes[rid] for rid in ranked[:limit]]
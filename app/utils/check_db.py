@@ -1,7 +1,9 @@
 
-from vector_db import collection
+from app.utils.vector_db import get_collection
 
 if __name__ == "__main__":
+    collection = get_collection()
+
     # total recipes in DB
     total = collection.count()
     print(f" Total recipes in DB: {total}")
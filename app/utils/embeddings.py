@@ -0,0 +1,234 @@
+# file: app/utils/embeddings.py
+
+from typing import List
+import os
+import time
+import numpy as np
+
+# -----------------------------
+# Settings
+# -----------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # app/utils
+APP_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))  # app
+
+# "torch" (SentenceTransformer), "onnx" (exported model) or "onnx-int8" (dynamically quantized)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", os.path.join(APP_DIR, "models", "all-MiniLM-L6-v2-onnx"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))  # 0 = let the runtime decide
+EMBED_MAX_LENGTH = int(os.getenv("EMBED_MAX_LENGTH", "256"))  # same as all-MiniLM-L6-v2
+
+ONNX_MODEL_FILES = {"onnx": "model.onnx", "onnx-int8": "model_int8.onnx"}
+
+# -----------------------------
+# Embedding providers
+# -----------------------------
+# Every provider exposes `encode(texts, batch_size=..., show_progress_bar=...)` like
+# SentenceTransformer: a str gives a 1-D vector, a list gives a 2-D array (L2-normalized).
+
+class TorchEmbedder:
+    """The original PyTorch path through SentenceTransformer."""
+
+    def __init__(self, model_name: str, threads: int = 0):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.name = "torch"
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs):
+        return self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar, **kwargs)
+
+
+class OnnxEmbedder:
+    """
+    ONNX Runtime inference of the exported transformer, followed by the same mean pooling
+    and L2 normalization as the all-MiniLM-L6-v2 SentenceTransformer pipeline.
+    Only needs `onnxruntime` and `tokenizers` at serving time (no torch).
+    """
+
+    def __init__(self, model_path: str, tokenizer_path: str, threads: int = 0,
+                 max_length: int = EMBED_MAX_LENGTH, name: str = "onnx"):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.name = name
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        pad_token = "[PAD]" if self.tokenizer.token_to_id("[PAD]") is not None else None
+        if pad_token:
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+        else:
+            self.tokenizer.enable_padding()
+
+    def _encode_batch(self, texts: List[str]):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        hidden = self.session.run(None, feeds)[0]  # (batch, tokens, dim)
+
+        # Mean pooling over real tokens, then L2 normalization
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = np.concatenate([
+            self._encode_batch(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)
+        ])
+        return embeddings[0] if single else embeddings
+
+
+def create_embedder(model_name: str, backend: str = EMBED_BACKEND, threads: int = EMBED_THREADS,
+                    onnx_dir: str = EMBED_ONNX_DIR):
+    """Build the configured embedding provider."""
+    if backend == "torch":
+        return TorchEmbedder(model_name, threads=threads)
+    if backend in ONNX_MODEL_FILES:
+        model_path = os.path.join(onnx_dir, ONNX_MODEL_FILES[backend])
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"{model_path} not found; export it first with `python -m app.utils.embeddings export`"
+            )
+        return OnnxEmbedder(model_path, os.path.join(onnx_dir, "tokenizer.json"), threads=threads, name=backend)
+    raise ValueError(f"Unknown EMBED_BACKEND: {backend}")
+
+# -----------------------------
+# Export (needs torch; quantization also needs the `onnx` package)
+# -----------------------------
+def export_onnx(model_name: str, out_dir: str = EMBED_ONNX_DIR, quantize: bool = True):
+    """Export the SentenceTransformer's transformer to ONNX (and an int8-quantized copy)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    model.tokenizer.save_pretrained(out_dir)  # writes tokenizer.json
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.inner(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            )[0]
+
+    sample = model.tokenizer(["chickpeas tomato garam masala"], return_tensors="pt")
+    model_path = os.path.join(out_dir, ONNX_MODEL_FILES["onnx"])
+    dynamic = {0: "batch", 1: "tokens"}
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer),
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            model_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": dynamic, "attention_mask": dynamic, "token_type_ids": dynamic,
+                "last_hidden_state": dynamic
+            },
+            opset_version=17,
+            dynamo=False
+        )
+    print(f"✅ Exported ONNX model to {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        int8_path = os.path.join(out_dir, ONNX_MODEL_FILES["onnx-int8"])
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"✅ Wrote int8-quantized model to {int8_path}")
+
+# -----------------------------
+# Latency & parity report
+# -----------------------------
+def top_k_neighbors(queries, corpus, k: int):
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def compare_backends(model_name: str, texts: List[str], queries: List[str], backends=("onnx", "onnx-int8"),
+                     threads: int = EMBED_THREADS, k: int = 10, onnx_dir: str = EMBED_ONNX_DIR):
+    """
+    Embed `texts` (catalog) and `queries` with the torch baseline and each other backend.
+    Reports per-query latency, batch throughput, cosine parity of the embeddings and
+    recall@k of each backend's nearest neighbors against the torch neighbors.
+    """
+    def measure(embedder):
+        embedder.encode(queries[:1])  # warm up
+        start = time.perf_counter()
+        corpus = embedder.encode(texts, batch_size=64)
+        batch_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        query_vectors = np.stack([embedder.encode(q) for q in queries])
+        query_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        return corpus, query_vectors, batch_seconds, query_ms
+
+    baseline = measure(create_embedder(model_name, "torch", threads, onnx_dir))
+    baseline_neighbors = top_k_neighbors(baseline[1], baseline[0], k)
+
+    report = {"torch": {
+        "query_ms": round(baseline[3], 3),
+        "texts_per_second": round(len(texts) / baseline[2], 1) if baseline[2] else None
+    }}
+    for backend in backends:
+        try:
+            corpus, query_vectors, batch_seconds, query_ms = measure(
+                create_embedder(model_name, backend, threads, onnx_dir)
+            )
+        except Exception as e:
+            report[backend] = {"error": str(e)}
+            continue
+        cosine = np.sum(corpus * baseline[0], axis=1)
+        neighbors = top_k_neighbors(query_vectors, corpus, k)
+        recall = np.mean([
+            len(set(a) & set(b)) / len(a) for a, b in zip(neighbors, baseline_neighbors)
+        ])
+        report[backend] = {
+            "query_ms": round(query_ms, 3),
+            "texts_per_second": round(len(texts) / batch_seconds, 1) if batch_seconds else None,
+            "cosine_mean": round(float(cosine.mean()), 5),
+            "cosine_min": round(float(cosine.min()), 5),
+            f"recall@{k}": round(float(recall), 4)
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    from app.utils import vector_db
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "compare"
+    if command == "export":
+        export_onnx(vector_db.EMBED_MODEL_NAME)
+    elif command == "compare":
+        recipes = list(vector_db.iter_recipes(vector_db.JSON_PATH))
+        texts = [vector_db.recipe_text(r) for r in recipes]
+        # Pantry-style queries: each recipe's first few ingredients
+        queries = [" ".join(r["ingredients"][:3]) for r in recipes]
+        print(json.dumps(compare_backends(vector_db.EMBED_MODEL_NAME, texts, queries), indent=2))
+    else:
+        print("Usage: python -m app.utils.embeddings [export|compare]")
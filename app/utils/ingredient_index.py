@@ -0,0 +1,221 @@
+# file: app/utils/ingredient_index.py
+
+from collections import Counter
+from typing import List
+import json
+import os
+import numpy as np
+
+
+def canonical_ingredient(name: str):
+    """Canonical form of an ingredient / pantry item: lowercase with collapsed whitespace."""
+    return " ".join(name.lower().split())
+
+
+def split_ingredients(ingredients):
+    """Ingredient list from Chroma metadata (comma-joined string) or a raw recipe (list)."""
+    if isinstance(ingredients, str):
+        ingredients = ingredients.split(",")
+    return [canonical_ingredient(i) for i in ingredients if i.strip()]
+
+# -----------------------------
+# Inverted ingredient index
+# -----------------------------
+class IngredientIndex:
+    """
+    Canonical ingredient vocabulary, per-recipe ingredient-ID sets and an inverted
+    index (ingredient ID -> recipe rows), so pantry matching is set intersection
+    instead of string splitting.
+
+    Once `columnar()` has been built, the per-recipe metadata dicts, ID sets and postings
+    are dropped and the columnar store is the only copy: `recipes` then materializes dicts
+    from it on access (saving, BM25), and `add` / `remove` expand them again first.
+    """
+
+    def __init__(self, version: str = "0"):
+        self.version = version
+        self.vocab = {}                  # ingredient -> ingredient ID
+        self.rows = {}                   # recipe id -> row
+        self._recipes = []               # row -> recipe metadata (None once compacted)
+        self._ingredient_ids = []        # row -> frozenset of ingredient IDs (None once compacted)
+        self._postings = []              # ingredient ID -> list of rows (None once compacted)
+        self._store = None               # columnar copy for scoring (see `columnar`)
+
+    @property
+    def recipes(self):
+        """row -> recipe metadata: the dict list, or a lazy view of the columnar store."""
+        return self._recipes if self._recipes is not None else self._store.metadatas()
+
+    def _expand(self):
+        """Rebuild the per-recipe dicts, ID sets and postings from the store before a mutation."""
+        if self._recipes is not None:
+            return
+        store = self._store
+        self.rows = dict(self.rows)  # shared with the store while compacted
+        self._recipes = list(store.metadatas())
+        self._ingredient_ids = [frozenset(store.row_ingredient_ids(row).tolist()) for row in range(len(store))]
+        self._postings = [[] for _ in self.vocab]
+        for row, ids in enumerate(self._ingredient_ids):
+            for ing_id in ids:
+                self._postings[ing_id].append(row)
+
+    def ingredient_id(self, name: str):
+        name = canonical_ingredient(name)
+        if name not in self.vocab:
+            self.vocab[name] = len(self.vocab)
+            self._postings.append([])
+        return self.vocab[name]
+
+    def add(self, metadata):
+        """Add (or replace) one recipe's metadata."""
+        self._expand()
+        rid = str(metadata.get("id", ""))
+        ids = frozenset(self.ingredient_id(i) for i in split_ingredients(metadata.get("ingredients", "")))
+
+        row = self.rows.get(rid)
+        if row is not None:
+            # Replace: drop the old postings first
+            for ing_id in self._ingredient_ids[row]:
+                self._postings[ing_id].remove(row)
+            self._recipes[row] = metadata
+            self._ingredient_ids[row] = ids
+        else:
+            row = len(self._recipes)
+            self.rows[rid] = row
+            self._recipes.append(metadata)
+            self._ingredient_ids.append(ids)
+
+        for ing_id in ids:
+            self._postings[ing_id].append(row)
+        self._store = None
+
+    def remove(self, recipe_id):
+        """Remove one recipe (the last row moves into its slot); returns False if it wasn't indexed."""
+        if str(recipe_id) not in self.rows:
+            return False
+        self._expand()
+        row = self.rows.pop(str(recipe_id))
+        for ing_id in self._ingredient_ids[row]:
+            self._postings[ing_id].remove(row)
+
+        last = len(self._recipes) - 1
+        if row != last:
+            for ing_id in self._ingredient_ids[last]:
+                postings = self._postings[ing_id]
+                postings[postings.index(last)] = row
+            self._recipes[row] = self._recipes[last]
+            self._ingredient_ids[row] = self._ingredient_ids[last]
+            self.rows[str(self._recipes[row].get("id", ""))] = row
+        self._recipes.pop()
+        self._ingredient_ids.pop()
+        self._store = None
+        return True
+
+    def copy(self, version: str = None):
+        """
+        Independent, expanded copy to patch with `add` / `remove` while readers keep using this
+        one (containers are copied, the metadata dicts and ingredient-ID sets are shared).
+        """
+        index = IngredientIndex(version=self.version if version is None else version)
+        index.vocab = dict(self.vocab)
+        index.rows = dict(self.rows)
+        if self._recipes is None:
+            index._recipes, index._store = None, self._store
+            index._expand()
+            index._store = None
+        else:
+            index._recipes = list(self._recipes)
+            index._ingredient_ids = list(self._ingredient_ids)
+            index._postings = [list(rows) for rows in self._postings]
+        return index
+
+    def columnar(self):
+        """
+        Columnar `RecipeStore` with the same rows and ingredient IDs (built once, dropped on
+        `add` / `remove`). Building it compacts the index (see the class docstring).
+        """
+        from app.utils.recipe_store import RecipeStore
+
+        if self._store is None:
+            self._store = RecipeStore.from_index(self)
+            self.rows = self._store.rows
+            self._recipes = self._ingredient_ids = self._postings = None
+        return self._store
+
+    def ingredient_id_sets(self):
+        """row -> ingredient IDs (frozensets, or sorted arrays once compacted)."""
+        if self._ingredient_ids is not None:
+            return self._ingredient_ids
+        return [self._store.row_ingredient_ids(row) for row in range(len(self._store))]
+
+    def pantry_ids(self, pantry_items: List[str]):
+        """Ingredient IDs for the pantry items that exist in the vocabulary."""
+        return frozenset(
+            self.vocab[name] for name in map(canonical_ingredient, pantry_items) if name in self.vocab
+        )
+
+    def match_count(self, recipe_id, pantry_ids):
+        """Number of pantry ingredients used by a recipe (None if the recipe isn't indexed)."""
+        row = self.rows.get(str(recipe_id))
+        if row is None:
+            return None
+        if self._ingredient_ids is None:
+            return len(pantry_ids.intersection(self._store.row_ingredient_ids(row).tolist()))
+        return len(self._ingredient_ids[row] & pantry_ids)
+
+    def top_overlap(self, pantry_ids, limit: int = 50):
+        """Recipes sharing the most ingredients with the pantry: list of `(metadata, match_count)`."""
+        if self._postings is None:
+            rows, counts = self._store.top_overlap(np.array(sorted(pantry_ids), dtype=np.int32), limit=limit)
+            return [(self._store.metadata(int(row)), int(count)) for row, count in zip(rows, counts)]
+        counts = Counter()
+        for ing_id in pantry_ids:
+            counts.update(self._postings[ing_id])
+        return [(self._recipes[row], count) for row, count in counts.most_common(limit)]
+
+    def __len__(self):
+        return len(self.rows)
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path: str):
+        """Write the index atomically as JSON (vocabulary + recipes with ingredient IDs)."""
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        data = {
+            "version": self.version,
+            "vocab": vocab,
+            "recipes": [
+                {"metadata": metadata, "ingredient_ids": sorted(int(i) for i in ids)}
+                for metadata, ids in zip(self.recipes, self.ingredient_id_sets())
+            ]
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data))  # json.dump to a file can't use the C encoder
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        index = cls(version=data.get("version", "0"))
+        index.vocab = {name: i for i, name in enumerate(data["vocab"])}
+        index._postings = [[] for _ in data["vocab"]]
+        for row, entry in enumerate(data["recipes"]):
+            metadata = entry["metadata"]
+            ids = frozenset(entry["ingredient_ids"])
+            index.rows[str(metadata.get("id", ""))] = row
+            index._recipes.append(metadata)
+            index._ingredient_ids.append(ids)
+            for ing_id in ids:
+                index._postings[ing_id].append(row)
+        return index
+
+    @classmethod
+    def build(cls, metadatas, version: str = "0"):
+        index = cls(version=version)
+        for metadata in metadatas:
+            index.add(metadata)
+        return index
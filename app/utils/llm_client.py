@@ -0,0 +1,214 @@
+# file: app/utils/llm_client.py
+
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+import ollama
+
+# -----------------------------
+# Settings
+# -----------------------------
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3.2:1b")
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", "15"))  # per HTTP call
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "2"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))  # extra attempts after the first
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "0.5"))  # doubled per attempt
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "8"))  # keep-alive connections to Ollama
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # consecutive failures to open
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))  # open -> half-open
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the model while the circuit breaker is open."""
+
+# -----------------------------
+# Circuit breaker
+# -----------------------------
+class CircuitBreaker:
+    """
+    closed: calls go through; `failure_threshold` consecutive failures open the circuit.
+    open: calls are rejected immediately for `reset_seconds`.
+    half-open: one trial call is let through; success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half-open"
+                self._trial_running = False
+            if self.state == "closed":
+                return True
+            if self.state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def release(self):
+        """The call was never sent (e.g. no free pooled connection): no verdict on Ollama's health."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+# -----------------------------
+# Pooled Ollama client
+# -----------------------------
+def is_retryable(error):
+    """Transport problems, timeouts, 429 and 5xx are retried; 4xx and bad model output are not."""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the caller's deadline leaves no time for (another) attempt."""
+
+
+class _TimeoutClient(ollama.Client):
+    """`ollama.Client` whose HTTP timeout can be shortened per call (its methods don't take one)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def _request_raw(self, *args, **kwargs):
+        timeout = getattr(self._local, "timeout", None)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return super()._request_raw(*args, **kwargs)
+
+
+class LLMClient:
+    """
+    One shared `ollama.Client` (a keep-alive httpx connection pool) with per-call timeouts,
+    bounded retries with exponential backoff + jitter, and a circuit breaker that fails fast
+    while Ollama is unhealthy, so callers go straight to their fallback.
+    With a `deadline`, attempts and backoff are cut to fit it, so a call never outlives its caller.
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, model: str = LLM_MODEL, timeout: float = LLM_CALL_TIMEOUT_SECONDS,
+                 retries: int = LLM_RETRIES, backoff: float = LLM_RETRY_BACKOFF_SECONDS,
+                 pool_size: int = LLM_POOL_SIZE, breaker: CircuitBreaker = None):
+        self.host = host
+        self.model = model
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+        self._client = _TimeoutClient(
+            host=host,
+            timeout=httpx.Timeout(timeout, connect=min(LLM_CONNECT_TIMEOUT_SECONDS, timeout)),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def chat(self, prompt: str, format: str = "json", deadline: float = None):
+        """
+        Model reply text for one user prompt. Raises `CircuitOpenError` or the last error.
+        `deadline` is a `time.monotonic()` timestamp: each attempt's HTTP timeout is capped by the
+        time left, and no retry starts that couldn't finish before it.
+        """
+        if deadline is not None and deadline <= time.monotonic():
+            raise DeadlineExceeded("no time left for an Ollama call")
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Ollama at {self.host} is unhealthy; circuit open")
+
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            try:
+                self._client._local.timeout = self._attempt_timeout(deadline)
+                response = self._client.chat(
+                    model=self.model, messages=[{"role": "user", "content": prompt}], format=format
+                )
+            except httpx.PoolTimeout:
+                # No free pooled connection: local contention, not an Ollama failure
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # The server answered: it's healthy even if the request was rejected
+                    self.breaker.record_success()
+                    raise
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+                if attempt == self.retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                self.retried += 1
+                time.sleep(delay)
+                continue
+            finally:
+                self._client._local.timeout = None
+            self.breaker.record_success()
+            return response["message"]["content"]
+
+    def _attempt_timeout(self, deadline):
+        """HTTP timeout for one attempt: the per-call timeout, cut to the time left before `deadline`."""
+        if deadline is None:
+            return None
+        left = max(0.001, min(self.timeout, deadline - time.monotonic()))
+        return httpx.Timeout(left, connect=min(LLM_CONNECT_TIMEOUT_SECONDS, left))
+
+    def chat_json(self, prompt: str, deadline: float = None):
+        """Parsed JSON reply (raises ValueError on malformed model output)."""
+        return json.loads(self.chat(prompt, format="json", deadline=deadline))
+
+    def close(self):
+        self._client._client.close()
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "model": self.model,
+            "calls": self.calls,
+            "retries": self.retried,
+            "failures": self.failures,
+            "breaker": self.breaker.stats()
+        }
+
+
+llm_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Process-wide client (created on first use, shared by all worker threads)."""
+    global llm_client
+    if llm_client is None:
+        with _client_lock:
+            if llm_client is None:
+                llm_client = LLMClient()
+    return llm_client
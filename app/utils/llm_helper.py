@@ -1,14 +1,93 @@
 # file: app/utils/llm_helper.py
 
-import ollama
+import hashlib
 import json
+import os
 
-def generate_recipe_details(recipe, pantry_items, diet=None, cuisine=None, time_available=None, servings_required=None):
+from app.utils.cache import BoundedDiskCache
+from app.utils.llm_client import get_llm_client, CircuitOpenError, LLM_MODEL
+from app.utils.metrics import registry, timed
+from app.utils.ingredient_index import canonical_ingredient, split_ingredients
+
+# -----------------------------
+# Settings
+# -----------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # app/utils
+APP_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))  # app
+
+# Durable enrichment cache (empty path disables it)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(APP_DIR, "cache", "llm_enrichment.sqlite3"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
+
+enrichment_cache = None
+
+
+def get_enrichment_cache(create: bool = True):
     """
-    Generate instructions, substitutions, and rank using Ollama LLM.
-    If LLM is not used or fails, fallback safely handles ingredients.
+    Shared SQLite enrichment cache (opened on first use; None when disabled).
+    With `create=False` (stats, metrics) a cache file that doesn't exist yet is not created.
     """
-    prompt = f"""
+    global enrichment_cache
+    if enrichment_cache is None and LLM_CACHE_PATH and (create or os.path.exists(LLM_CACHE_PATH)):
+        enrichment_cache = BoundedDiskCache(LLM_CACHE_PATH, max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024))
+    return enrichment_cache
+
+# -----------------------------
+# Enrichment cache key
+# -----------------------------
+def missing_ingredients(recipe, pantry_items):
+    """Canonical recipe ingredients that are not in the pantry, sorted."""
+    pantry = {canonical_ingredient(item) for item in pantry_items}
+    return sorted(set(split_ingredients(recipe.get("ingredients", []))) - pantry)
+
+
+def enrichment_key(recipe, pantry_items, diet=None, cuisine=None, model: str = LLM_MODEL):
+    """
+    Key for a recipe's generated details. Instructions and substitutions depend on the
+    recipe and on what is missing from the pantry, not on the rest of the pantry.
+    Time and servings are left out: recipes are already filtered to match them exactly.
+    The content hash ties entries to the recipe's current content (recipes can be edited in place).
+    """
+    key = {
+        "recipe": str(recipe.get("id") or recipe.get("name", "")),
+        "content": recipe.get("content_hash", ""),
+        "missing": missing_ingredients(recipe, pantry_items),
+        "diet": (diet or "").strip().lower(),
+        "cuisine": (cuisine or "").strip().lower(),
+        "model": model
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+# -----------------------------
+# LLM enrichment
+# -----------------------------
+def call_llm_json(prompt, deadline: float = None):
+    """
+    Send one prompt to the model through the shared pooled client and parse its JSON answer.
+    Raises on any failure, including immediately while the circuit breaker is open.
+    `deadline` (a `time.monotonic()` timestamp) bounds the call including its retries.
+    Outcomes are counted in `llm_calls_total{outcome=ok|error|circuit_open}`.
+    """
+    try:
+        with timed("llm_call"):
+            data = get_llm_client().chat_json(prompt, deadline=deadline)
+    except CircuitOpenError:
+        registry.inc("llm_calls_total", outcome="circuit_open")
+        raise
+    except Exception:
+        registry.inc("llm_calls_total", outcome="error")
+        raise
+    registry.inc("llm_calls_total", outcome="ok")
+    return data
+
+
+def format_ingredients(recipe):
+    ingredients = recipe.get("ingredients", [])
+    return ", ".join(ingredients) if isinstance(ingredients, list) else ingredients
+
+
+def build_prompt(recipe, pantry_items, diet=None, cuisine=None, time_available=None, servings_required=None):
+    return f"""
 User Pantry: {', '.join(pantry_items)}
 Diet: {diet or 'any'}
 Cuisine: {cuisine or 'any'}
@@ -17,7 +96,7 @@ Servings: {servings_required or 'any'}
 
 Candidate Recipe:
 Name: {recipe['name']}
-Ingredients: {', '.join(recipe.get('ingredients', [])) if isinstance(recipe.get('ingredients', []), list) else recipe.get('ingredients', '')}
+Ingredients: {format_ingredients(recipe)}
 Tags: {recipe.get('tags', '')}
 Time: {recipe.get('time_minutes', 'unknown')} minutes
 Servings: {recipe.get('servings', 'unknown')}
@@ -28,21 +107,231 @@ Generate:
 3. Rank the recipe suitability (high/medium/low).
 Output in JSON format only.
 """
+
+
+def fallback_recipe_details(recipe):
+    """Details built from the recipe alone, used when the LLM is unavailable."""
+    ingredients = recipe.get("ingredients", [])
+    if isinstance(ingredients, str):
+        # Convert string of ingredients to a proper list by splitting commas
+        ingredients = [i.strip() for i in ingredients.split(",") if i.strip()]
+    return {
+        "name": recipe["name"],
+        "rank": "high",
+        "instructions": [f"Use available ingredients: {', '.join(ingredients)}"],
+        "substitutions": [],
+        "match_score": recipe.get("match_score", 0),
+        "fallback": True
+    }
+
+
+def valid_details(details):
+    """Whether a model reply is usable: non-empty instructions list, substitutions (if any) a list."""
+    return (isinstance(details, dict) and isinstance(details.get("instructions"), list) and bool(details["instructions"])
+            and isinstance(details.get("substitutions", []), list))
+
+
+def generate_recipe_details(recipe, pantry_items, diet=None, cuisine=None, time_available=None, servings_required=None,
+                            deadline: float = None):
+    """
+    Generate instructions, substitutions, and rank using Ollama LLM.
+    Successful generations are stored in the enrichment cache, so a recipe with the same
+    missing ingredients, diet and cuisine costs no model call next time.
+    If LLM is not used or fails, fallback safely handles ingredients.
+    """
+    cache = get_enrichment_cache()
+    key = enrichment_key(recipe, pantry_items, diet, cuisine) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return dict(cached, match_score=recipe.get("match_score", 0))
+
+    prompt = build_prompt(recipe, pantry_items, diet, cuisine, time_available, servings_required)
     try:
-        llm_response = ollama.chat(prompt)  # Call LLM
-        data = json.loads(llm_response)
+        data = call_llm_json(prompt, deadline=deadline)  # Call LLM
+        if not valid_details(data):
+            raise ValueError("LLM reply has no usable instructions")
+        if cache is not None:
+            cache.set(key, data)
         data["match_score"] = recipe.get("match_score", 0)
         return data
     except Exception:
-        # Fallback if LLM fails or not used
-        ingredients = recipe.get("ingredients", [])
-        if isinstance(ingredients, str):
-            # Convert string of ingredients to a proper list by splitting commas
-            ingredients = [i.strip() for i in ingredients.split(",") if i.strip()]
-        return {
-            "name": recipe["name"],
-            "rank": "high",
-            "instructions": [f"Use available ingredients: {', '.join(ingredients)}"],
-            "substitutions": [],
-            "match_score": recipe.get("match_score", 0)
-        }
+        # Fallback if LLM fails or not used (never cached)
+        return fallback_recipe_details(recipe)
+
+def build_batch_prompt(recipes, pantry_items, diet=None, cuisine=None, time_available=None, servings_required=None):
+    """One prompt for several recipes: the shared preamble once, each recipe under its own key."""
+    candidates = "\n".join(
+        f"[{key}] {recipe['name']} | Ingredients: {format_ingredients(recipe)} | Tags: {recipe.get('tags', '')} | "
+        f"Time: {recipe.get('time_minutes', 'unknown')} min | Servings: {recipe.get('servings', 'unknown')}"
+        for key, recipe in recipes.items()
+    )
+    return f"""
+User Pantry: {', '.join(pantry_items)}
+Diet: {diet or 'any'}
+Cuisine: {cuisine or 'any'}
+Max time: {time_available or 'any'}
+Servings: {servings_required or 'any'}
+
+Candidate Recipes:
+{candidates}
+
+For EVERY candidate recipe generate:
+1. Step-by-step cooking instructions.
+2. Ingredient substitutions if something is missing in the pantry.
+3. Rank the recipe suitability (high/medium/low).
+Output in JSON format only, one entry per recipe key:
+{{"<key>": {{"instructions": ["..."], "substitutions": ["..."], "rank": "high"}}, ...}}
+"""
+
+
+def generate_batch_details(recipes, pantry_items, diet=None, cuisine=None, time_available=None, servings_required=None,
+                           deadline: float = None):
+    """
+    Details for several recipes from a single LLM call (recipes already in the enrichment
+    cache are not sent). Returns one entry per recipe, in order; an entry is None when the
+    model's answer has no usable result for that recipe, so the caller can fall back for it.
+    Raises if the call itself fails.
+    """
+    cache = get_enrichment_cache()
+    keys = [enrichment_key(recipe, pantry_items, diet, cuisine) for recipe in recipes]
+    results = [cache.get(key) if cache is not None else None for key in keys]
+
+    todo = {f"r{i}": recipe for i, (recipe, result) in enumerate(zip(recipes, results)) if result is None}
+    if todo:
+        data = call_llm_json(
+            build_batch_prompt(todo, pantry_items, diet, cuisine, time_available, servings_required), deadline=deadline
+        )
+        if isinstance(data.get("recipes"), dict):
+            data = data["recipes"]
+        for key in todo:
+            i = int(key[1:])
+            details = data.get(key)
+            if valid_details(details):
+                results[i] = details
+                if cache is not None:
+                    cache.set(keys[i], details)
+
+    return [
+        dict(result, match_score=recipe.get("match_score", 0)) if result is not None else None
+        for recipe, result in zip(recipes, results)
+    ]
+
+
+# -----------------------------
+# Precomputed base instructions & personalization
+# -----------------------------
+def generate_base_instructions(recipe):
+    """
+    Canonical step-by-step instructions for a recipe, independent of any pantry.
+    Used by the offline precompute job; raises if the model gives no usable steps.
+    """
+    prompt = f"""
+Recipe:
+Name: {recipe['name']}
+Ingredients: {format_ingredients(recipe)}
+Tags: {recipe.get('tags', '')}
+Time: {recipe.get('time_minutes', 'unknown')} minutes
+Servings: {recipe.get('servings', 'unknown')}
+
+Write concise step-by-step cooking instructions for this recipe.
+Output in JSON format only: {{"instructions": ["step 1", "step 2", ...]}}
+"""
+    instructions = call_llm_json(prompt).get("instructions")
+    if not isinstance(instructions, list) or not instructions:
+        raise ValueError("no instructions in model output")
+    return [str(step) for step in instructions]
+
+
+def generate_substitutions(recipe, pantry_items, diet=None, cuisine=None, deadline: float = None):
+    """
+    Personalization step for a recipe with precomputed instructions: only substitutions
+    for the ingredients missing from the pantry (cached like full enrichments).
+    """
+    missing = missing_ingredients(recipe, pantry_items)
+    if not missing:
+        return []
+
+    cache = get_enrichment_cache()
+    key = "substitutions:" + enrichment_key(recipe, pantry_items, diet, cuisine)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    prompt = f"""
+User Pantry: {', '.join(pantry_items)}
+Diet: {diet or 'any'}
+Cuisine: {cuisine or 'any'}
+Recipe: {recipe['name']}
+Missing ingredients: {', '.join(missing)}
+
+Suggest substitutions for the missing ingredients, preferably from the pantry.
+Output in JSON format only: {{"substitutions": ["use X instead of Y", ...]}}
+"""
+    substitutions = call_llm_json(prompt, deadline=deadline).get("substitutions", [])
+    if cache is not None:
+        cache.set(key, substitutions)
+    return substitutions
+
+# -----------------------------
+# Offline pre-warming
+# -----------------------------
+def prewarm(jobs, workers: int = 2):
+    """
+    Fill the enrichment cache ahead of traffic. `jobs` yields
+    `(recipe, pantry_items, diet, cuisine, time_available, servings_required)`, i.e. the request
+    fields, so each entry is generated from the same prompt a live request would send.
+    Entries already cached are skipped. Returns `{"total", "cached", "generated"}`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = get_enrichment_cache()
+    if cache is None:
+        raise RuntimeError("LLM_CACHE_PATH is empty; the enrichment cache is disabled")
+
+    stats = {"total": 0, "cached": 0, "generated": 0}
+    todo = {}
+    for job in jobs:
+        recipe, pantry_items, diet, cuisine = job[:4]
+        stats["total"] += 1
+        key = enrichment_key(recipe, pantry_items, diet, cuisine)
+        if key in cache or key in todo:
+            stats["cached"] += 1
+        else:
+            todo[key] = job
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda job: generate_recipe_details(*job), todo.values()))
+    stats["generated"] = sum(1 for key in todo if key in cache)
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m app.utils.llm_helper requests.jsonl
+    # Each line is a /recommend-recipes body; its top recipes are enriched and cached.
+    import sys
+    from app.main import RecipeRequest, normalize_request, validate_request, find_top_recipes_batch
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m app.utils.llm_helper <requests.jsonl> [workers]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        requests = [normalize_request(RecipeRequest(**json.loads(line))) for line in f if line.strip()]
+    requests = [r for r in requests if not validate_request(r)]
+
+    jobs = []
+    for request, outcome in zip(requests, find_top_recipes_batch(requests)):
+        if isinstance(outcome, Exception):
+            continue
+        recipes, _ = outcome
+        jobs.extend(
+            (recipe, request.pantry_items, request.diet, request.cuisine, request.time_available, request.servings_required)
+            for recipe in recipes
+        )
+
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    print(f"🔥 Pre-warming {len(jobs)} recipe enrichments from {len(requests)} requests...")
+    print(json.dumps(prewarm(jobs, workers=workers), indent=2))
+    print(json.dumps(get_enrichment_cache().stats(), indent=2))
@@ -0,0 +1,183 @@
+# file: app/utils/metrics.py
+
+from contextlib import contextmanager, nullcontext
+import os
+import threading
+import time
+
+# -----------------------------
+# Settings
+# -----------------------------
+# OpenTelemetry spans are opt-in: OTEL_ENABLED=true, exported over OTLP when
+# OTEL_EXPORTER_OTLP_ENDPOINT is set (otherwise spans only reach an already-configured provider)
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() in ("1", "true", "yes")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "recipe-recommender")
+
+# Stage latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 5, 10, 20, 50, 100, 200)
+
+# -----------------------------
+# Histogram
+# -----------------------------
+class Histogram:
+    """Per-bucket counts (value <= bound, not cumulative) plus count/sum; thread-safe."""
+
+    def __init__(self, bounds=(1, 2, 4, 8, 16, 32, 64, 128)):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    break
+            else:
+                i = len(self.bounds)
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={b}" for b in self.bounds] + ["+Inf"]
+            return {
+                "buckets": dict(zip(labels, self.counts)),
+                "count": self.count,
+                "sum": self.sum,
+                "mean": round(self.sum / self.count, 3) if self.count else 0.0
+            }
+
+# -----------------------------
+# Metrics registry (Prometheus text format)
+# -----------------------------
+class Registry:
+    """
+    Counters and histograms keyed by name + labels, plus gauges read from callbacks at
+    scrape time (e.g. cache hit ratios). `render()` gives the Prometheus exposition format.
+    """
+
+    def __init__(self, prefix: str = "recipe_"):
+        self.prefix = prefix
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # name -> callback returning {labels tuple: value}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(bounds=buckets))
+        histogram.observe(value)
+
+    def gauge(self, name: str, callback, help_text: str = ""):
+        self.gauges[name] = callback
+        if help_text:
+            self.help[name] = help_text
+
+    def describe(self, name: str, help_text: str):
+        self.help[name] = help_text
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = []
+
+        def header(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {self.prefix}{name} {self.help[name]}")
+            lines.append(f"# TYPE {self.prefix}{name} {kind}")
+
+        for name in sorted({name for name, _ in self.counters}):
+            header(name, "counter")
+            for (metric, labels), value in sorted(self.counters.items()):
+                if metric == name:
+                    lines.append(f"{self.prefix}{name}{self._labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            header(name, "histogram")
+            for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                snapshot = histogram.snapshot()
+                cumulative = 0
+                for bound, count in zip(list(histogram.bounds) + ["+Inf"], snapshot["buckets"].values()):
+                    cumulative += count
+                    lines.append(f"{self.prefix}{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.prefix}{name}_sum{self._labels(labels)} {snapshot['sum']}")
+                lines.append(f"{self.prefix}{name}_count{self._labels(labels)} {snapshot['count']}")
+
+        for name, callback in sorted(self.gauges.items()):
+            try:
+                values = callback()
+            except Exception:
+                continue
+            header(name, "gauge")
+            for labels, value in sorted(values.items()):
+                if value is not None:
+                    lines.append(f"{self.prefix}{name}{self._labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe("stage_duration_seconds", "Time spent per pipeline stage")
+registry.describe("candidates", "Candidate recipes per request before (retrieved) and after (filtered) scoring")
+registry.describe("llm_calls_total", "LLM calls by outcome")
+registry.describe("llm_fallbacks_total", "Recipes that got fallback details instead of LLM output")
+registry.describe("requests_total", "Recommendation requests by endpoint")
+registry.describe("batch_size", "Pantries per /recommend-recipes/batch call")
+
+# -----------------------------
+# Optional OpenTelemetry tracing
+# -----------------------------
+tracer = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace
+
+        if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+            provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+        tracer = trace.get_tracer(OTEL_SERVICE_NAME)
+    except ImportError:
+        print("⚠️ OTEL_ENABLED is set but opentelemetry is not installed; tracing disabled.")
+
+
+@contextmanager
+def timed(stage: str, **attributes):
+    """Record the block's duration in `stage_duration_seconds{stage=...}` (and as a span when tracing)."""
+    span = tracer.start_as_current_span(stage, attributes=attributes) if tracer is not None else nullcontext()
+    start = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            registry.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
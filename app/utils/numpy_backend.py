@@ -0,0 +1,332 @@
+# file: app/utils/numpy_backend.py
+
+import copy
+import json
+import os
+import threading
+import numpy as np
+
+# Rows scored per chunk when the matrix is float16 (converted to float32 chunk by chunk)
+SCORE_CHUNK_ROWS = 65536
+
+NUMERIC_COLUMNS = ("servings", "time_minutes")
+STRING_COLUMNS = (
+    "id", "name", "ingredients", "tags", "content_hash", "base_instructions", "base_instructions_hash"
+)
+
+
+def row_values(rid, metadata):
+    """String and numeric column values stored for one recipe's Chroma metadata."""
+    metadata = metadata or {}
+    strings = {name: metadata.get(name, "") for name in STRING_COLUMNS}
+    strings["id"] = str(metadata.get("id", rid))
+    numbers = {name: int(metadata.get(name, 0) or 0) for name in NUMERIC_COLUMNS}
+    return strings, numbers
+
+# -----------------------------
+# In-process brute-force vector store
+# -----------------------------
+class NumpyVectorStore:
+    """
+    Read-only snapshot of the recipe collection for in-process search:
+    - `embeddings.npy`: L2-normalized float32/float16 matrix, memory-mapped
+    - `servings.npy` / `time_minutes.npy`: typed numeric columns
+    - `columns.json`: string columns (id, name, ingredients, tags, ...) + snapshot info
+    - `delta.json` + `delta-<version>.npy` (optional): rows changed since the export, see `with_delta`
+    `query()` returns results shaped like Chroma's `collection.query()`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "columns.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        self.version = self.base_version = info.get("version", "0")
+        self.columns = info["columns"]
+        # Memory-mapped: pages are loaded on demand and shared through the OS page cache
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")[:len(self.columns["id"])]
+        self.numeric = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in NUMERIC_COLUMNS
+        }
+        # Rows appended by `with_delta` (after the base rows) and tombstones for replaced / deleted rows
+        self.delta_embeddings = np.zeros((0, self.embeddings.shape[1] if self.embeddings.ndim == 2 else 0),
+                                         dtype=np.float32)
+        self.deleted = np.zeros(len(self.columns["id"]), dtype=bool)
+        self._tag_masks = {}
+        self._lock = threading.Lock()
+        self._load_delta()
+
+    @property
+    def size(self):
+        """Rows including deleted ones (row numbers are stable until the next export)."""
+        return len(self.columns["id"])
+
+    def count(self):
+        return self.size - int(self.deleted.sum())
+
+    def delta_size(self):
+        return self.size - len(self.embeddings)
+
+    # -----------------------------
+    # Filtering
+    # -----------------------------
+    def _tag_mask(self, key: str):
+        """Boolean row mask for a `tag_<name>` flag (built once per tag)."""
+        with self._lock:
+            if key not in self._tag_masks:
+                tag = key[len("tag_"):]
+                self._tag_masks[key] = np.fromiter(
+                    (tag in {" ".join(t.lower().split()) for t in tags.split(",")} for tags in self.columns["tags"]),
+                    dtype=bool, count=self.size
+                )
+            return self._tag_masks[key]
+
+    def _mask(self, where):
+        """Evaluate the subset of Chroma `where` syntax produced by `build_where`."""
+        if "$and" in where:
+            mask = np.ones(self.size, dtype=bool)
+            for clause in where["$and"]:
+                mask &= self._mask(clause)
+            return mask
+
+        (key, value), = where.items()
+        if isinstance(value, dict):
+            (op, value), = value.items()
+            if op != "$eq":
+                raise ValueError(f"Unsupported operator for numpy backend: {op}")
+        if key in self.numeric:
+            return np.asarray(self.numeric[key]) == value
+        if key.startswith("tag_"):
+            mask = self._tag_mask(key)
+            return mask if value else ~mask
+        if key in self.columns:
+            return np.fromiter((v == value for v in self.columns[key]), dtype=bool, count=self.size)
+        return np.zeros(self.size, dtype=bool)
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    @staticmethod
+    def _matrix_scores(matrix, query):
+        if not len(matrix):
+            return np.zeros(0, dtype=np.float32)
+        if matrix.dtype == np.float32:
+            return matrix @ query
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), SCORE_CHUNK_ROWS):
+            chunk = np.asarray(matrix[start:start + SCORE_CHUNK_ROWS], dtype=np.float32)
+            scores[start:start + len(chunk)] = chunk @ query
+        return scores
+
+    def _scores(self, query, rows=None):
+        """Cosine similarity of the query against all rows (or the given sorted row indices)."""
+        if not len(self.delta_embeddings):
+            return self._matrix_scores(self.embeddings if rows is None else self.embeddings[rows], query)
+        base = len(self.embeddings)
+        if rows is None:
+            return np.concatenate([self._matrix_scores(self.embeddings, query), self.delta_embeddings @ query])
+        split = np.searchsorted(rows, base)
+        return np.concatenate([
+            self._matrix_scores(self.embeddings[rows[:split]], query),
+            self.delta_embeddings[rows[split:] - base] @ query
+        ])
+
+    def metadata(self, row: int):
+        """Materialize one row as the metadata dict Chroma would return."""
+        metadata = {name: self.columns[name][row] for name in STRING_COLUMNS if name in self.columns}
+        for name in NUMERIC_COLUMNS:
+            metadata[name] = int(self.numeric[name][row])
+        return metadata
+
+    def query(self, query_embeddings, n_results: int = 10, where: dict = None, **kwargs):
+        ids, metadatas, distances = [], [], []
+        mask = self._mask(where) if where else None
+        if self.deleted.any():
+            mask = ~self.deleted if mask is None else mask & ~self.deleted
+        rows = np.flatnonzero(mask) if mask is not None else None
+
+        for query in query_embeddings:
+            query = np.asarray(query, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm:
+                query = query / norm
+
+            scores = self._scores(query, rows)
+            k = min(n_results, len(scores))
+            if k == 0:
+                top = np.empty(0, dtype=np.int64)
+            else:
+                # argpartition: O(n) selection of the top k, then sort only those k
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+            top_rows = top if rows is None else rows[top]
+
+            ids.append([self.columns["id"][row] for row in top_rows])
+            metadatas.append([self.metadata(row) for row in top_rows])
+            distances.append((1.0 - scores[top]).tolist())  # cosine distance
+
+        return {"ids": ids, "metadatas": metadatas, "distances": distances}
+
+    # -----------------------------
+    # Incremental updates
+    # -----------------------------
+    def _load_delta(self):
+        """Apply the saved delta segment, if it belongs to this base snapshot."""
+        delta_path = os.path.join(self.path, "delta.json")
+        if not os.path.exists(delta_path):
+            return
+        with open(delta_path, "r", encoding="utf-8") as f:
+            delta = json.load(f)
+        if delta.get("base_version") != self.base_version:
+            return  # left over from before the last export
+        self.version = delta["version"]
+        self.delta_embeddings = np.load(os.path.join(self.path, delta["embeddings"]))
+        self.columns = {name: self.columns[name] + delta["columns"][name] for name in self.columns}
+        self.numeric = {
+            name: np.concatenate([self.numeric[name], np.asarray(delta["numeric"][name], dtype=np.int32)])
+            for name in NUMERIC_COLUMNS
+        }
+        self.deleted = np.zeros(self.size, dtype=bool)
+        self.deleted[delta["deleted"]] = True
+
+    def _save_delta(self):
+        """Write the delta segment (all rows appended since the export + tombstones); delta.json goes last."""
+        base = len(self.embeddings)
+        embeddings_name = f"delta-{self.version}.npy"
+        np.save(os.path.join(self.path, embeddings_name), self.delta_embeddings)
+        previous = None
+        delta_path = os.path.join(self.path, "delta.json")
+        if os.path.exists(delta_path):
+            with open(delta_path, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("embeddings")
+
+        tmp_path = delta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "base_version": self.base_version,
+                "version": self.version,
+                "embeddings": embeddings_name,
+                "deleted": np.flatnonzero(self.deleted).tolist(),
+                "columns": {name: values[base:] for name, values in self.columns.items()},
+                "numeric": {name: self.numeric[name][base:].tolist() for name in NUMERIC_COLUMNS}
+            }, f)
+        os.replace(tmp_path, delta_path)
+        if previous and previous != embeddings_name and os.path.exists(os.path.join(self.path, previous)):
+            os.remove(os.path.join(self.path, previous))
+
+    def with_delta(self, ids, embeddings, metadatas, deleted_ids=(), version: str = None):
+        """
+        New store with `ids` upserted (appended, any older row for the same id tombstoned) and
+        `deleted_ids` tombstoned, saved to disk as a delta segment next to the base snapshot.
+        The base matrix stays memory-mapped and untouched; this store keeps serving unchanged.
+        """
+        store = copy.copy(self)
+        live = {rid: row for row, rid in enumerate(self.columns["id"]) if not self.deleted[row]}
+        drop = [live[rid] for rid in list(ids) + list(deleted_ids) if rid in live]
+
+        rows = [row_values(rid, metadata) for rid, metadata in zip(ids, metadatas)]
+        if rows:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+            store.delta_embeddings = np.vstack([self.delta_embeddings.reshape(-1, vectors.shape[1]), vectors])
+        store.columns = {
+            name: values + [r[0][name] for r in rows] for name, values in self.columns.items()
+        }
+        store.numeric = {
+            name: np.concatenate([self.numeric[name], np.array([r[1][name] for r in rows], dtype=np.int32)])
+            for name in NUMERIC_COLUMNS
+        }
+        store.deleted = np.concatenate([self.deleted, np.zeros(len(rows), dtype=bool)])
+        store.deleted[drop] = True
+        store.version = self.version if version is None else version
+        store._tag_masks = {}
+        store._lock = threading.Lock()
+        store._save_delta()
+        return store
+
+    # -----------------------------
+    # Snapshot export
+    # -----------------------------
+    @staticmethod
+    def export(collection, path: str, version: str = "0", dtype: str = "float32", page_size: int = 1024):
+        """Write a snapshot of a Chroma collection, paging through it with bounded memory."""
+        os.makedirs(path, exist_ok=True)
+        # A new base snapshot supersedes the delta segment
+        for name in os.listdir(path):
+            if name == "delta.json" or (name.startswith("delta-") and name.endswith(".npy")):
+                os.remove(os.path.join(path, name))
+        total = collection.count()
+        dim = None
+        embeddings = None
+        numeric = {name: np.zeros(total, dtype=np.int32) for name in NUMERIC_COLUMNS}
+        columns = {name: [] for name in STRING_COLUMNS}
+
+        offset = 0
+        while offset < total:
+            page = collection.get(limit=page_size, offset=offset, include=["embeddings", "metadatas"])
+            if not page["ids"]:
+                break
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+
+            if embeddings is None:
+                dim = vectors.shape[1]
+                embeddings = np.lib.format.open_memmap(
+                    os.path.join(path, "embeddings.npy.tmp"), mode="w+", dtype=dtype, shape=(total, dim)
+                )
+            embeddings[offset:offset + len(vectors)] = vectors.astype(dtype)
+
+            for i, (rid, metadata) in enumerate(zip(page["ids"], page["metadatas"])):
+                strings, numbers = row_values(rid, metadata)
+                for name in NUMERIC_COLUMNS:
+                    numeric[name][offset + i] = numbers[name]
+                for name in STRING_COLUMNS:
+                    columns[name].append(strings[name])
+            offset += len(page["ids"])
+
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(path, "embeddings.npy.tmp"), mode="w+", dtype=dtype, shape=(0, 0)
+            )
+        embeddings.flush()
+        del embeddings
+        os.replace(os.path.join(path, "embeddings.npy.tmp"), os.path.join(path, "embeddings.npy"))
+        for name in NUMERIC_COLUMNS:
+            np.save(os.path.join(path, f"{name}.npy"), numeric[name][:offset])
+
+        # columns.json is written last: it marks the snapshot as complete
+        tmp_path = os.path.join(path, "columns.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "dtype": dtype, "dim": dim, "columns": columns}, f)
+        os.replace(tmp_path, os.path.join(path, "columns.json"))
+        return offset
+
+
+# -----------------------------
+# Benchmark against Chroma
+# -----------------------------
+if __name__ == "__main__":
+    import time
+    from app.utils import vector_db
+
+    store = vector_db.build_numpy_index()
+    print(f"📦 Exported {store.count()} recipes to {store.path} ({store.embeddings.dtype})")
+
+    # Use stored recipe embeddings as queries so both backends see identical inputs
+    sample = vector_db.get_collection().get(limit=100, include=["embeddings"])
+    queries = [list(map(float, e)) for e in sample["embeddings"]]
+    top_k = 10
+
+    for name, backend in (("chroma", vector_db.get_collection()), ("numpy", store)):
+        start = time.perf_counter()
+        results = [backend.query(query_embeddings=[q], n_results=top_k)["ids"][0] for q in queries]
+        elapsed = (time.perf_counter() - start) / max(len(queries), 1)
+        print(f"⏱️ {name:6s}: {elapsed * 1000:.3f} ms/query")
+        if name == "chroma":
+            chroma_results = results
+        else:
+            overlap = np.mean([
+                len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(chroma_results, results)
+            ]) if results else 0.0
+            print(f"🎯 top-{top_k} overlap with chroma: {overlap:.3f}")
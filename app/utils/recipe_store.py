@@ -0,0 +1,216 @@
+# file: app/utils/recipe_store.py
+
+from collections.abc import Sequence
+from typing import List
+import sys
+import numpy as np
+
+from app.utils.ingredient_index import canonical_ingredient, split_ingredients
+
+# Optional string columns carried through to enrichment (None when a recipe doesn't have them)
+EXTRA_COLUMNS = ("content_hash", "base_instructions", "base_instructions_hash")
+
+
+def split_tags(tags):
+    """Canonical tags from Chroma metadata (comma-joined string) or a raw recipe (list)."""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return [canonical_ingredient(t) for t in tags if t.strip()]
+
+
+def csr(lists):
+    """Ragged list of int lists -> (offsets, values) int32 arrays; row i is values[offsets[i]:offsets[i + 1]]."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    values = np.fromiter((v for values in lists for v in values), dtype=np.int32, count=int(offsets[-1]))
+    return offsets, values
+
+
+def gather(offsets, values, rows):
+    """Values of the given rows, concatenated, plus each row's start in the result (vectorized)."""
+    starts, ends = offsets[rows], offsets[rows + 1]
+    lengths = ends - starts
+    out_starts = np.zeros(len(rows), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=out_starts[1:])
+    positions = np.repeat(starts - out_starts, lengths) + np.arange(int(lengths.sum()))
+    return values[positions], out_starts, lengths
+
+
+def segment_sums(values, starts, lengths):
+    """Per-row sums of `gather` output (0 for rows without values)."""
+    if not len(values):
+        return np.zeros(len(starts), dtype=np.int64)
+    sums = np.add.reduceat(values, np.minimum(starts, len(values) - 1))
+    return np.where(lengths > 0, sums, 0)  # reduceat yields a single element for empty rows
+
+# -----------------------------
+# Columnar recipe store
+# -----------------------------
+class RecipeStore:
+    """
+    Read-only, columnar copy of the catalog for the scoring path:
+    - ingredient and tag IDs as interned int32 arrays (CSR: offsets + values)
+    - servings / time_minutes as typed int32 columns
+    - id / name / display strings as plain lists, only read when a row is materialized
+    Candidates are handled as row numbers; `metadata(row)` builds a dict only for results.
+    Rows line up with the metadata list it was built from (the ingredient index rows).
+    """
+
+    def __init__(self, metadatas, ingredient_vocab: dict = None, version: str = "0", ingredient_id_sets=None):
+        metadatas = metadatas if isinstance(metadatas, Sequence) else list(metadatas)
+        self.version = version
+        self.ingredient_vocab = ingredient_vocab if ingredient_vocab is not None else {}
+        self.tag_vocab = {}
+
+        self.ids = [sys.intern(str(m.get("id", ""))) for m in metadatas]
+        self.rows = {rid: row for row, rid in enumerate(self.ids)}
+        self.names = [m.get("name", "") for m in metadatas]
+        self.ingredient_text = [m.get("ingredients", "") for m in metadatas]
+        self.tag_text = [m.get("tags", "") for m in metadatas]
+        self.servings = np.fromiter((int(m.get("servings", 0) or 0) for m in metadatas), dtype=np.int32)
+        self.time_minutes = np.fromiter((int(m.get("time_minutes", 0) or 0) for m in metadatas), dtype=np.int32)
+        self.extra = {
+            name: [m.get(name) for m in metadatas] for name in EXTRA_COLUMNS
+            if any(name in m for m in metadatas)
+        }
+
+        if ingredient_id_sets is None:
+            ingredient_id_sets = [
+                {self._intern(self.ingredient_vocab, i) for i in split_ingredients(m.get("ingredients", ""))}
+                for m in metadatas
+            ]
+        self.ingredient_offsets, self.ingredient_ids = csr([sorted(ids) for ids in ingredient_id_sets])
+        self.tag_offsets, self.tag_ids = csr([
+            sorted({self._intern(self.tag_vocab, t) for t in split_tags(m.get("tags", ""))})
+            for m in metadatas
+        ])
+        # Inverted index: ingredient ID -> rows, for exact-overlap candidates
+        order = np.argsort(self.ingredient_ids, kind="stable")
+        row_of_value = np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.ingredient_offsets))
+        self.posting_rows = row_of_value[order]
+        self.posting_offsets = np.searchsorted(
+            self.ingredient_ids[order], np.arange(len(self.ingredient_vocab) + 1)
+        ).astype(np.int64)
+
+    @staticmethod
+    def _intern(vocab, name):
+        if name not in vocab:
+            vocab[name] = len(vocab)
+        return vocab[name]
+
+    @classmethod
+    def from_index(cls, index):
+        """Store for an `IngredientIndex` (same rows, same ingredient IDs, no re-parsing)."""
+        return cls(index.recipes, ingredient_vocab=dict(index.vocab), version=index.version,
+                   ingredient_id_sets=index.ingredient_id_sets())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        """Bytes held by the array columns (string columns not included)."""
+        arrays = (self.servings, self.time_minutes, self.ingredient_offsets, self.ingredient_ids,
+                  self.tag_offsets, self.tag_ids, self.posting_rows, self.posting_offsets)
+        return sum(a.nbytes for a in arrays)
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    def row_ingredient_ids(self, row: int):
+        """Ingredient IDs of one row (sorted int32 array)."""
+        return self.ingredient_ids[self.ingredient_offsets[row]:self.ingredient_offsets[row + 1]]
+
+    def pantry_ids(self, pantry_items: List[str]):
+        """Sorted ingredient IDs of the pantry items that exist in the vocabulary."""
+        ids = {self.ingredient_vocab[name] for name in map(canonical_ingredient, pantry_items)
+               if name in self.ingredient_vocab}
+        return np.array(sorted(ids), dtype=np.int32)
+
+    def rows_of(self, metadatas):
+        """Row numbers for candidate metadata dicts, plus the candidates not in the store."""
+        rows, unknown = [], []
+        for metadata in metadatas:
+            row = self.rows.get(str(metadata.get("id")))
+            if row is None:
+                unknown.append(metadata)
+            else:
+                rows.append(row)
+        return np.array(rows, dtype=np.int64), unknown
+
+    def match_counts(self, rows, pantry_ids):
+        """Number of pantry ingredients each row uses."""
+        if not len(rows):
+            return np.zeros(0, dtype=np.int64)
+        values, starts, lengths = gather(self.ingredient_offsets, self.ingredient_ids, rows)
+        return segment_sums(np.isin(values, pantry_ids).astype(np.int64), starts, lengths)
+
+    def has_tag(self, rows, tag: str):
+        """Boolean mask: which rows carry `tag` (canonicalized like the stored tags)."""
+        tag_id = self.tag_vocab.get(canonical_ingredient(tag))
+        if tag_id is None or not len(rows):
+            return np.zeros(len(rows), dtype=bool)
+        values, starts, lengths = gather(self.tag_offsets, self.tag_ids, rows)
+        return segment_sums((values == tag_id).astype(np.int64), starts, lengths) > 0
+
+    def top_overlap(self, pantry_ids, limit: int = 50):
+        """Rows sharing the most ingredients with the pantry: `(rows, counts)`, best first."""
+        if not len(pantry_ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pantry_ids = pantry_ids[pantry_ids < len(self.posting_offsets) - 1]
+        postings = [self.posting_rows[self.posting_offsets[i]:self.posting_offsets[i + 1]] for i in pantry_ids]
+        if not postings:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        rows, counts = np.unique(np.concatenate(postings), return_counts=True)
+        top = np.argsort(-counts, kind="stable")[:limit]
+        return rows[top].astype(np.int64), counts[top]
+
+    # -----------------------------
+    # Materialization
+    # -----------------------------
+    def metadata(self, row: int, **fields):
+        """One row as the metadata dict Chroma would return (plus `fields`, e.g. match_score)."""
+        metadata = {
+            "id": self.ids[row],
+            "name": self.names[row],
+            "ingredients": self.ingredient_text[row],
+            "tags": self.tag_text[row],
+            "time_minutes": int(self.time_minutes[row]),
+            "servings": int(self.servings[row])
+        }
+        for name, column in self.extra.items():
+            if column[row] is not None:
+                metadata[name] = column[row]
+        metadata.update(fields)
+        return metadata
+
+    def metadatas(self):
+        """All rows as a lazy sequence of metadata dicts (each built on access, nothing kept)."""
+        return MetadataRows(self)
+
+
+class MetadataRows(Sequence):
+    """
+    Read-only sequence view of a `RecipeStore`'s rows as the stored metadata dicts
+    (including the per-tag flags), for persisting the index and building BM25.
+    """
+
+    def __init__(self, store: RecipeStore):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._metadata(i) for i in range(*row.indices(len(self.store)))]
+        if row < 0:
+            row += len(self.store)
+        if not 0 <= row < len(self.store):
+            raise IndexError(row)
+        return self._metadata(row)
+
+    def _metadata(self, row):
+        metadata = self.store.metadata(row)
+        for tag in split_tags(metadata["tags"]):
+            metadata["tag_" + tag] = True
+        return metadata
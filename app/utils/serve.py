@@ -0,0 +1,208 @@
+# file: app/utils/serve.py
+
+import asyncio
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import traceback
+
+# -----------------------------
+# Settings
+# -----------------------------
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "4"))
+# Load the torch embedding model in the master so workers share its weights copy-on-write
+# (ONNX sessions start their thread pools on load, so they are always created per worker)
+PRELOAD_EMBED_MODEL = os.getenv("PRELOAD_EMBED_MODEL", "true").lower() in ("1", "true", "yes")
+
+# -----------------------------
+# Pre-fork loading
+# -----------------------------
+def _prepare():
+    from app.utils import vector_db
+
+    state = vector_db.warm_up()
+    if state["status"] != "ready":
+        raise SystemExit(f"❌ Warm-up failed: {state.get('error')}")
+
+
+def prepare():
+    """
+    Bring every on-disk artifact up to date (NumPy snapshot, ingredient index, substitution
+    table) in a separate spawned process, so the master never opens Chroma or runs the model
+    (neither is fork-safe) and only has to load files.
+    """
+    process = multiprocessing.get_context("spawn").Process(target=_prepare, name="prepare")
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("Preparing the indexes failed; see the output above")
+
+
+def load_shared_state():
+    """
+    Load the read-only serving state from disk into this process: ingredient index and its
+    columnar recipe store, lexical index, substitution table, the memory-mapped NumPy snapshot
+    and (torch only) the model weights. Called in the master before forking, every worker
+    then reads the same pages. Readiness is left to `load_worker_state`.
+    """
+    from app.utils import vector_db
+
+    start = time.perf_counter()
+    vector_db.get_ingredient_index().columnar()
+    if vector_db.RETRIEVAL_MODE == "hybrid":
+        vector_db.get_lexical_index()
+    if vector_db.SUBSTITUTIONS_SOURCE == "table":
+        vector_db.get_substitution_table()
+    if vector_db.VECTOR_BACKEND == "numpy":
+        vector_db.get_vector_backend()
+    if PRELOAD_EMBED_MODEL and vector_db.EMBED_BACKEND == "torch":
+        vector_db.get_embed_model()  # weights only: no inference before fork
+    vector_db.warmup_state.update(seconds=round(time.perf_counter() - start, 3))
+
+
+def load_worker_state():
+    """
+    Open what can't be shared across a fork, in the worker: the Chroma collection (unless the
+    NumPy snapshot is the backend) and the embedding model if it wasn't preloaded. Only then
+    is the worker marked ready, so /ready never reports a backend that isn't open.
+    """
+    from app.utils import vector_db
+
+    start = time.perf_counter()
+    if vector_db.VECTOR_BACKEND != "numpy":
+        vector_db.get_collection()
+    vector_db.get_embed_model()
+    seconds = (vector_db.warmup_state["seconds"] or 0) + time.perf_counter() - start
+    vector_db.warmup_state.update(status="ready", error=None, seconds=round(seconds, 3))
+
+
+def freeze():
+    """Move everything loaded so far out of the GC's reach, so collections in workers don't dirty shared pages."""
+    gc.collect()
+    gc.freeze()
+
+# -----------------------------
+# Workers
+# -----------------------------
+def bind(host: str = SERVE_HOST, port: int = SERVE_PORT, backlog: int = 2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock):
+    import uvicorn
+    from app import main
+
+    main.WARMUP_ON_STARTUP = False  # state is already loaded (before or right after fork)
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning"))
+    asyncio.run(server.serve(sockets=[sock]))
+
+
+def spawn_worker(sock, preloaded: bool = True, ready_fd: int = None):
+    """
+    Fork one worker serving on `sock`. Without `preloaded`, the worker loads its own copy of
+    the serving state (what plain `uvicorn --workers` does). Either way it then opens its own
+    per-worker state and writes one byte to `ready_fd`. Returns the child pid.
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        if not preloaded:
+            load_shared_state()
+        load_worker_state()
+        if ready_fd is not None:
+            os.write(ready_fd, b"1")
+        run_worker(sock)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def memory_usage(pid: int):
+    """
+    RSS, PSS (shared pages split between the processes mapping them) and USS (pages only
+    this process has) in MB, from /proc/<pid>/smaps_rollup (Linux).
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "uss_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1)
+    }
+
+# -----------------------------
+# Pre-fork master
+# -----------------------------
+def serve(host: str = SERVE_HOST, port: int = SERVE_PORT, workers: int = SERVE_WORKERS, preload: bool = True):
+    """
+    Multi-worker serving with one shared copy of the read-only state: prepare the indexes,
+    load them in this process, then fork `workers` uvicorn workers on one listening socket.
+    Workers that die are replaced; SIGTERM / SIGINT stop them all.
+    """
+    from app.utils import vector_db
+
+    if vector_db.VECTOR_BACKEND != "numpy":
+        print("⚠️ VECTOR_BACKEND is not 'numpy': every worker opens its own Chroma index.")
+    if preload:
+        print("📦 Preparing indexes...")
+        prepare()
+        load_shared_state()
+        freeze()
+    sock = bind(host, port)
+
+    children = {spawn_worker(sock, preload) for _ in range(max(1, workers))}
+    print(f"🚀 Serving on http://{host}:{port} with {len(children)} workers (preloaded: {preload})")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"⚠️ Worker {pid} exited ({status}); starting a replacement.")
+            children.add(spawn_worker(sock, preload))
+    sock.close()
+
+
+if __name__ == "__main__":
+    # python -m app.utils.serve [workers] [port]
+    import sys
+
+    serve(
+        workers=int(sys.argv[1]) if len(sys.argv) > 1 else SERVE_WORKERS,
+        port=int(sys.argv[2]) if len(sys.argv) > 2 else SERVE_PORT
+    )
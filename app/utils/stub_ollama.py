@@ -0,0 +1,103 @@
+# file: app/utils/stub_ollama.py
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+
+BATCH_KEY_RE = re.compile(r"^\[(r\d+)\]", re.MULTILINE)
+
+# -----------------------------
+# Stub Ollama server (benchmarks / load tests)
+# -----------------------------
+class StubOllama:
+    """
+    Local stand-in for Ollama's `/api/chat`: answers every prompt with canned JSON after
+    `latency_ms` (± `jitter_ms`), failing a `failure_rate` fraction of calls with a 500.
+    Batched prompts (recipes listed as `[r0] ...`) get one keyed entry per recipe.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply(self, prompt: str):
+        details = {"instructions": ["Prep the ingredients.", "Cook until done.", "Serve."], "substitutions": [], "rank": "high"}
+        if "substitutions for the missing" in prompt:
+            return {"substitutions": ["Use what you have."]}
+        if "concise step-by-step" in prompt:
+            return {"instructions": details["instructions"]}
+        keys = BATCH_KEY_RE.findall(prompt)
+        return {key: details for key in keys} if keys else details
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.calls += 1
+                    delay = max(0.0, stub.latency_ms + stub._random.uniform(-stub.jitter_ms, stub.jitter_ms))
+                    fail = stub._random.random() < stub.failure_rate
+                time.sleep(delay / 1000)
+
+                prompt = (body.get("messages") or [{}])[-1].get("content", "")
+                status = 500 if fail else 200
+                payload = {"error": "stub failure"} if fail else {
+                    "model": body.get("model", "stub"),
+                    "message": {"role": "assistant", "content": json.dumps(stub.reply(prompt))},
+                    "done": True
+                }
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    # python -m app.utils.stub_ollama [port] [latency_ms] -> point OLLAMA_HOST at it
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 11435
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 200.0
+    stub = StubOllama(port=port, latency_ms=latency, jitter_ms=latency / 4)
+    print(f"🤖 Stub Ollama on {stub.url} ({latency:.0f} ms per call)")
+    stub.server.serve_forever()
@@ -0,0 +1,168 @@
+# file: app/utils/substitutions.py
+
+from typing import Dict, List
+import hashlib
+import json
+import os
+import numpy as np
+
+from app.utils.ingredient_index import canonical_ingredient, split_ingredients
+
+# Words marking an ingredient a diet excludes (matched per word, plural "s" ignored).
+# Dairy words don't count when a plant qualifier is present (e.g. "oat milk", "peanut butter").
+MEAT_WORDS = {
+    "anchovy", "bacon", "beef", "chicken", "crab", "fish", "gelatin", "ham", "lamb", "meat", "mutton",
+    "pork", "prawn", "salmon", "sausage", "shrimp", "tuna", "turkey"
+}
+ANIMAL_PRODUCT_WORDS = {
+    "butter", "cheese", "cream", "curd", "egg", "feta", "ghee", "honey", "mayonnaise", "milk",
+    "paneer", "parmesan", "yogurt"
+}
+PLANT_QUALIFIERS = {"almond", "cashew", "cocoa", "coconut", "oat", "peanut", "plant", "rice", "soy", "vegan"}
+DIET_EXCLUDES = {
+    "vegetarian": MEAT_WORDS,
+    "vegan": MEAT_WORDS | ANIMAL_PRODUCT_WORDS
+}
+
+
+def strip_optional(ingredient: str):
+    """Ingredient name without a trailing "optional" qualifier ("cheese optional" -> "cheese")."""
+    name = canonical_ingredient(ingredient)
+    if name.endswith(" optional"):
+        name = name[:-len(" optional")].rstrip()
+    return name
+
+
+def is_optional(ingredient: str):
+    return strip_optional(ingredient) != canonical_ingredient(ingredient)
+
+
+def substitution_vocabulary(names):
+    """Ingredient vocabulary a table is built from: plain names, without "optional" qualifiers."""
+    return sorted({strip_optional(name) for name in names if strip_optional(name)})
+
+
+def breaks_diet(ingredient: str, diet: str):
+    """Whether an ingredient is excluded by a diet (only vegetarian / vegan are known)."""
+    excluded = DIET_EXCLUDES.get(canonical_ingredient(diet or ""))
+    if not excluded:
+        return False
+    words = {word[:-1] if word.endswith("s") else word for word in canonical_ingredient(ingredient).split()}
+    hits = words & excluded
+    if words & PLANT_QUALIFIERS:
+        hits -= ANIMAL_PRODUCT_WORDS
+    return bool(hits)
+
+
+def vocabulary_hash(vocabulary, overrides=None):
+    """Fingerprint of the inputs a table was built from (ingredient vocabulary + curated overrides)."""
+    data = json.dumps({"vocab": sorted(vocabulary), "overrides": overrides or {}}, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def load_overrides(path: str):
+    """
+    Curated substitutions from a JSON object `{"ingredient": ["substitute", ...]}`.
+    They replace the nearest neighbours for that ingredient; an empty list means "no substitute".
+    Missing file -> no overrides.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        canonical_ingredient(name): [canonical_ingredient(s) for s in substitutes]
+        for name, substitutes in data.items()
+    }
+
+# -----------------------------
+# Ingredient substitution table
+# -----------------------------
+class SubstitutionTable:
+    """
+    Precomputed ingredient -> substitutes lookup. Substitutes are the nearest neighbours of
+    each ingredient in embedding space (cosine similarity over the whole catalog vocabulary),
+    with curated overrides taking precedence. Request-time lookups are dictionary reads.
+    """
+
+    def __init__(self, table: Dict[str, List[str]] = None, version: str = "0", vocab_hash: str = ""):
+        self.table = table or {}
+        self.version = version
+        self.vocab_hash = vocab_hash
+
+    def __len__(self):
+        return len(self.table)
+
+    @classmethod
+    def build(cls, vocabulary: List[str], embeddings, k: int = 3, min_similarity: float = 0.5,
+              overrides: Dict[str, List[str]] = None, version: str = "0", chunk_size: int = 1024):
+        """
+        Nearest-neighbour table from one embedding per vocabulary entry (rows L2-normalized here).
+        Similarities are computed as a matrix product, `chunk_size` rows at a time to bound memory.
+        """
+        vocabulary = list(vocabulary)
+        overrides = overrides or {}
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if len(vocabulary):
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        k = max(0, min(k, len(vocabulary) - 1))
+
+        table = {}
+        for start in range(0, len(vocabulary) if k else 0, chunk_size):
+            similarity = vectors[start:start + chunk_size] @ vectors.T
+            rows = np.arange(similarity.shape[0])
+            similarity[rows, rows + start] = -np.inf  # an ingredient is not its own substitute
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            for row, (neighbours, scores) in enumerate(zip(top, top_scores)):
+                substitutes = [vocabulary[j] for j, score in zip(neighbours, scores) if score >= min_similarity]
+                if substitutes:
+                    table[vocabulary[start + row]] = substitutes
+
+        for name, substitutes in overrides.items():
+            if substitutes:
+                table[name] = list(substitutes)
+            else:
+                table.pop(name, None)
+        return cls(table, version=version, vocab_hash=vocabulary_hash(vocabulary, overrides))
+
+    def substitutes(self, ingredient: str):
+        return self.table.get(canonical_ingredient(ingredient), [])
+
+    def suggest(self, recipe_ingredients, pantry_items: List[str], diets: List[str] = ()):
+        """
+        Substitutions for the recipe ingredients missing from the pantry, in the same
+        `"use X instead of Y"` form as the LLM output. A substitute already in the pantry is
+        preferred; otherwise the closest one is suggested. Substitutes excluded by any of `diets`
+        (the request's diet, the recipe's diet tags) are dropped; ingredients left without one are skipped,
+        as are optional ones (nothing to substitute when they can simply be left out).
+        """
+        pantry = {canonical_ingredient(item) for item in pantry_items}
+        required = {name for name in split_ingredients(recipe_ingredients) if not is_optional(name)}
+        suggestions = []
+        for missing in sorted(required - pantry):
+            substitutes = [s for s in self.table.get(missing, []) if not any(breaks_diet(s, d) for d in diets)]
+            if not substitutes:
+                continue
+            choice = next((s for s in substitutes if s in pantry), substitutes[0])
+            suggestions.append(f"use {choice} instead of {missing}")
+        return suggestions
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path: str):
+        """Write the table atomically as JSON."""
+        data = {"version": self.version, "vocab_hash": self.vocab_hash, "table": self.table}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("table", {}), version=data.get("version", "0"), vocab_hash=data.get("vocab_hash", ""))
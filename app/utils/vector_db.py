@@ -88,12 +88,30 @@
 
 
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import List
+import hashlib
+import itertools
 import json
 import os
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app.utils.cache import LRUCache, DiskCache
+from app.utils.metrics import timed
+from app.utils.batching import MicroBatcher
+from app.utils.bm25 import BM25Index, reciprocal_rank_fusion
+from app.utils.embeddings import create_embedder, EMBED_BACKEND
+from app.utils.ingredient_index import IngredientIndex
+from app.utils.numpy_backend import NumpyVectorStore
+from app.utils.substitutions import SubstitutionTable, load_overrides, substitution_vocabulary, vocabulary_hash
 
 # -----------------------------
 # Setup absolute paths
@@ -102,83 +120,1049 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # app/utils
 APP_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))  # app
 DB_DIR = os.path.join(APP_DIR, "chroma_db")  # app/chroma_db
 JSON_PATH = os.path.join(APP_DIR, "data", "recipes.json")  # app/data/recipes.json
+CATALOG_VERSION_PATH = os.path.join(DB_DIR, "catalog_version")  # bumped whenever ingestion writes
+CATALOG_LOCK_PATH = os.path.join(DB_DIR, "catalog.lock")  # held by catalog writers across processes
+INGREDIENT_INDEX_PATH = os.path.join(DB_DIR, "ingredient_index.json")  # derived from the collection
+
+# Number of recipes encoded / written per batch during ingestion
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "4"))  # parallel LLM calls for base instructions
+
+# Vector search backend: "chroma" (default) or "numpy" (in-process, memory-mapped snapshot)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+NUMPY_INDEX_DIR = os.getenv("NUMPY_INDEX_DIR", os.path.join(DB_DIR, "numpy_index"))
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")  # or "float16" to halve memory
+# Catalog updates are appended to the snapshot as a delta; past this many rows it is re-exported
+NUMPY_DELTA_MAX_ROWS = int(os.getenv("NUMPY_DELTA_MAX_ROWS", "10000"))
+
+# HNSW index of the Chroma collection: distance metric ("l2" is Chroma's default, or "cosine" / "ip")
+# and graph parameters. The metric, HNSW_M and HNSW_CONSTRUCTION_EF are fixed when the collection is
+# created; HNSW_SEARCH_EF also applies to an existing one. Measure with `python -m app.utils.benchmark hnsw`.
+DISTANCE_METRICS = ("cosine", "ip", "l2")
+CHROMA_DISTANCE = os.getenv("CHROMA_DISTANCE", "l2").lower()
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "100"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "100"))
+
+# "vector" (embedding search only) or "hybrid" (BM25 keyword search fused with it by reciprocal rank)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Ingredient substitutions: "table" (precomputed nearest neighbours, default) or "llm" (asked per request)
+SUBSTITUTIONS_SOURCE = os.getenv("SUBSTITUTIONS_SOURCE", "table").lower()
+SUBSTITUTIONS_PATH = os.path.join(DB_DIR, "substitutions.json")  # derived from the ingredient vocabulary
+SUBSTITUTION_OVERRIDES_PATH = os.getenv(
+    "SUBSTITUTION_OVERRIDES_PATH", os.path.join(APP_DIR, "data", "substitution_overrides.json")
+)
+SUBSTITUTION_NEIGHBORS = int(os.getenv("SUBSTITUTION_NEIGHBORS", "3"))
+SUBSTITUTION_MIN_SIMILARITY = float(os.getenv("SUBSTITUTION_MIN_SIMILARITY", "0.5"))
+
+# Query-embedding cache (in-memory LRU, plus an optional SQLite tier shared by workers)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_TTL_SECONDS = float(os.getenv("EMBED_CACHE_TTL_SECONDS", "3600"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")  # e.g. app/cache/embeddings.sqlite3
+
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+
+# Micro-batching of query embeddings across concurrent requests
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "true").lower() in ("1", "true", "yes")
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "2"))
 
 # Ensure DB dir exists
 os.makedirs(DB_DIR, exist_ok=True)
 
 # -----------------------------
-# 1️⃣ Initialize Persistent Chroma client
+# 1️⃣ Chroma client & 2️⃣ embedding model (created lazily)
 # -----------------------------
-client = chromadb.PersistentClient(path=DB_DIR)
-collection = client.get_or_create_collection(name="recipes")
+# chromadb / the embedding backend (torch or ONNX Runtime, see EMBED_BACKEND) are only imported
+# on first use, so importing this module is cheap and the API can start serving /health early.
+client = None
+collection = None
+embed_model = None
+_init_lock = threading.Lock()
 
-# -----------------------------
-# 2️⃣ Load embedding model
-# -----------------------------
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
+# Warm-up progress reported by /ready
+warmup_state = {"status": "pending", "error": None, "seconds": None}
+
+
+def get_client():
+    global client
+    if client is None:
+        with _init_lock:
+            if client is None:
+                import chromadb
+                client = chromadb.PersistentClient(path=DB_DIR)
+    return client
+
+
+def hnsw_configuration(space: str = CHROMA_DISTANCE, m: int = HNSW_M,
+                       construction_ef: int = HNSW_CONSTRUCTION_EF, search_ef: int = HNSW_SEARCH_EF):
+    """Chroma collection configuration for the HNSW index."""
+    if space not in DISTANCE_METRICS:
+        raise ValueError(f"Unsupported distance metric: {space} (expected one of {', '.join(DISTANCE_METRICS)})")
+    return {"hnsw": {"space": space, "max_neighbors": m, "ef_construction": construction_ef, "ef_search": search_ef}}
+
+
+def open_collection(chroma_client, name: str = "recipes", configuration: dict = None):
+    """
+    Get or create a collection with the HNSW configuration. The search ef of an existing
+    collection is updated (it takes effect when its index is loaded, i.e. before the first
+    query in this process); the metric, M and construction ef only apply to new collections,
+    so a mismatch is reported instead: re-ingest into an empty DB_DIR to change them.
+    """
+    configuration = configuration or hnsw_configuration()
+    wanted = configuration["hnsw"]
+    chroma_collection = chroma_client.get_or_create_collection(name=name, configuration=configuration)
+    current = (chroma_collection.configuration or {}).get("hnsw") or {}
+    if current.get("ef_search") not in (None, wanted["ef_search"]):
+        chroma_collection.modify(configuration={"hnsw": {"ef_search": wanted["ef_search"]}})
+    fixed = [key for key in ("space", "max_neighbors", "ef_construction") if current.get(key) not in (None, wanted[key])]
+    if fixed:
+        print(f"⚠️ Collection '{name}' was created with " + ", ".join(f"{key}={current[key]}" for key in fixed) +
+              "; HNSW metric / M / construction ef only change when the collection is rebuilt.")
+    return chroma_collection
+
+
+def get_collection():
+    global collection
+    if collection is None:
+        chroma_client = get_client()
+        with _init_lock:
+            if collection is None:
+                collection = open_collection(chroma_client)
+    return collection
+
+
+def get_embed_model():
+    global embed_model
+    if embed_model is None:
+        with _init_lock:
+            if embed_model is None:
+                embed_model = create_embedder(EMBED_MODEL_NAME, EMBED_BACKEND)
+    return embed_model
+
+
+def warm_up():
+    """
+    Load the Chroma collection, the embedding model and the derived indexes, and run one
+    encode so the first real request doesn't pay for it. Progress is kept in `warmup_state`.
+    """
+    warmup_state.update(status="warming", error=None)
+    start = time.perf_counter()
+    try:
+        get_collection()
+        get_embed_model().encode("warm up")
+        get_ingredient_index().columnar()
+        if RETRIEVAL_MODE == "hybrid":
+            get_lexical_index()
+        if SUBSTITUTIONS_SOURCE == "table":
+            get_substitution_table()
+        get_vector_backend()
+        warmup_state.update(status="ready", seconds=round(time.perf_counter() - start, 3))
+    except Exception as e:
+        warmup_state.update(status="failed", error=str(e), seconds=round(time.perf_counter() - start, 3))
+    return warmup_state
+
+
+def is_ready():
+    return warmup_state["status"] == "ready"
 
 # -----------------------------
 # 3️⃣ Add recipes from JSON
 # -----------------------------
-def add_recipes_from_json(file_path: str = JSON_PATH):
-    """Load all recipes from JSON and add them to ChromaDB."""
+def recipe_text(recipe):
+    """Text that gets embedded for a recipe."""
+    return recipe["name"] + " " + " ".join(recipe["ingredients"]) + " " + " ".join(recipe["tags"])
+
+
+# Collection metadata marker: every stored recipe carries the per-tag flags (see `mark_tag_flags`)
+TAG_FLAGS_MARKER = "tag_flags"
+
+
+def tag_key(tag: str):
+    """Metadata key of the boolean flag stored for a tag (e.g. "tag_vegan")."""
+    return "tag_" + " ".join(tag.lower().split())
+
+
+def recipe_metadata(recipe):
+    """Chroma metadata stored for a recipe."""
+    # Safely convert numeric fields
+    time_minutes = int(recipe.get("time_required", 0) or 0)
+    servings = int(recipe.get("servings", 1) or 1)
+
+    metadata = {
+        "id": recipe.get("id", ""),
+        "name": recipe.get("name", "Unnamed Recipe"),
+        "ingredients": ", ".join(recipe.get("ingredients", [])),
+        "tags": ", ".join(recipe.get("tags", [])),
+        "time_minutes": time_minutes,
+        "servings": servings
+    }
+    # One boolean flag per tag, so diet/cuisine can be filtered inside the Chroma query
+    for tag in recipe.get("tags", []):
+        metadata[tag_key(tag)] = True
+    return metadata
+
+
+def content_hash(text, metadata):
+    """Stable hash of everything we store for a recipe, used to skip unchanged recipes."""
+    payload = json.dumps({"document": text, "metadata": metadata}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def catalog_version():
+    """
+    Current catalog version stamp (changes every time ingestion writes to the collection).
+    Shared through a file so the API process sees changes made by a separate ingestion run.
+    """
+    try:
+        with open(CATALOG_VERSION_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip() or "0"
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_catalog_version():
+    """Give the catalog a new version stamp, invalidating caches keyed on the old one."""
+    version = uuid.uuid4().hex
+    tmp_path = CATALOG_VERSION_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, CATALOG_VERSION_PATH)
+    return version
+
+
+def iter_json_array(f, chunk_size: int = 1 << 16):
+    """Incrementally parse a top-level JSON array, yielding one element at a time."""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+    buffer = buffer[1:]
+    eof = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith("]"):
+            return
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Element is split across chunks (or the file is truncated)
+                if eof:
+                    raise
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def iter_recipes(file_path: str = JSON_PATH):
+    """
+    Stream recipes from a catalog file without loading it all into memory.
+    Supports a JSON array (like recipes.json) or JSON Lines (one recipe per line).
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+
+        if first == "[":
+            yield from iter_json_array(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_batches(items, batch_size: int):
+    """Group an iterable into lists of at most `batch_size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prepare_recipe(recipe):
+    """Normalize a raw recipe into `(id, text, metadata)` ready to embed."""
+    text = recipe_text(recipe)
+    metadata = recipe_metadata(recipe)
+    metadata["content_hash"] = content_hash(text, metadata)
+    return str(recipe.get("id", "")), text, metadata
+
+
+def write_changes(batch, batch_size: int):
+    """
+    Embed and upsert the new / changed recipes of one batch of prepared recipes.
+    Returns the IDs written (the catalog version is left to the caller).
+    """
+    ids = [rid for rid, _, _ in batch]
+
+    # Skip recipes already stored with the same content
+    existing = get_collection().get(ids=ids, include=["metadatas", "documents"])
+    stored_metadatas = {rid: meta or {} for rid, meta in zip(existing["ids"], existing["metadatas"])}
+    stored_documents = dict(zip(existing["ids"], existing["documents"]))
+    changed = [
+        item for item in batch
+        if stored_metadatas.get(item[0], {}).get("content_hash") != item[2]["content_hash"]
+    ]
+    if not changed:
+        return []
+
+    # Chroma merges metadata on write: explicitly delete keys (e.g. removed tags) that are gone
+    for rid, _, metadata in changed:
+        for key in stored_metadatas.get(rid, {}).keys() - metadata.keys():
+            metadata[key] = None
+
+    # Only recipes whose embedded text changed need a new embedding
+    reembed = [item for item in changed if stored_documents.get(item[0]) != item[1]]
+    metadata_only = [item for item in changed if stored_documents.get(item[0]) == item[1]]
+
+    if reembed:
+        embeddings = get_embed_model().encode(
+            [text for _, text, _ in reembed], batch_size=batch_size, show_progress_bar=False
+        )
+        get_collection().upsert(
+            ids=[rid for rid, _, _ in reembed],
+            documents=[text for _, text, _ in reembed],
+            metadatas=[metadata for _, _, metadata in reembed],
+            embeddings=[embedding.tolist() for embedding in embeddings]
+        )
+    if metadata_only:
+        get_collection().update(
+            ids=[rid for rid, _, _ in metadata_only],
+            metadatas=[metadata for _, _, metadata in metadata_only]
+        )
+    return [rid for rid, _, _ in changed]
+
+
+def write_batch(batch, batch_size: int):
+    """Embed and upsert one batch of prepared recipes; returns how many were written."""
+    with catalog_write_lock():
+        written = write_changes(batch, batch_size)
+        if written:
+            bump_catalog_version()
+    return len(written)
+
+
+def load_checkpoint(checkpoint_path):
+    """Number of records already ingested according to the checkpoint file (0 if none)."""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return int(json.load(f).get("records_done", 0))
+
+
+def save_checkpoint(checkpoint_path, records_done: int):
+    """Atomically record how many records have been ingested."""
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"records_done": records_done}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def ingest_recipes(recipes, batch_size: int = INGEST_BATCH_SIZE, checkpoint_path: str = None):
+    """
+    Stream recipes through normalize -> embed -> write, one batch at a time.
+    `recipes` can be any iterable (e.g. `iter_recipes(...)`), so memory stays bounded.
+    Recipes whose content hash matches the stored one are skipped, so reruns are cheap.
+    With `checkpoint_path`, progress is saved after every batch and a rerun resumes
+    after the last completed batch; the checkpoint is removed once ingestion finishes.
+    Returns ingestion stats (counts and recipes/second).
+    """
+    batch_size = max(1, min(batch_size, get_client().get_max_batch_size()))
+    start = time.perf_counter()
+    resumed_from = load_checkpoint(checkpoint_path)
+    records_done = resumed_from
+    total = written = 0
+
+    # Already-ingested records are still parsed, but not normalized, embedded or written
+    prepared = (prepare_recipe(recipe) for recipe in itertools.islice(recipes, resumed_from, None))
+
+    for batch in iter_batches(prepared, batch_size):
+        written += write_batch(batch, batch_size)
+        total += len(batch)
+        records_done += len(batch)
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, records_done)
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    # A run covering the whole collection has (re)written every recipe with its tag flags
+    marked = get_collection().count() <= records_done and mark_tag_flags()
+    if written or marked:
+        # Keep the derived indexes in sync with the collection
+        build_ingredient_index()
+        if VECTOR_BACKEND == "numpy":
+            build_numpy_index()
+
+    seconds = time.perf_counter() - start
+    return {
+        "total": total,
+        "written": written,
+        "skipped": total - written,
+        "resumed_from": resumed_from,
+        "seconds": round(seconds, 3),
+        "recipes_per_second": round(total / seconds, 1) if seconds > 0 else 0.0
+    }
+
+
+def add_recipes_from_json(file_path: str = JSON_PATH, batch_size: int = INGEST_BATCH_SIZE, resume: bool = True):
+    """
+    Stream recipes from a JSON array / JSON Lines file and upsert new/changed ones into ChromaDB.
+    With `resume`, progress is checkpointed next to the file so a crashed run picks up where it stopped.
+    """
     if not os.path.exists(file_path):
         print(f"❌ JSON file not found: {file_path}")
         return
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        recipes = json.load(f)
-
-    print(f"🔄 Adding {len(recipes)} recipes to Chroma DB...")
-
-    for recipe in recipes:
-        text = recipe["name"] + " " + " ".join(recipe["ingredients"]) + " " + " ".join(recipe["tags"])
-        embedding = embed_model.encode(text).tolist()
-
-        # Safely convert numeric fields
-        time_minutes = int(recipe.get("time_required", 0) or 0)
-        servings = int(recipe.get("servings", 1) or 1)
-
-        collection.add(
-            documents=[text],
-            metadatas=[{
-                "id": recipe.get("id", ""),
-                "name": recipe.get("name", "Unnamed Recipe"),
-                "ingredients": ", ".join(recipe.get("ingredients", [])),
-                "tags": ", ".join(recipe.get("tags", [])),
-                "time_minutes": time_minutes,
-                "servings": servings
-            }],
-            embeddings=[embedding],
-            ids=[str(recipe.get("id", ""))]
-        )
+    checkpoint_path = file_path + ".checkpoint" if resume else None
+    print(f"🔄 Ingesting recipes from {file_path} into Chroma DB (batch size {batch_size})...")
+    stats = ingest_recipes(iter_recipes(file_path), batch_size=batch_size, checkpoint_path=checkpoint_path)
+    if stats["resumed_from"]:
+        print(f"↪️ Resumed after {stats['resumed_from']} already ingested recipes.")
+    print(
+        f"✅ Wrote {stats['written']} recipes, skipped {stats['skipped']} unchanged "
+        f"in {stats['seconds']}s ({stats['recipes_per_second']} recipes/s)."
+    )
+    return stats
+
+# -----------------------------
+# 3️⃣b Incremental catalog updates (API / delta files)
+# -----------------------------
+_catalog_write_lock = threading.Lock()
+
+
+@contextmanager
+def catalog_write_lock():
+    """
+    Serialize catalog writers: threads of this process, and (POSIX `flock`) every other worker
+    process and CLI run sharing DB_DIR, so two updates never read the same previous version.
+    """
+    with _catalog_write_lock:
+        if fcntl is None:  # Windows: single-process servers only
+            yield
+            return
+        os.makedirs(os.path.dirname(CATALOG_LOCK_PATH), exist_ok=True)
+        with open(CATALOG_LOCK_PATH, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def delete_recipes(ids):
+    """Delete recipes from the collection; returns the IDs that existed."""
+    ids = list(dict.fromkeys(str(rid) for rid in ids))
+    if not ids:
+        return []
+    existing = get_collection().get(ids=ids, include=[])["ids"]
+    if existing:
+        get_collection().delete(ids=existing)
+    return existing
+
+
+def apply_catalog_delta(changed_ids, deleted_ids, previous_version: str, version: str):
+    """
+    Patch the derived indexes for a catalog change instead of rebuilding them from the whole
+    collection: the ingredient index (copied, patched, saved) and the NumPy snapshot (a delta
+    segment). An index that wasn't in sync with `previous_version` is rebuilt instead.
+    New copies are swapped in, so requests already holding the old ones are unaffected.
+    """
+    global _ingredient_index, _numpy_store
+    page = get_collection().get(ids=list(changed_ids), include=["metadatas", "embeddings"]) if changed_ids \
+        else {"ids": [], "metadatas": [], "embeddings": []}
+    # Written recipes that are gone again (deleted in the same change) count as deleted
+    fetched = set(page["ids"])
+    deleted = list(dict.fromkeys(list(deleted_ids) + [rid for rid in changed_ids if rid not in fetched]))
+
+    with _ingredient_index_lock:
+        index = _ingredient_index
+        if (index is None or index.version != previous_version) and os.path.exists(INGREDIENT_INDEX_PATH):
+            index = IngredientIndex.load(INGREDIENT_INDEX_PATH)
+        if index is None or index.version != previous_version:
+            build_ingredient_index()
+        else:
+            index = index.copy(version=version)
+            for metadata in page["metadatas"]:
+                index.add(metadata)
+            for rid in deleted:
+                index.remove(rid)
+            index.save(INGREDIENT_INDEX_PATH)
+            index.columnar()
+            _ingredient_index = index
+
+    if VECTOR_BACKEND == "numpy":
+        with _numpy_store_lock:
+            store = _numpy_store
+            if (store is None or store.version != previous_version) \
+                    and os.path.exists(os.path.join(NUMPY_INDEX_DIR, "columns.json")):
+                store = NumpyVectorStore(NUMPY_INDEX_DIR)
+            if store is None or store.version != previous_version \
+                    or store.delta_size() + len(page["ids"]) > NUMPY_DELTA_MAX_ROWS:
+                build_numpy_index()
+            else:
+                _numpy_store = store.with_delta(
+                    page["ids"], page["embeddings"], page["metadatas"], deleted, version=version
+                )
+
+
+def update_catalog(upserts=(), deletes=(), batch_size: int = INGEST_BATCH_SIZE):
+    """
+    Apply a catalog change while the service runs: upsert the raw recipes in `upserts` and
+    delete the recipe IDs in `deletes`. Only new or changed recipes are re-embedded, the
+    derived indexes are patched in place (see `apply_catalog_delta`) and the catalog version is
+    bumped once, so caches keyed on it and every worker process pick the change up.
+    Returns `{"written", "unchanged", "deleted", "version", "seconds"}`.
+    """
+    start = time.perf_counter()
+    batch_size = max(1, min(batch_size, get_client().get_max_batch_size()))
+    total = 0
+    written, deleted = [], []
+
+    with catalog_write_lock():
+        previous_version = version = catalog_version()
+        for batch in iter_batches(map(prepare_recipe, upserts), batch_size):
+            written += write_changes(batch, batch_size)
+            total += len(batch)
+        deleted = delete_recipes(deletes)
+        if written or deleted:
+            version = bump_catalog_version()
+            apply_catalog_delta(written, deleted, previous_version, version)
 
-    print(f"✅ Added {len(recipes)} recipes to Chroma DB.")
+    if written or deleted:
+        # Rebuild what is derived lazily now, rather than in the next request
+        get_ingredient_index().columnar()
+        if RETRIEVAL_MODE == "hybrid":
+            get_lexical_index()
+        if SUBSTITUTIONS_SOURCE == "table":
+            get_substitution_table()
+
+    return {
+        "written": len(written),
+        "unchanged": total - len(written),
+        "deleted": len(deleted),
+        "version": version,
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+
+def iter_delta(file_path: str):
+    """
+    Operations of a delta file (JSON Lines or JSON array), as `(recipe_id, recipe or None)`.
+    Each entry is `{"op": "upsert", "recipe": {...}}`, `{"op": "delete", "id": "..."}`
+    or a bare recipe (an upsert).
+    """
+    for entry in iter_recipes(file_path):
+        op = entry.get("op")
+        if op is None:
+            yield str(entry.get("id", "")), entry
+        elif op == "upsert":
+            yield str(entry["recipe"].get("id", "")), entry["recipe"]
+        elif op == "delete":
+            yield str(entry["id"]), None
+        else:
+            raise ValueError(f"Unknown delta op: {op}")
+
+
+def apply_delta_file(file_path: str, batch_size: int = INGEST_BATCH_SIZE):
+    """Apply a delta file to the catalog (the last operation per recipe ID wins)."""
+    operations = dict(iter_delta(file_path))
+    stats = update_catalog(
+        upserts=[recipe for recipe in operations.values() if recipe is not None],
+        deletes=[rid for rid, recipe in operations.items() if recipe is None],
+        batch_size=batch_size
+    )
+    print(
+        f"✅ Delta {file_path}: wrote {stats['written']}, unchanged {stats['unchanged']}, "
+        f"deleted {stats['deleted']} in {stats['seconds']}s (catalog version {stats['version']})."
+    )
+    return stats
+
+# -----------------------------
+# 3️⃣c Precompute base instructions (offline, after ingestion)
+# -----------------------------
+def base_instructions(metadata):
+    """Precomputed instructions stored with a recipe, or None if missing / stale."""
+    if not metadata or not metadata.get("base_instructions"):
+        return None
+    if metadata.get("base_instructions_hash") != metadata.get("content_hash"):
+        return None
+    try:
+        return json.loads(metadata["base_instructions"])
+    except ValueError:
+        return None
+
+
+def precompute_base_instructions(generate=None, workers: int = PRECOMPUTE_WORKERS,
+                                 batch_size: int = INGEST_BATCH_SIZE):
+    """
+    Generate canonical (pantry-independent) instructions once per recipe and store them in
+    the recipe metadata as `base_instructions` (JSON list), tagged with the recipe's content
+    hash. Recipes that already have up-to-date instructions are skipped, and every batch is
+    written as soon as it finishes, so an interrupted run resumes where it stopped.
+    Changed recipes lose their instructions on re-ingestion and are picked up by the next run.
+    Returns `{"total", "generated", "skipped", "failed", "seconds"}`.
+    """
+    if generate is None:
+        from app.utils.llm_helper import generate_base_instructions as generate
+
+    def attempt(metadata):
+        try:
+            return generate(metadata)
+        except Exception as e:
+            print(f"⚠️ Base instructions failed for {metadata.get('id')}: {e}")
+            return None
+
+    start = time.perf_counter()
+    stats = {"total": 0, "generated": 0, "skipped": 0, "failed": 0}
+    pending = []
+    for metadata in iter_collection_metadatas():
+        stats["total"] += 1
+        if base_instructions(metadata) is not None:
+            stats["skipped"] += 1
+        else:
+            pending.append(metadata)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch in iter_batches(pending, batch_size):
+            done = [
+                (metadata, steps) for metadata, steps in zip(batch, pool.map(attempt, batch)) if steps
+            ]
+            stats["failed"] += len(batch) - len(done)
+            if not done:
+                continue
+            get_collection().update(
+                ids=[str(metadata["id"]) for metadata, _ in done],
+                metadatas=[
+                    {"base_instructions": json.dumps(steps), "base_instructions_hash": metadata.get("content_hash")}
+                    for metadata, steps in done
+                ]
+            )
+            stats["generated"] += len(done)
+
+    if stats["generated"]:
+        # Cached responses and derived indexes hold copies of the metadata
+        bump_catalog_version()
+        build_ingredient_index()
+        if VECTOR_BACKEND == "numpy":
+            build_numpy_index()
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+# -----------------------------
+# 3️⃣d Inverted ingredient index
+# -----------------------------
+_ingredient_index = None
+_ingredient_index_lock = threading.Lock()
+
+
+def iter_collection_metadatas(page_size: int = INGEST_BATCH_SIZE):
+    """Page through every recipe's metadata stored in the collection."""
+    offset = 0
+    while True:
+        page = get_collection().get(limit=page_size, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            return
+        yield from page["metadatas"]
+        offset += len(page["ids"])
+
+
+def build_ingredient_index():
+    """Rebuild the ingredient vocabulary / inverted index from the collection and save it."""
+    global _ingredient_index
+    # Read the version first: if ingestion writes meanwhile, the index is rebuilt again later
+    version = catalog_version()
+    index = IngredientIndex.build(iter_collection_metadatas(), version=version)
+    index.save(INGREDIENT_INDEX_PATH)
+    # Compact into the columnar store before publishing, so readers never see it change
+    index.columnar()
+    _ingredient_index = index
+    return index
+
+
+def get_ingredient_index():
+    """Ingredient index for the current catalog version (loaded from disk, or rebuilt if stale)."""
+    global _ingredient_index
+    version = catalog_version()
+    if _ingredient_index is not None and _ingredient_index.version == version:
+        return _ingredient_index
+
+    with _ingredient_index_lock:
+        if _ingredient_index is not None and _ingredient_index.version == version:
+            return _ingredient_index
+        if os.path.exists(INGREDIENT_INDEX_PATH):
+            index = IngredientIndex.load(INGREDIENT_INDEX_PATH)
+            if index.version == version:
+                index.columnar()
+                _ingredient_index = index
+                return index
+        return build_ingredient_index()
+
+# -----------------------------
+# 3️⃣e Ingredient substitution table
+# -----------------------------
+_substitution_table = None
+_substitution_table_lock = threading.Lock()
+
+
+def build_substitution_table():
+    """
+    Embed the whole ingredient vocabulary once and precompute each ingredient's nearest
+    neighbours (plus the curated overrides), then save the table next to the ingredient index.
+    """
+    global _substitution_table
+    index = get_ingredient_index()
+    vocabulary = substitution_vocabulary(index.vocab)
+    start = time.perf_counter()
+    embeddings = encode_texts(vocabulary) if vocabulary else []
+    table = SubstitutionTable.build(
+        vocabulary, embeddings, k=SUBSTITUTION_NEIGHBORS, min_similarity=SUBSTITUTION_MIN_SIMILARITY,
+        overrides=load_overrides(SUBSTITUTION_OVERRIDES_PATH), version=index.version
+    )
+    table.save(SUBSTITUTIONS_PATH)
+    _substitution_table = table
+    print(f"🔁 Built substitution table: {len(table)} of {len(vocabulary)} ingredients "
+          f"in {time.perf_counter() - start:.2f}s")
+    return table
+
+
+def get_substitution_table():
+    """
+    Substitution table for the current catalog version. A saved table is reused when only the
+    version changed but the vocabulary and overrides did not (no re-embedding); otherwise it is rebuilt.
+    """
+    global _substitution_table
+    version = catalog_version()
+    if _substitution_table is not None and _substitution_table.version == version:
+        return _substitution_table
+
+    with _substitution_table_lock:
+        if _substitution_table is not None and _substitution_table.version == version:
+            return _substitution_table
+        if os.path.exists(SUBSTITUTIONS_PATH):
+            table = SubstitutionTable.load(SUBSTITUTIONS_PATH)
+            if table.version != version:
+                index = get_ingredient_index()
+                if table.vocab_hash == vocabulary_hash(substitution_vocabulary(index.vocab), load_overrides(SUBSTITUTION_OVERRIDES_PATH)):
+                    table.version = version
+                    table.save(SUBSTITUTIONS_PATH)
+            if table.version == version:
+                _substitution_table = table
+                return table
+        return build_substitution_table()
+
+# -----------------------------
+# 3️⃣f Vector search backend
+# -----------------------------
+_numpy_store = None
+_numpy_store_lock = threading.Lock()
+
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index():
+    """BM25 index over the recipes in the ingredient index (rebuilt in memory when the version changes)."""
+    global _lexical_index
+    ingredient_index = get_ingredient_index()
+    if _lexical_index is not None and _lexical_index.version == ingredient_index.version:
+        return _lexical_index
+    with _lexical_index_lock:
+        if _lexical_index is None or _lexical_index.version != ingredient_index.version:
+            # Built from the columnar store's lazy rows, so no second copy of the dicts is kept
+            _lexical_index = BM25Index(ingredient_index.recipes, version=ingredient_index.version)
+    return _lexical_index
+
+
+def build_numpy_index():
+    """Export the collection to the memory-mapped NumPy snapshot and load it."""
+    global _numpy_store
+    version = catalog_version()
+    NumpyVectorStore.export(get_collection(), NUMPY_INDEX_DIR, version=version, dtype=NUMPY_INDEX_DTYPE)
+    _numpy_store = NumpyVectorStore(NUMPY_INDEX_DIR)
+    return _numpy_store
+
+
+def get_vector_backend():
+    """
+    Object answering `query(query_embeddings=..., n_results=..., where=...)`:
+    the Chroma collection, or the NumPy snapshot (re-exported when the catalog version changes).
+    """
+    global _numpy_store
+    if VECTOR_BACKEND != "numpy":
+        return get_collection()
+
+    version = catalog_version()
+    if _numpy_store is not None and _numpy_store.version == version:
+        return _numpy_store
+
+    with _numpy_store_lock:
+        if _numpy_store is not None and _numpy_store.version == version:
+            return _numpy_store
+        if os.path.exists(os.path.join(NUMPY_INDEX_DIR, "columns.json")):
+            store = NumpyVectorStore(NUMPY_INDEX_DIR)
+            if store.version == version:
+                _numpy_store = store
+                return store
+        return build_numpy_index()
 
 # -----------------------------
 # 4️⃣ Query recipes by pantry items
 # -----------------------------
-def query_recipes(pantry_items: List[str], top_k: int = 5):
-    """Query top matching recipes based on pantry items."""
+embedding_cache = LRUCache(maxsize=EMBED_CACHE_SIZE, ttl=EMBED_CACHE_TTL_SECONDS)
+shared_embedding_cache = DiskCache(EMBED_CACHE_PATH, ttl=EMBED_CACHE_TTL_SECONDS) if EMBED_CACHE_PATH else None
+
+
+def normalize_pantry(pantry_items: List[str]):
+    """Canonical pantry: lowercased, whitespace-collapsed, de-duplicated and sorted."""
+    items = {" ".join(item.lower().split()) for item in pantry_items}
+    return sorted(item for item in items if item)
+
+
+def embedding_key(items: List[str]):
+    """
+    Cache key of a normalized pantry: a hash of the model, backend and items, so entries from
+    another embedding model (e.g. in the shared tier) are never reused.
+    """
+    payload = json.dumps([EMBED_MODEL_NAME, EMBED_BACKEND, items])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cached_embedding(key: str):
+    """Look a query embedding up in the memory tier, then the shared tier."""
+    embedding = embedding_cache.get(key)
+    if embedding is None and shared_embedding_cache is not None:
+        embedding = shared_embedding_cache.get(key)
+        if embedding is not None:
+            embedding_cache.set(key, embedding)
+    return embedding
+
+
+def store_embedding(key: str, embedding):
+    embedding_cache.set(key, embedding)
+    if shared_embedding_cache is not None:
+        shared_embedding_cache.set(key, embedding)
+
+
+def encode_texts(texts):
+    return get_embed_model().encode(texts, batch_size=INGEST_BATCH_SIZE, show_progress_bar=False)
+
+
+embedding_batcher = MicroBatcher(
+    lambda texts: get_embed_model().encode(texts) if isinstance(texts, str) else encode_texts(texts),
+    max_batch_size=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_WAIT_MS
+)
+
+
+def embed_query(pantry_items: List[str]):
+    """
+    Embedding for a pantry, cached on the normalized pantry set. Cache misses go through
+    the micro-batcher, so concurrent requests share one model call.
+    """
+    items = normalize_pantry(pantry_items)
+    query_text = " ".join(items)
+    key = embedding_key(items)
+
+    embedding = cached_embedding(key)
+    if embedding is None:
+        with timed("embedding"):
+            if EMBED_BATCHING:
+                embedding = embedding_batcher.encode(query_text).tolist()
+            else:
+                embedding = get_embed_model().encode(query_text).tolist()
+        store_embedding(key, embedding)
+    return embedding
+
+
+def embed_queries(pantry_lists: List[List[str]]):
+    """Embeddings for many pantries; all cache misses are encoded in one batch."""
+    normalized = [normalize_pantry(items) for items in pantry_lists]
+    keys = [embedding_key(items) for items in normalized]
+    texts = {key: " ".join(items) for key, items in zip(keys, normalized)}
+    embeddings = {key: cached_embedding(key) for key in texts}
+
+    missing = [key for key, embedding in embeddings.items() if embedding is None]
+    if missing:
+        with timed("embedding"):
+            encoded = encode_texts([texts[key] for key in missing])
+        for key, embedding in zip(missing, encoded):
+            embeddings[key] = embedding.tolist()
+            store_embedding(key, embeddings[key])
+
+    return [embeddings[key] for key in keys]
+
+
+def embedding_cache_stats():
+    """Hit/miss counters for the query-embedding cache tiers."""
+    return {
+        "memory": embedding_cache.stats(),
+        "shared": shared_embedding_cache.stats() if shared_embedding_cache is not None else None
+    }
+
+
+def embedding_batcher_stats():
+    """Queue-depth, batch-size and queue-wait histograms of the embedding micro-batcher."""
+    return dict(embedding_batcher.stats(), enabled=EMBED_BATCHING)
+
+
+_tag_filter_support = {}
+
+
+def mark_tag_flags():
+    """
+    Record in the collection metadata that every recipe has its tag flags (set by an ingestion
+    run that covered the whole collection). The first time, the catalog version is bumped so
+    other workers re-check. Returns True if the marker was newly set.
+    """
+    chroma_collection = get_collection()
+    metadata = chroma_collection.metadata or {}
+    if metadata.get(TAG_FLAGS_MARKER):
+        return False
+    with catalog_write_lock():
+        chroma_collection.modify(metadata={**metadata, TAG_FLAGS_MARKER: True})
+        bump_catalog_version()
+    return True
+
+
+def supports_tag_filters():
+    """
+    Whether the catalog stores per-tag flags (ingested after tags became structured), from the
+    marker ingestion writes into the collection metadata. Catalogs ingested earlier only have the
+    comma-joined `tags` string; rerun ingestion to add the flags (only metadata is rewritten,
+    nothing is re-embedded).
+    The NumPy snapshot evaluates tag filters from the tags column itself (no Chroma round trip).
+    """
+    if VECTOR_BACKEND == "numpy":
+        return True
+    version = catalog_version()
+    if version not in _tag_filter_support:
+        # Read the collection again: another process may have set the marker since it was opened
+        metadata = get_client().get_collection(get_collection().name).metadata or {}
+        _tag_filter_support.clear()
+        _tag_filter_support[version] = bool(metadata.get(TAG_FLAGS_MARKER))
+    return _tag_filter_support[version]
+
+
+def build_where(servings: int = None, time_minutes: int = None, tags: List[str] = ()):
+    """Chroma `where` clause for the recipe filters (None when there is nothing to filter)."""
+    clauses = []
+    if servings:
+        clauses.append({"servings": servings})
+    if time_minutes:
+        clauses.append({"time_minutes": time_minutes})
+    if tags and supports_tag_filters():
+        clauses.extend({tag_key(tag): True} for tag in tags)
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def query_recipes(pantry_items: List[str], top_k: int = 5, where: dict = None):
+    """
+    Query top matching recipes based on pantry items.
+    `where` (see `build_where`) is applied inside Chroma, so only eligible recipes are returned.
+    """
     if not pantry_items:
         print("⚠️ No pantry items provided!")
         return []
 
-    query_text = " ".join(pantry_items)
-    embedding = embed_model.encode(query_text).tolist()
-    results = collection.query(query_embeddings=[embedding], n_results=top_k)
+    embedding = embed_query(pantry_items)
+    with timed("vector_query"):
+        results = get_vector_backend().query(query_embeddings=[embedding], n_results=top_k, where=where)
+    recipes = (results or {}).get("metadatas") or [[]]
+    recipes = recipes[0] or []
+
+    if RETRIEVAL_MODE == "hybrid":
+        recipes = fuse_lexical(recipes, pantry_items, top_k, where)
 
-    if not results or not results.get("metadatas") or not results["metadatas"][0]:
+    if not recipes:
         print("❌ No matching recipes found.")
         return []
-
-    recipes = results["metadatas"][0]
     return recipes
 
+
+def fuse_lexical(vector_recipes, pantry_items: List[str], top_k: int, where: dict = None):
+    """Reciprocal-rank fusion of vector results with BM25 keyword results for the same pantry."""
+    with timed("lexical_query"):
+        lexical = [metadata for metadata, _ in get_lexical_index().search(" ".join(pantry_items), limit=top_k, where=where)]
+    return reciprocal_rank_fusion([vector_recipes, lexical], limit=top_k, k=RRF_K)
+
+def query_recipes_batch(pantry_lists: List[List[str]], top_k: int = 5, wheres: List[dict] = None):
+    """
+    Query recipes for many pantries at once: one embedding batch, and one multi-query
+    call per distinct `where` clause (a single call when all requests share the same filters).
+    Returns one candidate list per pantry, in input order.
+    """
+    wheres = wheres or [None] * len(pantry_lists)
+    results = [[] for _ in pantry_lists]
+    queries = [i for i, items in enumerate(pantry_lists) if items]
+    if not queries:
+        return results
+
+    embeddings = embed_queries([pantry_lists[i] for i in queries])
+
+    groups = {}
+    for i, embedding in zip(queries, embeddings):
+        groups.setdefault(json.dumps(wheres[i], sort_keys=True), []).append((i, embedding))
+
+    backend = get_vector_backend()
+    for group in groups.values():
+        where = wheres[group[0][0]]
+        with timed("vector_query"):
+            response = backend.query(
+                query_embeddings=[embedding for _, embedding in group], n_results=top_k, where=where
+            )
+        for (i, _), metadatas in zip(group, response.get("metadatas") or []):
+            results[i] = metadatas or []
+
+    if RETRIEVAL_MODE == "hybrid":
+        for i in queries:
+            results[i] = fuse_lexical(results[i], pantry_lists[i], top_k, wheres[i])
+    return results
+
 # -----------------------------
 # 5️⃣ Optional test run
 # -----------------------------
 if __name__ == "__main__":
+    import sys
+
+    if "--delta" in sys.argv:
+        # python -m app.utils.vector_db --delta changes.jsonl
+        apply_delta_file(sys.argv[sys.argv.index("--delta") + 1])
+        sys.exit(0)
+
+    if "--substitutions" in sys.argv:
+        # python -m app.utils.vector_db --substitutions (rebuild after editing the overrides file)
+        build_substitution_table()
+        sys.exit(0)
+
+    if "--precompute" in sys.argv:
+        # python -m app.utils.vector_db --precompute
+        print(f"🧑‍🍳 Precomputing base instructions ({PRECOMPUTE_WORKERS} workers)...")
+        print(precompute_base_instructions())
+        sys.exit(0)
+
     # Uncomment below line for first run to populate DB
     add_recipes_from_json()
 
@@ -179,3 +179,438 @@ def test_large_recipe_list():
         result = llm_helper.generate_recipe_instructions(recipes, pantry)
         assert len(result) == 20
         assert all(r["rank"] == "medium" for r in result.values())
+
+# -----------------------------
+# Test: LRU cache eviction, TTL and counters
+# -----------------------------
+def test_lru_cache_eviction_and_ttl():
+    import time
+    from app.utils.cache import LRUCache
+
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+    expiring = LRUCache(maxsize=2, ttl=0.01)
+    expiring.set("a", 1)
+    time.sleep(0.02)
+    assert expiring.get("a") is None
+
+# -----------------------------
+# Test: Inverted ingredient index
+# -----------------------------
+def test_ingredient_index_matching(tmp_path):
+    from app.utils.ingredient_index import IngredientIndex
+
+    index = IngredientIndex.build([
+        {"id": "r-1", "name": "Pasta", "ingredients": "pasta, tomato, Garlic"},
+        {"id": "r-2", "name": "Salad", "ingredients": "tomato, cucumber"},
+    ])
+    pantry_ids = index.pantry_ids([" garlic", "TOMATO", "saffron"])
+
+    assert index.match_count("r-1", pantry_ids) == 2
+    assert index.match_count("r-2", pantry_ids) == 1
+    assert index.match_count("missing", pantry_ids) is None
+    assert [(m["id"], c) for m, c in index.top_overlap(pantry_ids)] == [("r-1", 2), ("r-2", 1)]
+
+    # Replacing a recipe updates the inverted index; save/load round-trips
+    index.add({"id": "r-2", "name": "Salad", "ingredients": "tomato, garlic, cucumber"})
+    path = str(tmp_path / "ingredient_index.json")
+    index.save(path)
+    loaded = IngredientIndex.load(path)
+    assert loaded.match_count("r-2", loaded.pantry_ids(["garlic", "tomato"])) == 2
+    assert len(loaded) == 2
+
+    # Once compacted into the columnar store, the dicts are materialized from it
+    store = loaded.columnar()
+    assert loaded.recipes[1] == store.metadata(1) and loaded.match_count("r-2", pantry_ids) == 2
+    assert [(m["id"], c) for m, c in loaded.top_overlap(pantry_ids)] == [("r-1", 2), ("r-2", 2)]
+    loaded.add({"id": "r-3", "name": "Soup", "ingredients": "garlic"})
+    assert len(loaded) == 3 and loaded.match_count("r-3", pantry_ids) == 1 and len(store) == 2
+
+# -----------------------------
+# Test: ONNX embedder mean-pools and normalizes like SentenceTransformer
+# -----------------------------
+def test_onnx_embedder_pooling(tmp_path):
+    import numpy as np
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import helper, numpy_helper, TensorProto
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from app.utils.embeddings import OnnxEmbedder
+
+    # Toy "transformer": a token-embedding lookup returning (batch, tokens, dim)
+    table = np.array([[0, 0, 0], [1, 0, 0], [0, 2, 0], [0, 0, 3]], dtype=np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])],
+        "toy",
+        [helper.make_tensor_value_info(n, TensorProto.INT64, ["batch", "tokens"])
+         for n in ("input_ids", "attention_mask")],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["batch", "tokens", 3])],
+        [numpy_helper.from_array(table, "table")]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    onnx.save(model, str(tmp_path / "model.onnx"))
+
+    tokenizer = Tokenizer(models.WordLevel({"[PAD]": 0, "egg": 1, "milk": 2, "rice": 3}, unk_token="[PAD]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+
+    embedder = OnnxEmbedder(str(tmp_path / "model.onnx"), str(tmp_path / "tokenizer.json"), threads=1)
+    single = embedder.encode("egg milk")
+    batch = embedder.encode(["egg milk", "rice"], batch_size=1)
+
+    expected = np.array([0.5, 1.0, 0.0]) / np.linalg.norm([0.5, 1.0, 0.0])
+    assert single.shape == (3,)
+    assert np.allclose(single, expected)
+    assert batch.shape == (2, 3)
+    assert np.allclose(batch[0], expected) and np.allclose(batch[1], [0, 0, 1])
+    # Padding tokens are excluded from the mean
+    assert np.allclose(embedder.encode(["egg milk", "egg"])[0], expected)
+
+# -----------------------------
+# Test: LLM enrichment cache is keyed on the missing ingredients
+# -----------------------------
+def test_enrichment_cache_reuses_details(tmp_path):
+    from app.utils.cache import BoundedDiskCache
+
+    recipe = {"id": "r-1", "name": "Omelette", "ingredients": "egg, milk, cheese", "match_score": 2}
+    reply = '{"rank": "high", "instructions": ["Whisk"], "substitutions": []}'
+    cache = BoundedDiskCache(str(tmp_path / "llm.sqlite3"))
+
+    with patch.object(llm_helper, "enrichment_cache", cache), \
+         patch("app.utils.llm_client.LLMClient.chat", return_value=reply) as chat:
+        first = llm_helper.generate_recipe_details(recipe, ["egg", "milk"], diet="vegetarian")
+        # Same missing set ({cheese}) with a different pantry -> served from the cache
+        second = llm_helper.generate_recipe_details(recipe, ["Egg", "milk", "rice"], diet="Vegetarian")
+        assert chat.call_count == 1
+        assert first == second and second["instructions"] == ["Whisk"] and second["match_score"] == 2
+
+        llm_helper.generate_recipe_details(recipe, ["egg"], diet="vegetarian")  # missing {cheese, milk}
+        llm_helper.generate_recipe_details(recipe, ["egg", "milk"], diet="vegan")
+        assert chat.call_count == 3
+
+        # Failures fall back and are never cached
+        chat.side_effect = RuntimeError("ollama down")
+        assert llm_helper.generate_recipe_details(recipe, [], diet="vegetarian")["rank"] == "high"
+        assert len(cache) == 3
+
+        # Replies without usable instructions (or with malformed substitutions) fall back too, uncached
+        chat.side_effect = None
+        for bad in ['{"rank": "high"}', '{"instructions": []}', '{"instructions": ["Mix"], "substitutions": "none"}', '[]']:
+            chat.return_value = bad
+            assert llm_helper.generate_recipe_details(recipe, [], diet="vegetarian")["fallback"] is True
+        assert len(cache) == 3
+        chat.return_value = reply
+
+        # Pre-warming sends the prompt a live request would (max time and servings included)
+        assert llm_helper.prewarm([(recipe, ["egg"], "vegan", None, 20, 4)])["generated"] == 1
+        assert chat.call_args[0][0] == llm_helper.build_prompt(recipe, ["egg"], "vegan", None, 20, 4)
+
+# -----------------------------
+# Test: Bounded disk cache evicts least recently used entries by size
+# -----------------------------
+def test_bounded_disk_cache_eviction(tmp_path):
+    import time
+    from app.utils.cache import BoundedDiskCache
+
+    cache = BoundedDiskCache(str(tmp_path / "bounded.sqlite3"), max_bytes=2500)
+    cache.set("a", "x" * 1000)
+    time.sleep(0.01)
+    cache.set("b", "x" * 1000)
+    time.sleep(0.01)
+    assert cache.get("a") is not None  # "a" is now more recently used than "b"
+    cache.set("c", "x" * 1000)
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] <= 2500
+    # Entries survive reopening the file
+    assert BoundedDiskCache(cache.path, max_bytes=2500).get("c") == "x" * 1000
+
+# -----------------------------
+# Test: One batched prompt is parsed back into per-recipe details
+# -----------------------------
+def test_generate_batch_details(tmp_path):
+    import json
+    from app.utils.cache import BoundedDiskCache
+
+    recipes = [
+        {"id": f"r-{i}", "name": f"Recipe{i}", "ingredients": "egg, milk", "match_score": i} for i in range(3)
+    ]
+    content = {
+        "r0": {"instructions": ["Whisk"], "substitutions": [], "rank": "high"},
+        "r1": {"rank": "low"},  # no instructions -> unusable
+    }
+
+    with patch.object(llm_helper, "enrichment_cache", BoundedDiskCache(str(tmp_path / "llm.sqlite3"))), \
+         patch("app.utils.llm_client.LLMClient.chat", return_value=json.dumps(content)) as chat:
+        results = llm_helper.generate_batch_details(recipes, ["egg"], diet="vegetarian")
+        assert chat.call_count == 1
+        assert results[0]["instructions"] == ["Whisk"] and results[0]["match_score"] == 0
+        assert results[1] is None and results[2] is None
+        prompt = chat.call_args[0][0]
+        assert prompt.count("User Pantry") == 1 and "[r2] Recipe2" in prompt
+
+        # Cached recipes are not sent again
+        llm_helper.generate_batch_details(recipes[:1], ["egg"], diet="vegetarian")
+        assert chat.call_count == 1
+
+# -----------------------------
+# Test: Pooled Ollama client retries, times out and trips its breaker (local stub server)
+# -----------------------------
+@pytest.fixture
+def ollama_stub():
+    """Minimal /api/chat server; each request pops the next scripted behaviour."""
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    script = []
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            hits.append(self.path)
+            action = script.pop(0) if script else ("ok", "{}")
+            if action[0] == "sleep":
+                time.sleep(action[1])
+                action = ("ok", "{}")
+            status = 200 if action[0] == "ok" else int(action[0])
+            body = json.dumps({"model": "stub", "message": {"role": "assistant", "content": action[1]}, "done": True})
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", script, hits
+    server.shutdown()
+
+
+def test_llm_client_against_stub(ollama_stub):
+    import httpx
+    from app.utils.llm_client import LLMClient, CircuitBreaker, CircuitOpenError
+
+    host, script, hits = ollama_stub
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.2)
+    client = LLMClient(host=host, timeout=0.3, retries=1, backoff=0.01, breaker=breaker)
+
+    # Transient 500 is retried on the pooled connection
+    script.extend([("500", ""), ("ok", '{"rank": "high"}')])
+    assert client.chat_json("prompt") == {"rank": "high"}
+    assert len(hits) == 2 and client.stats()["retries"] == 1
+
+    # Two calls that keep timing out open the circuit; the next call fails fast
+    script.extend([("sleep", 0.5)] * 4)
+    for _ in range(2):
+        with pytest.raises(httpx.TimeoutException):
+            client.chat("prompt")
+    assert breaker.state == "open"
+    hits.clear()
+    with pytest.raises(CircuitOpenError):
+        client.chat("prompt")
+    assert hits == []
+
+    # After the reset period one trial call goes through and closes the circuit
+    import time
+    time.sleep(0.6)
+    script.clear()
+    script.append(("ok", '{"rank": "low"}'))
+    assert client.chat_json("prompt") == {"rank": "low"}
+    assert breaker.state == "closed"
+
+    # The caller's deadline caps the attempt and leaves no room for a retry
+    script.extend([("sleep", 0.5)] * 2)
+    hits.clear()
+    start = time.monotonic()
+    with pytest.raises(httpx.TimeoutException):
+        client.chat("prompt", deadline=start + 0.1)
+    assert time.monotonic() - start < 0.25 and len(hits) == 1
+    client.close()
+
+    # No free pooled connection is neither retried nor counted against Ollama
+    import threading
+    pooled = LLMClient(host=host, timeout=1.0, retries=1, backoff=0.01, pool_size=1, breaker=CircuitBreaker())
+    script.clear()
+    script.append(("sleep", 0.6))
+    busy = threading.Thread(target=pooled.chat, args=("prompt",))
+    busy.start()
+    time.sleep(0.1)
+    with pytest.raises(httpx.PoolTimeout):
+        pooled.chat("prompt", deadline=time.monotonic() + 0.2)
+    busy.join()
+    assert pooled.stats()["retries"] == 0 and pooled.breaker.failures == 0
+    pooled.close()
+
+# -----------------------------
+# Test: BM25 keyword search with filters, fused by reciprocal rank
+# -----------------------------
+def test_bm25_search_and_fusion():
+    from app.utils.bm25 import BM25Index, reciprocal_rank_fusion
+
+    metadatas = [
+        {"id": "r-1", "name": "Saffron Rice", "ingredients": "rice, saffron, butter", "tags": "indian", "servings": 2},
+        {"id": "r-2", "name": "Plain Rice", "ingredients": "rice, water", "tags": "vegan", "servings": 2},
+        {"id": "r-3", "name": "Saffron Milk", "ingredients": "milk, saffron", "tags": "Indian, drink", "servings": 4},
+    ]
+    index = BM25Index(metadatas)
+
+    ranked = [m["id"] for m, _ in index.search("saffron rice", limit=3)]
+    assert ranked[0] == "r-1" and set(ranked) == {"r-1", "r-2", "r-3"}
+    assert [m["id"] for m, _ in index.search("saffron", where={"servings": 4})] == ["r-3"]
+    assert [m["id"] for m, _ in index.search("saffron", where={"$and": [{"tag_indian": True}, {"servings": 2}]})] == ["r-1"]
+    assert index.search("chocolate") == []
+
+    vector = [metadatas[1], metadatas[2], metadatas[0]]
+    lexical = [metadatas[2], metadatas[0]]
+    fused = reciprocal_rank_fusion([vector, lexical], limit=2)
+    assert [m["id"] for m in fused] == ["r-3", "r-1"]
+
+# -----------------------------
+# Test: Substitution table from embedding nearest neighbours plus curated overrides
+# -----------------------------
+def test_substitution_table(tmp_path):
+    from app.utils.substitutions import SubstitutionTable
+
+    vocabulary = ["butter", "ghee", "milk", "oat milk", "salt"]
+    embeddings = [[1, 0.1, 0], [1, 0, 0], [0, 1, 0], [0, 1, 0.2], [0, 0, 1]]
+    table = SubstitutionTable.build(vocabulary, embeddings, k=2, min_similarity=0.5,
+                                    overrides={"milk": ["cream"], "salt": []}, version="v1")
+
+    assert table.substitutes("Butter") == ["ghee"]
+    assert table.substitutes("oat milk") == ["milk"]
+    assert table.substitutes("milk") == ["cream"]  # curated override wins
+    assert table.substitutes("salt") == []
+    assert table.suggest("butter, milk, egg", ["egg"]) == ["use ghee instead of butter", "use cream instead of milk"]
+
+    diet_table = SubstitutionTable({"olive oil": ["butter", "ghee", "coconut oil"], "cheese": ["chicken", "tofu"],
+                                    "milk": ["cream", "oat milk"], "egg": ["banana"]})
+    assert diet_table.suggest("olive oil, cheese, milk", [], diets=["vegan"]) == [
+        "use tofu instead of cheese", "use oat milk instead of milk", "use coconut oil instead of olive oil"]
+    assert diet_table.suggest("cheese, egg", [], diets=["", "vegetarian"]) == [
+        "use tofu instead of cheese", "use banana instead of egg"]
+    assert diet_table.suggest("milk", [], diets=["vegan"]) == ["use oat milk instead of milk"]
+    assert SubstitutionTable({"egg": ["yogurt"]}).suggest("egg", [], diets=["vegan"]) == []
+
+    from app.utils.substitutions import substitution_vocabulary
+    assert substitution_vocabulary(["cheese optional", "cheese", "chicken optional", "tofu"]) == ["cheese", "chicken", "tofu"]
+    optional_table = SubstitutionTable({"cheese": ["tofu"], "chicken": ["paneer"]})
+    assert optional_table.suggest("bread, cheese optional, chicken", []) == ["use paneer instead of chicken"]
+
+    table.save(str(tmp_path / "substitutions.json"))
+    loaded = SubstitutionTable.load(str(tmp_path / "substitutions.json"))
+    assert loaded.table == table.table and loaded.version == "v1" and loaded.vocab_hash == table.vocab_hash
+
+# -----------------------------
+# Test: Pre-fork loading fills the shared state without touching Chroma; workers open it and become ready
+# -----------------------------
+def test_serve_load_shared_state():
+    import os
+    from unittest.mock import patch
+    from app.utils import serve, vector_db
+
+    with patch.dict(vector_db.warmup_state, status="pending"), \
+         patch.object(vector_db, "VECTOR_BACKEND", "numpy"), \
+         patch.object(vector_db, "EMBED_BACKEND", "onnx"), \
+         patch.object(vector_db, "get_collection") as collection, \
+         patch.object(vector_db, "get_embed_model") as model, \
+         patch.object(vector_db, "get_ingredient_index") as index, \
+         patch.object(vector_db, "get_substitution_table"), \
+         patch.object(vector_db, "get_vector_backend") as backend:
+        serve.load_shared_state()
+        assert vector_db.warmup_state["status"] == "pending"
+        assert index.call_count == 1 and backend.call_count == 1
+        assert collection.call_count == 0 and model.call_count == 0  # ONNX sessions are created per worker
+
+        # After the fork: the worker opens its own model (and Chroma, when it is the backend)
+        serve.load_worker_state()
+        assert vector_db.warmup_state["status"] == "ready"
+        assert collection.call_count == 0 and model.call_count == 1
+        with patch.object(vector_db, "VECTOR_BACKEND", "chroma"):
+            serve.load_worker_state()
+        assert collection.call_count == 1
+
+    if os.path.exists(f"/proc/{os.getpid()}/smaps_rollup"):
+        usage = serve.memory_usage(os.getpid())
+        assert usage["rss_mb"] >= usage["uss_mb"] > 0
+
+# -----------------------------
+# Test: Columnar recipe store (interned IDs, typed columns, row-based lookups)
+# -----------------------------
+def test_recipe_store_columns():
+    import numpy as np
+    from app.utils.ingredient_index import IngredientIndex
+
+    metadatas = [
+        {"id": "r-1", "name": "Omelette", "ingredients": "Egg, onion", "tags": "Vegetarian, quick",
+         "time_minutes": 10, "servings": 2, "base_instructions": "[]"},
+        {"id": "r-2", "name": "Pancakes", "ingredients": "egg, milk, flour", "tags": "vegetarian",
+         "time_minutes": 20, "servings": 4},
+        {"id": "r-3", "name": "Water", "ingredients": "", "tags": "", "time_minutes": 1, "servings": 1},
+    ]
+    store = IngredientIndex.build(metadatas).columnar()
+
+    assert store.servings.dtype == np.int32 and store.ingredient_ids.dtype == np.int32
+    rows, unknown = store.rows_of([{"id": "r-2"}, {"id": "r-9"}, {"id": "r-3"}, {"id": "r-1"}])
+    assert rows.tolist() == [1, 2, 0] and unknown == [{"id": "r-9"}]
+
+    pantry = store.pantry_ids(["EGG", "milk", "chocolate"])
+    assert store.match_counts(rows, pantry).tolist() == [2, 0, 1]
+    assert store.has_tag(rows, "quick").tolist() == [False, False, True]
+    assert store.has_tag(rows, " vegetarian ").tolist() == [True, False, True]
+
+    overlap, counts = store.top_overlap(pantry, limit=5)
+    assert overlap.tolist() == [1, 0] and counts.tolist() == [2, 1]
+
+    assert store.metadata(0, match_score=1) == dict(metadatas[0], match_score=1)
+    assert "base_instructions" not in store.metadata(1)
+
+# -----------------------------
+# Test: Benchmark catalogs follow the recipes.json schema and reports diff cleanly
+# -----------------------------
+def test_benchmark_catalog_and_report(tmp_path):
+    import json
+    from app.utils import benchmark
+
+    path = benchmark.generate_catalog(200, str(tmp_path / "catalog.jsonl"), seed=1)
+    recipes = [json.loads(line) for line in open(path, encoding="utf-8")]
+    assert len(recipes) == 200
+    assert set(recipes[0]) == {"id", "name", "ingredients", "tags", "time_required", "servings"}
+    assert benchmark.generate_catalog(200, str(tmp_path / "again.jsonl"), seed=1) and \
+        open(tmp_path / "again.jsonl").read() == open(path).read()
+
+    queries = benchmark.generate_queries(path, 20, seed=1)
+    assert len(queries) == 20 and all(q["pantry_items"] and q["servings_required"] for q in queries)
+
+    stats = benchmark.summarize([1.0, 2.0, 3.0, 4.0], wall_seconds=2.0)
+    assert stats["p50_ms"] == 2.5 and stats["throughput_rps"] == 2.0
+    old = {"meta": {"commit": "a"}, "results": [{"stage": "scoring", "concurrency": 1, "p50_ms": 2.0}]}
+    new = {"meta": {"commit": "b"}, "results": [{"stage": "scoring", "concurrency": 1, "p50_ms": 3.0}]}
+    assert benchmark.compare_reports(old, new)["diff"][0]["p50_ms"]["change_pct"] == 50.0
+
+# -----------------------------
+# Test: Exact search ground truth for the HNSW sweep, per distance metric
+# -----------------------------
+def test_benchmark_exact_search():
+    import numpy as np
+    from app.utils import benchmark
+
+    vectors = np.array([[1, 0], [10, 1], [0, 1], [-1, 0]], dtype=np.float32)
+    query = np.array([[1, 0]], dtype=np.float32)
+    assert benchmark.ExactSearch(vectors, "l2").top_k(query, 2).tolist() == [[0, 2]]
+    assert benchmark.ExactSearch(vectors, "cosine").top_k(query, 2).tolist() == [[0, 1]]
+    assert benchmark.ExactSearch(vectors, "ip").top_k(query, 2).tolist() == [[1, 0]]
+    assert benchmark.ExactSearch(vectors, "l2").top_k(np.repeat(query, 100, axis=0), 9, chunk_size=7).shape == (100, 4)
@@ -0,0 +1,428 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+
+from fastapi.testclient import TestClient
+from app import main
+from app.main import RecipeRequest
+from app.utils.ingredient_index import IngredientIndex
+
+
+@pytest.fixture(autouse=True)
+def isolate_main(tmp_path):
+    """
+    Empty response cache, no ingredient index or substitution table unless a test provides one,
+    and an enrichment cache under tmp_path instead of app/cache.
+    """
+    main.response_cache.clear()
+    with patch("app.main.get_ingredient_index", return_value=None), \
+         patch("app.main.get_substitution_table", side_effect=FileNotFoundError), \
+         patch("app.utils.llm_helper.LLM_CACHE_PATH", str(tmp_path / "llm_enrichment.sqlite3")), \
+         patch("app.utils.llm_helper.enrichment_cache", None):
+        yield
+
+
+def make_recipes(n):
+    return [
+        {"name": f"Recipe{i}", "ingredients": "egg, milk", "tags": "vegetarian",
+         "time_minutes": 10, "servings": 2, "match_score": 1}
+        for i in range(n)
+    ]
+
+# -----------------------------
+# Test: Concurrent enrichment keeps input order
+# -----------------------------
+def test_enrich_recipes_keeps_order():
+    def fake_details(recipe, pantry, **kwargs):
+        time.sleep(0.01 * (5 - int(recipe["name"][-1])))
+        return {"instructions": [recipe["name"]], "substitutions": []}
+
+    request = RecipeRequest(pantry_items=["egg"], servings_required=2)
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True):
+        results, all_ok = asyncio.run(main.enrich_recipes(make_recipes(5), request))
+
+    assert [r["instructions"] for r in results] == [[f"Recipe{i}"] for i in range(5)]
+
+# -----------------------------
+# Test: Fan-out is bounded by LLM_CONCURRENCY across requests
+# -----------------------------
+def test_enrich_recipes_bounded_concurrency():
+    from concurrent.futures import ThreadPoolExecutor
+
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def fake_details(recipe, pantry, **kwargs):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+        return {"instructions": ["Step1"], "substitutions": []}
+
+    async def two_requests():
+        return await asyncio.gather(*(main.enrich_recipes(make_recipes(6), request) for _ in range(2)))
+
+    request = RecipeRequest(pantry_items=["egg"], servings_required=2)
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.llm_executor", ThreadPoolExecutor(max_workers=2)), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True):
+        (first, _), (second, _) = asyncio.run(two_requests())
+
+    assert len(first) == len(second) == 6
+    assert state["peak"] <= 2
+
+# -----------------------------
+# Test: Slow recipes fall back after the timeout / deadline
+# -----------------------------
+def test_enrich_recipes_timeout_fallback():
+    def fake_details(recipe, pantry, **kwargs):
+        if recipe["name"] == "Recipe1":
+            time.sleep(0.5)
+        return {"instructions": ["LLM step"], "substitutions": ["milk->soy"]}
+
+    request = RecipeRequest(pantry_items=["egg"], servings_required=2)
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.LLM_TIMEOUT_SECONDS", 0.1), \
+         patch("app.main.LLM_DEADLINE_SECONDS", 0.3), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True):
+        results, all_ok = asyncio.run(main.enrich_recipes(make_recipes(3), request))
+
+    assert not all_ok
+    assert results[0]["instructions"] == ["LLM step"]
+    assert results[1]["substitutions"] == []
+    assert "Prepare Recipe1" in results[1]["instructions"][1]
+    assert results[2]["substitutions"] == ["milk->soy"]
+
+# -----------------------------
+# Test: Streaming endpoint sends candidates first, then details
+# -----------------------------
+def test_recommend_recipes_stream():
+    candidates = make_recipes(2)
+
+    def fake_details(recipe, pantry, **kwargs):
+        return {"instructions": [f"Cook {recipe['name']}"], "substitutions": []}
+
+    with patch("app.main.query_recipes", return_value=candidates), \
+         patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True):
+        response = TestClient(main.app).post(
+            "/recommend-recipes/stream", json={"pantry_items": ["egg"], "servings_required": 2}
+        )
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["type"] == "candidates"
+    assert [r["name"] for r in events[0]["recipes"]] == ["Recipe0", "Recipe1"]
+    details = {e["index"]: e for e in events if e["type"] == "details"}
+    assert details[1]["instructions"] == ["Cook Recipe1"]
+    assert events[-1] == {"type": "done"}
+
+# -----------------------------
+# Test: Identical requests are served from the response cache until the catalog changes
+# -----------------------------
+def test_response_cache_and_invalidation():
+    def fake_details(recipe, pantry, **kwargs):
+        return {"instructions": ["Step1"], "substitutions": []}
+
+    client = TestClient(main.app)
+    with patch("app.main.query_recipes", return_value=make_recipes(2)) as query, \
+         patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True), \
+         patch("app.main.catalog_version", return_value="v1") as version:
+        first = client.post("/recommend-recipes", json={"pantry_items": ["Egg", "milk"], "servings_required": 2})
+        second = client.post("/recommend-recipes", json={"pantry_items": [" milk", "egg "], "servings_required": 2})
+        assert first.json() == second.json()
+        assert query.call_count == 1
+
+        version.return_value = "v2"
+        client.post("/recommend-recipes", json={"pantry_items": ["egg", "milk"], "servings_required": 2})
+        assert query.call_count == 2
+
+# -----------------------------
+# Test: Ingredient index adds exact-overlap recipes the embedding search missed
+# -----------------------------
+def test_find_top_recipes_uses_ingredient_index():
+    vector_hits = [{"id": "r-1", "name": "Omelette", "ingredients": "egg, onion",
+                    "tags": "vegetarian", "time_minutes": 10, "servings": 2}]
+    index = IngredientIndex.build(vector_hits + [
+        {"id": "r-2", "name": "Pancakes", "ingredients": "egg, milk, flour",
+         "tags": "vegetarian", "time_minutes": 20, "servings": 2}
+    ])
+    request = RecipeRequest(pantry_items=["egg", "milk", "flour"], servings_required=2)
+
+    with patch("app.main.query_recipes", return_value=[dict(r) for r in vector_hits]), \
+         patch("app.main.get_ingredient_index", return_value=index):
+        recipes, message = asyncio.run(main.find_top_recipes(request))
+
+    assert message is None
+    assert [(r["name"], r["match_score"]) for r in recipes] == [("Pancakes", 3), ("Omelette", 1)]
+
+# -----------------------------
+# Test: Batch endpoint returns per-item results and errors in input order
+# -----------------------------
+def test_recommend_recipes_batch():
+    def fake_batch(pantry_lists, top_k=5, wheres=None):
+        assert len(pantry_lists) == 2  # one vector search call for all valid requests
+        return [make_recipes(2) if "egg" in items else [] for items in pantry_lists]
+
+    body = [
+        {"pantry_items": ["egg"], "servings_required": 2},
+        {"pantry_items": ["egg"]},
+        {"pantry_items": ["saffron"], "servings_required": 2},
+    ]
+    with patch("app.main.query_recipes_batch", side_effect=fake_batch), \
+         patch("app.main.LLM_AVAILABLE", False):
+        response = TestClient(main.app).post("/recommend-recipes/batch", json=body)
+
+    results = response.json()
+    assert len(results) == 3
+    assert [r["name"] for r in results[0]["recipes"]] == ["Recipe0", "Recipe1"]
+    assert results[1] == {"message": "Please provide at least pantry items and servings."}
+    assert results[2] == {"message": main.NO_RESULTS_MESSAGE}
+
+# -----------------------------
+# Test: /ready reports warm-up state; importing the app doesn't load the model
+# -----------------------------
+def test_ready_after_warm_up():
+    from app.utils import vector_db
+
+    assert vector_db.embed_model is None
+    client = TestClient(main.app)
+    with patch.dict(vector_db.warmup_state, status="pending"):
+        assert client.get("/ready").status_code == 503
+
+        with patch.object(vector_db, "get_collection"), \
+             patch.object(vector_db, "get_embed_model"), \
+             patch.object(vector_db, "get_ingredient_index"), \
+             patch.object(vector_db, "get_substitution_table"), \
+             patch.object(vector_db, "get_vector_backend"):
+            vector_db.warm_up()
+
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+    assert client.get("/health").json()["status"] == "ok"
+
+# -----------------------------
+# Test: Precomputed base instructions skip full LLM enrichment
+# -----------------------------
+def test_enrich_uses_precomputed_instructions():
+    recipes = make_recipes(2)
+    for r in recipes:
+        r.update(content_hash="h", base_instructions_hash="h", base_instructions=json.dumps(["Boil", "Serve"]))
+    recipes[1]["ingredients"] = "egg"  # nothing missing -> no model call at all
+
+    request = RecipeRequest(pantry_items=["egg"], servings_required=2)
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.generate_recipe_details", create=True) as details, \
+         patch("app.main.generate_substitutions", return_value=["oat milk"], create=True) as substitutions:
+        results, all_ok = asyncio.run(main.enrich_recipes(recipes, request))
+
+    assert details.call_count == 0 and substitutions.call_count == 1
+    assert results == [
+        {"instructions": ["Boil", "Serve"], "substitutions": ["oat milk"]},
+        {"instructions": ["Boil", "Serve"], "substitutions": []}
+    ]
+    assert all_ok
+
+# -----------------------------
+# Test: Batch mode uses one LLM call and enriches left-out recipes individually
+# -----------------------------
+def test_enrich_recipes_batch_mode():
+    def fake_batch(recipes, pantry, **kwargs):
+        # The model "forgets" the last recipe
+        return [{"instructions": [f"Batch {r['name']}"], "substitutions": []} for r in recipes[:-1]] + [None]
+
+    def fake_details(recipe, pantry, **kwargs):
+        return {"instructions": [f"Single {recipe['name']}"], "substitutions": []}
+
+    request = RecipeRequest(pantry_items=["egg"], servings_required=2)
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.LLM_ENRICH_MODE", "batch"), \
+         patch("app.main.generate_batch_details", side_effect=fake_batch, create=True) as batch, \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True) as details:
+        results, all_ok = asyncio.run(main.enrich_recipes(make_recipes(3), request))
+
+    assert batch.call_count == 1 and details.call_count == 1
+    assert [r["instructions"] for r in results] == [["Batch Recipe0"], ["Batch Recipe1"], ["Single Recipe2"]]
+    assert all_ok
+
+# -----------------------------
+# Test: /metrics exposes stage latencies, candidate counts and LLM fallbacks
+# -----------------------------
+def test_metrics_endpoint(tmp_path):
+    from app.utils.metrics import registry
+
+    def fake_details(recipe, pantry, **kwargs):
+        if recipe["name"] == "Recipe1":
+            raise RuntimeError("ollama down")
+        return {"instructions": ["Step1"], "substitutions": []}
+
+    registry.clear()
+    client = TestClient(main.app)
+    candidates = make_recipes(3)
+    candidates[2]["servings"] = 4  # filtered out by servings_required
+    with patch("app.main.query_recipes", return_value=candidates), \
+         patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True):
+        client.post("/recommend-recipes", json={"pantry_items": ["egg"], "servings_required": 2})
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert 'recipe_requests_total{endpoint="recommend"} 1' in lines
+    assert 'recipe_llm_fallbacks_total{reason="error"} 1' in lines
+    assert 'recipe_candidates_sum{stage="retrieved"} 3.0' in lines
+    assert 'recipe_candidates_sum{stage="filtered"} 2.0' in lines
+    assert 'recipe_stage_duration_seconds_count{stage="enrichment"} 1' in lines
+    assert 'recipe_stage_duration_seconds_bucket{stage="scoring",le="+Inf"} 1' in lines
+
+    # Scrapes and /stats report the enrichment cache only once it exists; they never create it
+    with patch("app.main.LLM_AVAILABLE", True):
+        assert client.get("/stats").json()["llm_cache"] is None
+    assert not (tmp_path / "llm_enrichment.sqlite3").exists()
+    assert any(line.startswith('recipe_cache_hit_ratio{cache="response"}') for line in lines)
+
+# -----------------------------
+# Test: The substitution table serves recipes without a model call; substitutions the model wrote win
+# -----------------------------
+def test_enrich_uses_substitution_table():
+    from app.utils.substitutions import SubstitutionTable
+
+    table = SubstitutionTable({"milk": ["cream", "yogurt"]})
+    recipes = make_recipes(2)
+    recipes[0].update(content_hash="h", base_instructions_hash="h", base_instructions=json.dumps(["Boil", "Serve"]))
+
+    def fake_details(recipe, pantry, **kwargs):
+        return {"instructions": ["LLM step"], "substitutions": ["use water instead of milk"]}
+
+    request = RecipeRequest(pantry_items=["egg", "yogurt"], servings_required=2)
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.SUBSTITUTIONS_SOURCE", "table"), \
+         patch("app.main.get_substitution_table", return_value=table), \
+         patch("app.main.generate_recipe_details", side_effect=fake_details, create=True) as details, \
+         patch("app.main.generate_substitutions", create=True) as substitutions:
+        results, all_ok = asyncio.run(main.enrich_recipes(recipes, request))
+
+    # Precomputed instructions + table: no model call; the other recipe keeps the model's substitutions
+    assert substitutions.call_count == 0 and details.call_count == 1
+    assert results[0] == {"instructions": ["Boil", "Serve"], "substitutions": ["use yogurt instead of milk"]}
+    assert results[1] == {"instructions": ["LLM step"], "substitutions": ["use water instead of milk"]}
+    assert all_ok
+
+    # The model fell back (or failed): the table fills in
+    fallback = {"instructions": ["Use available ingredients"], "substitutions": [], "fallback": True}
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.SUBSTITUTIONS_SOURCE", "table"), \
+         patch("app.main.get_substitution_table", return_value=table), \
+         patch("app.main.generate_recipe_details", return_value=fallback, create=True):
+        results, all_ok = asyncio.run(main.enrich_recipes(make_recipes(1), request))
+    assert results[0]["substitutions"] == ["use yogurt instead of milk"] and not all_ok
+
+    # Batch mode: the model's substitutions are kept as well
+    def fake_batch(recipes, pantry, **kwargs):
+        return [{"instructions": ["Batch step"], "substitutions": ["use water instead of milk"]} for _ in recipes]
+
+    with patch("app.main.LLM_AVAILABLE", True), \
+         patch("app.main.LLM_ENRICH_MODE", "batch"), \
+         patch("app.main.SUBSTITUTIONS_SOURCE", "table"), \
+         patch("app.main.get_substitution_table", return_value=table), \
+         patch("app.main.generate_batch_details", side_effect=fake_batch, create=True):
+        results, all_ok = asyncio.run(main.enrich_recipes(make_recipes(2), request))
+    assert [r["substitutions"] for r in results] == [["use water instead of milk"]] * 2 and all_ok
+
+# -----------------------------
+# Test: Columnar scoring ranks and filters exactly like the dict-based path
+# -----------------------------
+def test_rank_rows_matches_score_candidates():
+    import random
+
+    rng = random.Random(3)
+    words = ["egg", "milk", "flour", "rice", "tomato", "onion", "Garlic", "butter"]
+    tags = ["vegan", "vegetarian", "indian", "Italian", "quick meal"]
+    metadatas = [
+        {"id": f"r-{i}", "name": f"Recipe{i}", "ingredients": ", ".join(rng.sample(words, rng.randint(0, 4))),
+         "tags": ", ".join(rng.sample(tags, rng.randint(0, 3))), "time_minutes": rng.choice([10, 20]),
+         "servings": rng.choice([2, 4])}
+        for i in range(200)
+    ]
+    index = IngredientIndex.build(metadatas)
+    requests = [
+        RecipeRequest(pantry_items=["egg", "garlic"], servings_required=2),
+        RecipeRequest(pantry_items=["rice", "tomato", "onion"], servings_required=4, time_available=20, diet="vegan"),
+        RecipeRequest(pantry_items=["milk"], servings_required=2, cuisine="italian", diet="quick  meal"),
+    ]
+    with patch("app.main.RETRIEVAL_MODE", "hybrid"):  # no overlap merge: same candidates for both paths
+        for request in requests:
+            columnar, _ = main.rank_candidates(request, [dict(m) for m in metadatas[:120]], index)
+            legacy, _ = main.rank_candidates(request, [dict(m) for m in metadatas[:120]], None)
+            assert [(r["id"], r["match_score"]) for r in columnar] == [(r["id"], r["match_score"]) for r in legacy]
+            assert columnar == legacy
+
+# -----------------------------
+# Test: Diet and cuisine match whole tags (case and spacing ignored), not substrings
+# -----------------------------
+def test_diet_and_cuisine_match_whole_tags():
+    metadatas = [
+        {"id": "r-0", "name": "Dal", "ingredients": "lentils, rice", "tags": " Vegetarian ,South  Indian",
+         "time_minutes": 20, "servings": 2},
+        {"id": "r-1", "name": "Curry", "ingredients": "chicken, rice", "tags": "non-vegetarian, south indian",
+         "time_minutes": 20, "servings": 2},
+        {"id": "r-2", "name": "Salad", "ingredients": "lettuce, rice", "tags": "vegan",
+         "time_minutes": 20, "servings": 2},
+    ]
+    index = IngredientIndex.build(metadatas)
+    cases = [
+        (RecipeRequest(pantry_items=["rice"], servings_required=2, diet="vegetarian"), ["r-0"]),
+        (RecipeRequest(pantry_items=["rice"], servings_required=2, diet=" VEGETARIAN "), ["r-0"]),
+        (RecipeRequest(pantry_items=["rice"], servings_required=2, diet="veg"), []),
+        (RecipeRequest(pantry_items=["rice"], servings_required=2, cuisine="south indian"), ["r-0", "r-1"]),
+        (RecipeRequest(pantry_items=["rice"], servings_required=2, cuisine="indian"), []),
+    ]
+    with patch("app.main.RETRIEVAL_MODE", "hybrid"):
+        for request, expected in cases:
+            assert [r["id"] for r in main.score_candidates([dict(m) for m in metadatas], request)] == expected
+            columnar, _ = main.rank_candidates(request, [dict(m) for m in metadatas], index)
+            assert [r["id"] for r in columnar] == expected
+
+# -----------------------------
+# Test: Catalog endpoints pass changes to update_catalog (and check the token)
+# -----------------------------
+def test_catalog_update_endpoints():
+    calls = []
+
+    def fake_update(upserts=(), deletes=()):
+        calls.append((list(upserts), list(deletes)))
+        return {"written": len(upserts), "unchanged": 0, "deleted": int(deletes == ["r-1"]), "version": "v2"}
+
+    client = TestClient(main.app)
+    recipe = {"name": "Soup", "ingredients": ["leek", "potato"], "tags": ["vegan"], "time_required": 30}
+    with patch("app.main.update_catalog", side_effect=fake_update), \
+         patch("app.main.CATALOG_API_TOKEN", "secret"):
+        assert client.post("/recipes", json=[dict(recipe, id="r-1")]).status_code == 401
+
+        headers = {"X-Catalog-Token": "secret"}
+        response = client.post("/recipes", json=[dict(recipe, id="r-1")], headers=headers)
+        assert response.status_code == 200 and response.json()["version"] == "v2"
+        assert client.post("/recipes", json=[recipe], headers=headers).status_code == 422
+        assert client.post("/recipes", json=[dict(recipe, id="r-5")] * 2, headers=headers).status_code == 422
+        assert client.put("/recipes/r-2", json=recipe, headers=headers).status_code == 200
+        assert client.put("/recipes/r-2", json=dict(recipe, id="r-3"), headers=headers).status_code == 422
+        assert client.delete("/recipes/r-1", headers=headers).status_code == 200
+        assert client.delete("/recipes/r-404", headers=headers).status_code == 404
+
+    # Without a token the write endpoints are disabled
+    with patch("app.main.update_catalog", side_effect=fake_update):
+        assert client.post("/recipes", json=[dict(recipe, id="r-1")]).status_code == 503
+    assert len(calls) == 4
+
+    assert calls[0][0][0]["id"] == "r-1" and calls[0][0][0]["servings"] == 1
+    assert calls[1][0][0]["id"] == "r-2"
+    assert calls[2] == ([], ["r-1"])
@@ -0,0 +1,459 @@
+import io
+import json
+import uuid
+import numpy as np
+import pytest
+from unittest.mock import patch, MagicMock
+
+chromadb = pytest.importorskip("chromadb")
+
+from app.utils import vector_db
+
+
+def make_recipe(i, servings=2, tags=("vegetarian",)):
+    return {
+        "id": f"r-{i}", "name": f"Recipe{i}", "ingredients": ["egg", "milk"],
+        "tags": list(tags), "time_required": 10, "servings": servings
+    }
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Isolated in-memory collection + fake embedding model."""
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(name=f"test-{uuid.uuid4().hex}")
+    embed_model = MagicMock()
+    embed_model.encode.side_effect = lambda texts, **kwargs: (
+        np.ones(3, dtype=np.float32) if isinstance(texts, str) else np.ones((len(texts), 3), dtype=np.float32)
+    )
+
+    with patch.object(vector_db, "client", client), \
+         patch.object(vector_db, "collection", collection), \
+         patch.object(vector_db, "embed_model", embed_model), \
+         patch.object(vector_db, "CATALOG_VERSION_PATH", str(tmp_path / "catalog_version")), \
+         patch.object(vector_db, "CATALOG_LOCK_PATH", str(tmp_path / "catalog.lock")), \
+         patch.object(vector_db, "INGREDIENT_INDEX_PATH", str(tmp_path / "ingredient_index.json")), \
+         patch.object(vector_db, "_ingredient_index", None):
+        yield collection, embed_model
+
+# -----------------------------
+# Test: Batched ingestion writes every recipe
+# -----------------------------
+def test_ingest_recipes_batches(temp_db):
+    collection, embed_model = temp_db
+    stats = vector_db.ingest_recipes([make_recipe(i) for i in range(5)], batch_size=2)
+
+    assert collection.count() == 5
+    assert stats["written"] == 5 and stats["skipped"] == 0
+    assert embed_model.encode.call_count == 3  # 2 + 2 + 1
+
+# -----------------------------
+# Test: Rerun only re-embeds changed recipes
+# -----------------------------
+def test_ingest_recipes_idempotent(temp_db):
+    collection, embed_model = temp_db
+    recipes = [make_recipe(i) for i in range(3)]
+    vector_db.ingest_recipes(recipes)
+
+    recipes[1] = dict(make_recipe(1), name="Renamed")
+    embed_model.encode.reset_mock()
+    stats = vector_db.ingest_recipes(recipes)
+
+    assert stats["written"] == 1 and stats["skipped"] == 2
+    assert collection.count() == 3
+    assert collection.get(ids=["r-1"])["metadatas"][0]["name"] == "Renamed"
+    assert len(embed_model.encode.call_args[0][0]) == 1
+
+# -----------------------------
+# Test: Streaming reader handles JSON arrays and JSON Lines
+# -----------------------------
+def test_iter_recipes_formats(tmp_path):
+    recipes = [make_recipe(i) for i in range(50)]
+    array_path = tmp_path / "recipes.json"
+    array_path.write_text(json.dumps(recipes, indent=2))
+    lines_path = tmp_path / "recipes.jsonl"
+    lines_path.write_text("\n".join(json.dumps(r) for r in recipes) + "\n")
+
+    assert list(vector_db.iter_recipes(str(array_path))) == recipes
+    assert list(vector_db.iter_recipes(str(lines_path))) == recipes
+    # Tiny chunks force elements to be split across reads
+    assert list(vector_db.iter_json_array(io.StringIO(json.dumps(recipes)), chunk_size=7)) == recipes
+
+# -----------------------------
+# Test: Ingestion resumes from the checkpoint after a crash
+# -----------------------------
+def test_ingest_recipes_resume(temp_db, tmp_path):
+    collection, embed_model = temp_db
+    recipes = [make_recipe(i) for i in range(6)]
+    checkpoint = str(tmp_path / "recipes.json.checkpoint")
+
+    def crash_after_four():
+        for i, recipe in enumerate(recipes):
+            if i == 4:
+                raise RuntimeError("crash")
+            yield recipe
+
+    with pytest.raises(RuntimeError):
+        vector_db.ingest_recipes(crash_after_four(), batch_size=2, checkpoint_path=checkpoint)
+    assert vector_db.load_checkpoint(checkpoint) == 4
+
+    stats = vector_db.ingest_recipes(iter(recipes), batch_size=2, checkpoint_path=checkpoint)
+    assert stats["resumed_from"] == 4 and stats["total"] == 2
+    assert collection.count() == 6
+    assert not (tmp_path / "recipes.json.checkpoint").exists()
+
+# -----------------------------
+# Test: Query embeddings are cached on the normalized pantry set
+# -----------------------------
+def test_embed_query_cache(temp_db, tmp_path):
+    from app.utils.cache import LRUCache, DiskCache
+
+    collection, embed_model = temp_db
+    embed_model.encode.side_effect = lambda text, **kwargs: np.ones(3, dtype=np.float32)
+    shared = DiskCache(str(tmp_path / "embeddings.sqlite3"))
+
+    with patch.object(vector_db, "embedding_cache", LRUCache(maxsize=8)), \
+         patch.object(vector_db, "shared_embedding_cache", shared):
+        vector_db.embed_query(["Tomato", "garlic"])
+        vector_db.embed_query([" garlic ", "TOMATO", "tomato"])
+        assert embed_model.encode.call_count == 1
+        assert embed_model.encode.call_args[0][0] == "garlic tomato"
+        assert vector_db.embedding_cache_stats()["memory"]["hits"] == 1
+
+    # A fresh worker (empty memory tier) reuses the shared on-disk embedding
+    with patch.object(vector_db, "embedding_cache", LRUCache(maxsize=8)), \
+         patch.object(vector_db, "shared_embedding_cache", DiskCache(shared.path)):
+        assert vector_db.embed_query(["garlic", "tomato"]) == [1.0, 1.0, 1.0]
+        assert embed_model.encode.call_count == 1
+
+        # ...but not one computed by a different embedding model
+        with patch.object(vector_db, "EMBED_MODEL_NAME", "other-model"):
+            vector_db.embed_query(["garlic", "tomato"])
+        assert embed_model.encode.call_count == 2
+    assert vector_db.embedding_key(["a|b"]) != vector_db.embedding_key(["a", "b"])
+
+# -----------------------------
+# Test: Catalog version changes only when ingestion writes
+# -----------------------------
+def test_catalog_version_bumped_on_write(temp_db):
+    assert vector_db.catalog_version() == "0"
+    vector_db.ingest_recipes([make_recipe(1)])
+    version = vector_db.catalog_version()
+    assert version != "0"
+
+    vector_db.ingest_recipes([make_recipe(1)])  # unchanged -> no write
+    assert vector_db.catalog_version() == version
+
+# -----------------------------
+# Test: Ingestion rebuilds the ingredient index for the new catalog version
+# -----------------------------
+def test_ingestion_builds_ingredient_index(temp_db):
+    vector_db.ingest_recipes([make_recipe(i) for i in range(3)], batch_size=2)
+    index = vector_db.get_ingredient_index()
+
+    assert len(index) == 3
+    assert index.version == vector_db.catalog_version()
+    assert index.match_count("r-0", index.pantry_ids(["milk", "egg"])) == 2
+
+# -----------------------------
+# Test: Filters are pushed down into the Chroma query
+# -----------------------------
+def test_query_recipes_where_filters(temp_db):
+    vector_db.ingest_recipes([
+        make_recipe(1, servings=2, tags=["vegan", "Indian"]),
+        make_recipe(2, servings=4, tags=["vegan", "indian"]),
+        make_recipe(3, servings=2, tags=["vegetarian", "italian"]),
+    ])
+
+    where = vector_db.build_where(servings=2, time_minutes=10, tags=["Vegan", "indian"])
+    results = vector_db.query_recipes(["egg"], top_k=50, where=where)
+    assert [r["id"] for r in results] == ["r-1"]
+    assert vector_db.build_where() is None
+
+# -----------------------------
+# Test: Tag filters are used once an ingestion run has flagged the whole catalog
+# -----------------------------
+def test_tag_filter_marker(temp_db):
+    collection, embed_model = temp_db
+    # Recipe stored before tags became flags
+    collection.add(ids=["r-0"], embeddings=[[1.0, 1.0, 1.0]], metadatas=[{"id": "r-0", "tags": "vegan"}])
+
+    vector_db.ingest_recipes([make_recipe(1, tags=["vegan"])])
+    assert not vector_db.supports_tag_filters()
+    assert vector_db.build_where(tags=["vegan"]) is None
+
+    vector_db.ingest_recipes([make_recipe(0, tags=["vegan"]), make_recipe(1, tags=["vegan"])])
+    assert collection.metadata[vector_db.TAG_FLAGS_MARKER] is True
+    assert vector_db.build_where(tags=["vegan"]) == {"tag_vegan": True}
+
+# -----------------------------
+# Test: Metadata-only changes skip re-embedding and drop removed tags
+# -----------------------------
+def test_metadata_only_update(temp_db):
+    collection, embed_model = temp_db
+    recipe = make_recipe(1, tags=["vegan"])
+    vector_db.ingest_recipes([recipe])
+
+    recipe["servings"] = 6
+    embed_model.encode.reset_mock()
+    vector_db.ingest_recipes([recipe])
+    assert embed_model.encode.call_count == 0
+    assert collection.get(ids=["r-1"])["metadatas"][0]["servings"] == 6
+
+    recipe["tags"] = ["vegetarian"]
+    vector_db.ingest_recipes([recipe])
+    metadata = collection.get(ids=["r-1"])["metadatas"][0]
+    assert metadata["tag_vegetarian"] is True and "tag_vegan" not in metadata
+
+# -----------------------------
+# Test: NumPy snapshot backend matches Chroma results
+# -----------------------------
+def test_numpy_backend_matches_chroma(temp_db, tmp_path):
+    from app.utils.numpy_backend import NumpyVectorStore
+
+    collection, _ = temp_db
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(30, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    recipes = [make_recipe(i, servings=2 + i % 2, tags=["vegan"] if i % 3 else ["vegetarian"]) for i in range(30)]
+    collection.add(
+        ids=[r["id"] for r in recipes],
+        metadatas=[vector_db.recipe_metadata(r) for r in recipes],
+        embeddings=vectors.tolist()
+    )
+
+    NumpyVectorStore.export(collection, str(tmp_path / "numpy_index"), version="v1", page_size=7)
+    store = NumpyVectorStore(str(tmp_path / "numpy_index"))
+    assert store.count() == 30 and store.version == "v1"
+
+    query = vectors[5] + 0.1
+    expected = collection.query(query_embeddings=[query.tolist()], n_results=5)["ids"][0]
+    assert store.query(query_embeddings=[query], n_results=5)["ids"][0] == expected
+
+    where = {"$and": [{"servings": 3}, {"tag_vegan": True}]}
+    result = store.query(query_embeddings=[query], n_results=50, where=where)
+    assert result["ids"][0] and all(
+        m["servings"] == 3 and "vegan" in m["tags"] for m in result["metadatas"][0]
+    )
+    assert sorted(result["ids"][0]) == sorted(collection.get(where=where)["ids"])
+
+# -----------------------------
+# Test: Batched queries encode all pantries in one call
+# -----------------------------
+def test_query_recipes_batch(temp_db):
+    collection, embed_model = temp_db
+    vector_db.ingest_recipes([make_recipe(1, servings=2), make_recipe(2, servings=4)])
+    embed_model.encode.reset_mock()
+
+    with patch.object(vector_db, "embedding_cache", vector_db.LRUCache(maxsize=8)):
+        results = vector_db.query_recipes_batch(
+            [["egg"], [], ["milk"], ["Egg "]], top_k=5,
+            wheres=[{"servings": 2}, None, {"servings": 4}, {"servings": 2}]
+        )
+
+    assert embed_model.encode.call_count == 1
+    assert sorted(embed_model.encode.call_args[0][0]) == ["egg", "milk"]
+    assert [[r["id"] for r in recipes] for recipes in results] == [["r-1"], [], ["r-2"], ["r-1"]]
+
+# -----------------------------
+# Test: Concurrent query embeddings are micro-batched into one model call
+# -----------------------------
+def test_embed_query_micro_batching(temp_db):
+    import threading
+    from app.utils.batching import MicroBatcher
+
+    collection, embed_model = temp_db
+    batcher = MicroBatcher(lambda texts: embed_model.encode(texts), max_batch_size=16, max_wait_ms=200)
+    barrier = threading.Barrier(6)
+    results = {}
+
+    def worker(i):
+        barrier.wait()
+        results[i] = vector_db.embed_query([f"item-{i % 5}"])  # two callers share a pantry
+
+    with patch.object(vector_db, "embedding_cache", vector_db.LRUCache(maxsize=0)), \
+         patch.object(vector_db, "embedding_batcher", batcher):
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert embed_model.encode.call_count == 1
+    assert sorted(embed_model.encode.call_args[0][0]) == [f"item-{i}" for i in range(5)]
+    assert all(results[i] == [1.0, 1.0, 1.0] for i in range(6))
+    stats = batcher.stats()
+    assert stats["batch_size"]["count"] == 1 and stats["batch_size"]["sum"] == 5
+    assert stats["wait_ms"]["count"] == 6
+
+# -----------------------------
+# Test: Base instructions are precomputed once, resumably, and dropped when a recipe changes
+# -----------------------------
+def test_precompute_base_instructions(temp_db):
+    collection, _ = temp_db
+    recipes = [make_recipe(i) for i in range(4)]
+    vector_db.ingest_recipes(recipes)
+    version = vector_db.catalog_version()
+    calls = []
+
+    def flaky(metadata):
+        calls.append(metadata["id"])
+        if metadata["id"] == "r-2" and calls.count("r-2") == 1:
+            raise RuntimeError("model timeout")
+        return [f"Cook {metadata['name']}"]
+
+    stats = vector_db.precompute_base_instructions(generate=flaky, workers=2, batch_size=2)
+    assert stats["generated"] == 3 and stats["failed"] == 1
+    assert vector_db.catalog_version() != version
+    assert vector_db.get_ingredient_index().recipes[0].get("base_instructions")
+
+    # Rerun only retries the failed recipe
+    stats = vector_db.precompute_base_instructions(generate=flaky, workers=2)
+    assert stats["generated"] == 1 and stats["skipped"] == 3
+    metadata = collection.get(ids=["r-2"])["metadatas"][0]
+    assert vector_db.base_instructions(metadata) == ["Cook Recipe2"]
+
+    # Re-ingesting a changed recipe invalidates its instructions
+    recipes[1]["name"] = "Renamed"
+    vector_db.ingest_recipes(recipes)
+    assert vector_db.base_instructions(collection.get(ids=["r-1"])["metadatas"][0]) is None
+    assert vector_db.base_instructions(collection.get(ids=["r-0"])["metadatas"][0]) == ["Cook Recipe0"]
+
+# -----------------------------
+# Test: Hybrid retrieval fuses BM25 matches into the vector results
+# -----------------------------
+def test_query_recipes_hybrid(temp_db):
+    recipes = [dict(make_recipe(i), ingredients=["rice", f"spice{i}"]) for i in range(6)]
+    recipes[4]["ingredients"] = ["saffron", "rice"]
+    vector_db.ingest_recipes(recipes)
+
+    with patch.object(vector_db, "_lexical_index", None), \
+         patch.object(vector_db, "RETRIEVAL_MODE", "hybrid"):
+        results = vector_db.query_recipes(["Saffron"], top_k=2, where={"servings": 2})
+        batch = vector_db.query_recipes_batch([["saffron"]], top_k=2, wheres=[None])
+
+    # The only keyword match makes the top 2 whatever the vector ranking (all embeddings are equal here)
+    assert "r-4" in [r["id"] for r in results] and len(results) == 2
+    assert "r-4" in [r["id"] for r in batch[0]]
+
+# -----------------------------
+# Test: Substitution table is built once and survives version bumps with the same vocabulary
+# -----------------------------
+def test_substitution_table_reused_across_versions(temp_db, tmp_path):
+    _, embed_model = temp_db
+    recipes = [make_recipe(0), dict(make_recipe(1), ingredients=["egg", "oat milk"])]
+    vector_db.ingest_recipes(recipes)
+
+    with patch.object(vector_db, "SUBSTITUTIONS_PATH", str(tmp_path / "substitutions.json")), \
+         patch.object(vector_db, "SUBSTITUTION_OVERRIDES_PATH", ""), \
+         patch.object(vector_db, "_substitution_table", None), \
+         patch.object(vector_db, "EMBED_BATCHING", False):
+        embed_model.encode.reset_mock()
+        table = vector_db.get_substitution_table()
+        assert embed_model.encode.call_count == 1  # whole vocabulary in one call
+        assert table.substitutes("milk")  # identical fake embeddings: everything is a neighbour
+
+        vector_db.bump_catalog_version()
+        vector_db._substitution_table = None
+        embed_model.encode.reset_mock()
+        assert vector_db.get_substitution_table().version == vector_db.catalog_version()
+        assert embed_model.encode.call_count == 0
+
+# -----------------------------
+# Test: Catalog updates patch the derived indexes instead of rebuilding them
+# -----------------------------
+def test_update_catalog_incremental(temp_db, tmp_path):
+    from app.utils.numpy_backend import NumpyVectorStore
+
+    collection, embed_model = temp_db
+    with patch.object(vector_db, "VECTOR_BACKEND", "numpy"), \
+         patch.object(vector_db, "NUMPY_INDEX_DIR", str(tmp_path / "numpy_index")), \
+         patch.object(vector_db, "_numpy_store", None), \
+         patch.object(vector_db, "SUBSTITUTIONS_SOURCE", "llm"):
+        vector_db.ingest_recipes([make_recipe(i) for i in range(4)])
+
+        embed_model.encode.reset_mock()
+        with patch.object(vector_db, "build_ingredient_index", wraps=vector_db.build_ingredient_index) as rebuild, \
+             patch.object(vector_db, "build_numpy_index", wraps=vector_db.build_numpy_index) as export:
+            stats = vector_db.update_catalog(
+                upserts=[dict(make_recipe(1), ingredients=["saffron", "rice"]), make_recipe(2), make_recipe(9)],
+                deletes=["r-0", "r-404"]
+            )
+        assert (stats["written"], stats["unchanged"], stats["deleted"]) == (2, 1, 1)
+        assert stats["version"] == vector_db.catalog_version()
+        assert embed_model.encode.call_count == 1  # r-1 and r-9 only
+        rebuild.assert_not_called()
+        export.assert_not_called()
+
+        index = vector_db.get_ingredient_index()
+        assert sorted(index.rows) == ["r-1", "r-2", "r-3", "r-9"]
+        assert index.match_count("r-1", index.pantry_ids(["saffron"])) == 1
+        assert index.match_count("r-2", index.pantry_ids(["saffron"])) == 0
+
+        ids = [r["id"] for r in vector_db.query_recipes(["egg"], top_k=10)]
+        assert sorted(ids) == ["r-1", "r-2", "r-3", "r-9"]
+        reloaded = NumpyVectorStore(str(tmp_path / "numpy_index"))  # e.g. another worker
+        assert reloaded.version == stats["version"] and reloaded.count() == 4
+
+        # Delta file: the last operation per recipe wins
+        delta_path = tmp_path / "delta.jsonl"
+        delta_path.write_text("\n".join(json.dumps(op) for op in [
+            {"op": "delete", "id": "r-9"}, make_recipe(0), {"op": "upsert", "recipe": make_recipe(9, servings=3)},
+            {"op": "delete", "id": "r-3"}
+        ]))
+        stats = vector_db.apply_delta_file(str(delta_path))
+        assert (stats["written"], stats["deleted"]) == (2, 1)
+        assert sorted(collection.get()["ids"]) == ["r-0", "r-1", "r-2", "r-9"]
+        results = vector_db.query_recipes(["egg"], top_k=10, where={"servings": 3})
+        assert [r["id"] for r in results] == ["r-9"]
+
+# -----------------------------
+# Test: Catalog writers wait for a lock held by another process
+# -----------------------------
+def test_catalog_write_lock_across_processes(tmp_path):
+    if vector_db.fcntl is None:
+        pytest.skip("flock is POSIX-only")
+    import subprocess
+    import sys
+    import threading
+
+    lock_path = str(tmp_path / "catalog.lock")
+    holder = subprocess.Popen([sys.executable, "-c", (
+        "import fcntl, sys, time\n"
+        f"f = open({lock_path!r}, 'a'); fcntl.flock(f, fcntl.LOCK_EX)\n"
+        "print('locked', flush=True); time.sleep(0.5)"
+    )], stdout=subprocess.PIPE, text=True)
+    assert holder.stdout.readline().strip() == "locked"
+
+    entered = threading.Event()
+
+    def writer():
+        with vector_db.catalog_write_lock():
+            entered.set()
+
+    with patch.object(vector_db, "CATALOG_LOCK_PATH", lock_path):
+        thread = threading.Thread(target=writer)
+        thread.start()
+        assert not entered.wait(0.2)
+        holder.wait()
+        thread.join(5)
+    assert entered.is_set()
+
+# -----------------------------
+# Test: HNSW settings are applied to new collections; search ef also to existing ones
+# -----------------------------
+def test_open_collection_hnsw_settings():
+    client = chromadb.EphemeralClient()
+    name = f"test-{uuid.uuid4().hex}"
+    configuration = vector_db.hnsw_configuration("cosine", m=8, construction_ef=50, search_ef=20)
+    collection = vector_db.open_collection(client, name, configuration)
+    assert {k: collection.configuration["hnsw"][k] for k in ("space", "max_neighbors", "ef_construction", "ef_search")} \
+        == {"space": "cosine", "max_neighbors": 8, "ef_construction": 50, "ef_search": 20}
+
+    reopened = vector_db.open_collection(client, name, vector_db.hnsw_configuration("l2", m=8, construction_ef=50, search_ef=64))
+    hnsw = client.get_collection(name).configuration["hnsw"]
+    assert hnsw["ef_search"] == 64 and hnsw["space"] == "cosine"  # the metric is fixed at creation
+    assert reopened.name == name
+
+    with pytest.raises(ValueError):
+        vector_db.hnsw_configuration("manhattan")